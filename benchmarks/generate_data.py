@@ -0,0 +1,307 @@
+# encoding: UTF-8
+
+# Copyright (c) 2019-2020 Japan Network Information Center ("JPNIC")
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute and/or sublicense of
+# the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# ベンチマーク用のRIBとVRPsのファイルを作る
+# 乱数の種を固定しているので、同じ規模を指定すれば毎回同じファイルができる (ネットワークもroutinatorも使わない)
+# 実際のフルルートに近づけるため、次のようにしている
+#   * IPv4とIPv6のプレフィックス長の分布はおおよそ実際のBGPの経路表のもの。IPv6は経路の17%くらい
+#   * 経路の2割は他の経路のより長いprefix(more-specific)で、1%くらいのprefixは複数のASが広告している(MOAS)
+#   * 1つのASが広告するprefixの数は偏らせる(少数のASがたくさん広告する)。4バイトASNも混ぜる
+#   * VRPは経路の半分くらいに対して作り、ほとんどはVALIDになるが、他のASのものやmaxLengthが足りないもの、AS0のものも混ぜる
+# BGPのUPDATEの記録(MRTのBGP4MP)も作れる (updatesサブコマンドのベンチマーク用)
+#   * 経路と同じ数のUPDATEを、何人かのピアから受け取ったことにする。ほとんどは既存の経路の広告し直しか取り消しで、
+#     新しいmore-specificの広告や、別のASからの広告(ハイジャックかもしれないもの)、セッションの切断も混ぜる
+#
+# 使い方: python benchmarks/generate_data.py 100k /tmp/roamon-bench [--updates]
+
+import argparse
+import os
+import random
+import socket
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from roamon_verify_index import format_prefix
+from roamon_verify_mrt import write_rib_file
+from roamon_verify_vrps import write_vrps_file
+
+# 規模の名前と経路の数
+SCALES = {"10k": 10000, "100k": 100000, "1m": 1000000}
+
+SEED = 20200301
+
+# プレフィックス長の分布 {プレフィックス長: 重み}
+IPV4_PREFIXLEN_WEIGHTS = {24: 600, 23: 90, 22: 110, 21: 50, 20: 50, 19: 30, 18: 20, 17: 10, 16: 30,
+                          15: 3, 14: 2, 13: 1, 12: 1, 11: 1, 10: 1, 8: 1}
+IPV6_PREFIXLEN_WEIGHTS = {48: 550, 47: 20, 46: 20, 44: 60, 40: 60, 36: 30, 33: 10, 32: 200, 29: 40, 28: 10}
+IPV6_SHARE = 0.17
+MORE_SPECIFIC_SHARE = 0.2
+MOAS_SHARE = 0.01
+# ASあたりの経路の数の平均
+ROUTES_PER_ASN = 12
+# VRPを作る経路の割合
+ROA_COVERAGE = 0.5
+# UPDATEを送ってくるピアの数
+N_PEERS = 16
+# UPDATEの種類の分布 {種類: 重み}
+UPDATE_KIND_WEIGHTS = {"reannounce": 6000, "withdraw": 2500, "more_specific": 900, "other_origin": 599, "peer_down": 1}
+
+
+# 重み付きの表から選ぶ関数を作る
+def _weighted_chooser(rng, weights):
+    values = list(weights)
+    cumulative = []
+    total = 0
+    for value in values:
+        total += weights[value]
+        cumulative.append(total)
+    return lambda: rng.choices(values, cum_weights=cumulative)[0]
+
+
+# ASNの番号を実際のASNにする。3割くらいは4バイトASN
+def _asn_of(idx):
+    if idx % 10 < 3:
+        return 131072 + idx
+    return 1 + idx % 64000
+
+
+# 経路を作る。{(IPバージョン, ネットワークアドレスの整数, プレフィックス長): [Origin AS, ...]} を返す
+def generate_routes(n_routes, seed=SEED):
+    rng = random.Random(seed)
+    choose_v4_prefixlen = _weighted_chooser(rng, IPV4_PREFIXLEN_WEIGHTS)
+    choose_v6_prefixlen = _weighted_chooser(rng, IPV6_PREFIXLEN_WEIGHTS)
+    n_asns = max(1, n_routes // ROUTES_PER_ASN)
+
+    routes = {}
+    prefix_list = []
+    while len(prefix_list) < n_routes:
+        # 一部のASがたくさんの経路を広告するように、小さい番号ほど選ばれやすくする
+        origin_asn = _asn_of(int(n_asns * rng.random() ** 3))
+        if prefix_list and rng.random() < MORE_SPECIFIC_SHARE:
+            # 既存の経路のmore-specific。半分以上は元と同じASが広告する
+            version, network_int, prefixlen = rng.choice(prefix_list)
+            max_prefixlen = 24 if version == 4 else 48
+            if prefixlen >= max_prefixlen:
+                continue
+            width = 32 if version == 4 else 128
+            new_prefixlen = min(max_prefixlen, prefixlen + rng.choice([1, 2, 4, 8]))
+            network_int |= rng.getrandbits(new_prefixlen - prefixlen) << (width - new_prefixlen)
+            prefixlen = new_prefixlen
+            if rng.random() < 0.7:
+                origin_asn = routes[rng.choice(prefix_list)][0]
+        elif rng.random() < IPV6_SHARE:
+            # グローバルユニキャスト(2000::/3)の中から
+            version, prefixlen = 6, choose_v6_prefixlen()
+            network_int = (0b001 << 125) | (rng.getrandbits(prefixlen - 3) << (128 - prefixlen))
+        else:
+            # 1.0.0.0から223.255.255.255の中から
+            version, prefixlen = 4, choose_v4_prefixlen()
+            network_int = rng.randrange(1 << 24, 224 << 24) >> (32 - prefixlen) << (32 - prefixlen)
+
+        key = (version, network_int, prefixlen)
+        if key in routes:
+            continue
+        routes[key] = [origin_asn]
+        prefix_list.append(key)
+        if rng.random() < MOAS_SHARE:
+            routes[key].append(_asn_of(rng.randrange(n_asns)))
+    return routes
+
+
+# 経路に対してVRPを作る。[(prefix文字列, ASN, maxLength), ...] を返す
+def generate_vrps(routes, seed=SEED):
+    rng = random.Random(seed + 1)
+    vrps = set()
+    for (version, network_int, prefixlen), origins in routes.items():
+        if rng.random() >= ROA_COVERAGE:
+            continue
+        width = 32 if version == 4 else 128
+        max_prefixlen = 24 if version == 4 else 48
+        origin_asn = origins[0]
+        kind = rng.random()
+        if kind < 0.80:
+            # 経路と同じprefixとASのVRP (VALID)
+            vrps.add((format_prefix(version, network_int, prefixlen), origin_asn, prefixlen))
+        elif kind < 0.88 and prefixlen > 8:
+            # 短いprefixのVRPでmaxLengthを伸ばしてある (VALID)
+            shorter_prefixlen = max(8, prefixlen - rng.choice([1, 2, 4]))
+            shorter_network_int = network_int >> (width - shorter_prefixlen) << (width - shorter_prefixlen)
+            vrps.add((format_prefix(version, shorter_network_int, shorter_prefixlen), origin_asn,
+                      max(prefixlen, min(max_prefixlen, shorter_prefixlen + 8))))
+        elif kind < 0.95:
+            # 他のASのVRP (INVALID)
+            vrps.add((format_prefix(version, network_int, prefixlen), origin_asn + 1, prefixlen))
+        elif kind < 0.98 and prefixlen > 8:
+            # 短いprefixのVRPでmaxLengthが足りない (INVALID)
+            shorter_prefixlen = prefixlen - 1
+            shorter_network_int = network_int >> (width - shorter_prefixlen) << (width - shorter_prefixlen)
+            vrps.add((format_prefix(version, shorter_network_int, shorter_prefixlen), origin_asn, shorter_prefixlen))
+        else:
+            # AS0のVRP (INVALID)
+            vrps.add((format_prefix(version, network_int, prefixlen), 0, prefixlen))
+    return sorted(vrps)
+
+
+# 規模の名前に対応するRIBとVRPsのファイルのパス
+def data_file_paths(dir_path_data, scale):
+    return (os.path.join(dir_path_data, "vrps_{}.dat".format(scale)),
+            os.path.join(dir_path_data, "rib_{}.dat".format(scale)))
+
+
+# RIBとVRPsのファイルを作る。すでにあれば作らない(毎回同じものができるので)。(VRPsのパス, RIBのパス) を返す
+def ensure_data_files(dir_path_data, scale):
+    file_path_vrps, file_path_rib = data_file_paths(dir_path_data, scale)
+    if os.path.exists(file_path_vrps) and os.path.exists(file_path_rib):
+        return file_path_vrps, file_path_rib
+
+    os.makedirs(dir_path_data, exist_ok=True)
+    rng = random.Random(SEED + 2)
+    routes = generate_routes(SCALES[scale])
+    peer_counts = {}
+    for (version, network_int, prefixlen), origins in routes.items():
+        prefix = format_prefix(version, network_int, prefixlen)
+        for origin_asn in origins:
+            peer_counts[(prefix, origin_asn)] = rng.randint(1, 60)
+    write_vrps_file(generate_vrps(routes), file_path_vrps)
+    write_rib_file(peer_counts, file_path_rib)
+    return file_path_vrps, file_path_rib
+
+
+# NLRIの並びにする
+def _encode_nlri(prefixes):
+    encoded = []
+    for version, network_int, prefixlen in prefixes:
+        n_bytes = (prefixlen + 7) // 8
+        width = 32 if version == 4 else 128
+        encoded.append(bytes([prefixlen]) + (network_int >> (width - 8 * n_bytes)).to_bytes(n_bytes, "big"))
+    return b"".join(encoded)
+
+
+# パス属性を1つ作る (長さが255を超えるものは拡張長にする)
+def _encode_attribute(flags, attr_type, value):
+    if len(value) > 255:
+        return struct.pack(">BBH", flags | 0x10, attr_type, len(value)) + value
+    return struct.pack(">BBB", flags, attr_type, len(value)) + value
+
+
+# BGP4MP_MESSAGE_AS4のMRTのレコードを作る。IPv4はUPDATEのNLRIに、IPv6はMP_REACH_NLRI/MP_UNREACH_NLRIに入れる
+def _encode_bgp4mp_update(timestamp, peer_ip, peer_asn, announced, withdrawn, as_path):
+    withdrawn_v4 = [prefix for prefix in withdrawn if prefix[0] == 4]
+    withdrawn_v6 = [prefix for prefix in withdrawn if prefix[0] == 6]
+    announced_v4 = [prefix for prefix in announced if prefix[0] == 4]
+    announced_v6 = [prefix for prefix in announced if prefix[0] == 6]
+    attributes = b""
+    if announced:
+        attributes += _encode_attribute(0x40, 1, b"\0")
+        attributes += _encode_attribute(0x40, 2, struct.pack(">BB", 2, len(as_path)) +
+                                        b"".join(struct.pack(">I", asn) for asn in as_path))
+        if announced_v4:
+            attributes += _encode_attribute(0x40, 3, socket.inet_aton(peer_ip))
+        if announced_v6:
+            next_hop = socket.inet_pton(socket.AF_INET6, "2001:db8::1")
+            attributes += _encode_attribute(0x80, 14, struct.pack(">HBB", 2, 1, len(next_hop)) + next_hop + b"\0" +
+                                            _encode_nlri(announced_v6))
+    if withdrawn_v6:
+        attributes += _encode_attribute(0x80, 15, struct.pack(">HB", 2, 1) + _encode_nlri(withdrawn_v6))
+    withdrawn_nlri = _encode_nlri(withdrawn_v4)
+    update = struct.pack(">H", len(withdrawn_nlri)) + withdrawn_nlri + struct.pack(">H", len(attributes)) + \
+        attributes + _encode_nlri(announced_v4)
+    message = b"\xff" * 16 + struct.pack(">HB", 19 + len(update), 2) + update
+    body = struct.pack(">IIHH", peer_asn, 64496, 0, 1) + socket.inet_aton(peer_ip) + \
+        socket.inet_aton("192.0.2.254") + message
+    return struct.pack(">IHHI", timestamp, 16, 4, len(body)) + body
+
+
+# BGP4MP_STATE_CHANGE_AS4のMRTのレコード (EstablishedからIdleへ) を作る
+def _encode_bgp4mp_peer_down(timestamp, peer_ip, peer_asn):
+    body = struct.pack(">IIHH", peer_asn, 64496, 0, 1) + socket.inet_aton(peer_ip) + \
+        socket.inet_aton("192.0.2.254") + struct.pack(">HH", 6, 1)
+    return struct.pack(">IHHI", timestamp, 16, 5, len(body)) + body
+
+
+# 経路に対するUPDATEを作り、MRTのファイルに書き出す。UPDATEの数を返す
+def write_updates_file(routes, n_updates, file_path_updates, seed=SEED):
+    rng = random.Random(seed + 3)
+    choose_kind = _weighted_chooser(rng, UPDATE_KIND_WEIGHTS)
+    prefix_list = sorted(routes)
+    n_asns = max(1, len(routes) // ROUTES_PER_ASN)
+    peers = [("198.51.100.{}".format(idx + 1), 65000 + idx) for idx in range(N_PEERS)]
+    timestamp = 1583020800
+    with open(file_path_updates + ".tmp", "wb") as f:
+        for idx in range(n_updates):
+            peer_ip, peer_asn = rng.choice(peers)
+            kind = choose_kind()
+            version, network_int, prefixlen = prefix = rng.choice(prefix_list)
+            origin_asn = routes[prefix][0]
+            if kind == "reannounce":
+                record = _encode_bgp4mp_update(timestamp, peer_ip, peer_asn, [prefix], [], [peer_asn, origin_asn])
+            elif kind == "withdraw":
+                record = _encode_bgp4mp_update(timestamp, peer_ip, peer_asn, [], [prefix], [])
+            elif kind == "more_specific":
+                width = 32 if version == 4 else 128
+                new_prefixlen = min(width, prefixlen + rng.choice([1, 2, 4]))
+                network_int |= rng.getrandbits(new_prefixlen - prefixlen) << (width - new_prefixlen)
+                record = _encode_bgp4mp_update(timestamp, peer_ip, peer_asn, [(version, network_int, new_prefixlen)],
+                                               [], [peer_asn, origin_asn])
+            elif kind == "other_origin":
+                record = _encode_bgp4mp_update(timestamp, peer_ip, peer_asn, [prefix], [],
+                                               [peer_asn, _asn_of(rng.randrange(n_asns))])
+            else:
+                record = _encode_bgp4mp_peer_down(timestamp, peer_ip, peer_asn)
+            f.write(record)
+            if idx % 1000 == 999:
+                timestamp += 1
+    os.replace(file_path_updates + ".tmp", file_path_updates)
+    return n_updates
+
+
+# 規模に対応するUPDATEのファイルのパス
+def updates_file_path(dir_path_data, scale):
+    return os.path.join(dir_path_data, "updates_{}.mrt".format(scale))
+
+
+# UPDATEのファイルを作る。すでにあれば作らない。パスを返す
+def ensure_updates_file(dir_path_data, scale):
+    file_path_updates = updates_file_path(dir_path_data, scale)
+    if not os.path.exists(file_path_updates):
+        os.makedirs(dir_path_data, exist_ok=True)
+        write_updates_file(generate_routes(SCALES[scale]), SCALES[scale], file_path_updates)
+    return file_path_updates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="generate synthetic RIB and VRP files for benchmarks")
+    parser.add_argument("scale", choices=sorted(SCALES), help="number of routes")
+    parser.add_argument("dir_path_data", help="directory to write rib_<scale>.dat and vrps_<scale>.dat")
+    parser.add_argument("--updates", action="store_true",
+                        help="also write updates_<scale>.mrt, BGP updates for the routes in MRT format")
+    args = parser.parse_args()
+    for file_path in ensure_data_files(args.dir_path_data, args.scale):
+        print(file_path)
+    if args.updates:
+        print(ensure_updates_file(args.dir_path_data, args.scale))
+
+
+if __name__ == "__main__":
+    main()
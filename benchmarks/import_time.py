@@ -0,0 +1,107 @@
+# encoding: UTF-8
+
+# Copyright (c) 2019-2020 Japan Network Information Center ("JPNIC")
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute and/or sublicense of
+# the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# roamon_verify_controllerの起動にかかる時間を計る
+# python -X importtime でimportにかかった時間を調べ、予算(--budget-ms)を超えるか、
+# サブコマンドでしか使わない重いモジュール(requests, tqdm, pyfiglet, numpy)が起動時にimportされていたら終了コード1で終わる
+# また、"--help"の実行にかかる時間(何回か実行した中央値)も表示する
+#
+# 使い方: python benchmarks/import_time.py [--budget-ms 50]
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+DIR_PATH_REPOSITORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+FILE_PATH_CONTROLLER = os.path.join(DIR_PATH_REPOSITORY, "roamon_verify_controller.py")
+DEFAULT_BUDGET_MS = 50
+DEFAULT_RUNS = 10
+# 起動時にimportされていてはいけないモジュール
+HEAVY_MODULES = ["requests", "tqdm", "pyfiglet", "numpy"]
+TOP_MODULES = 10
+
+
+# python -X importtime の出力を [(モジュール名, 自分の時間(us), 累計の時間(us)), ...] にする
+def parse_importtime(text):
+    imports = []
+    for line in text.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        imports.append((name.strip(), int(self_us), int(cumulative_us)))
+    return imports
+
+
+# roamon_verify_controllerをimportして、import時間の一覧と、importされた重いモジュールを返す
+def measure_import():
+    code = "import sys, roamon_verify_controller; print(' '.join(m for m in {} if m in sys.modules))".format(
+        HEAVY_MODULES)
+    env = dict(os.environ, PYTHONPATH=DIR_PATH_REPOSITORY)
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], env=env, check=True,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    return parse_importtime(process.stderr), process.stdout.split()
+
+
+# "--help"を何回か実行して、かかった時間の中央値(秒)を返す
+def measure_help(runs):
+    seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, FILE_PATH_CONTROLLER, "--help"], check=True, stdout=subprocess.DEVNULL)
+        seconds.append(time.perf_counter() - start)
+    return statistics.median(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="measure start-up time of roamon_verify_controller")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS,
+                        help="allowed import time of roamon_verify_controller in ms (default: {})".format(
+                            DEFAULT_BUDGET_MS))
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS,
+                        help="number of --help runs to take the median of (default: {})".format(DEFAULT_RUNS))
+    args = parser.parse_args()
+
+    imports, heavy_modules = measure_import()
+    controller_us = [cumulative_us for name, _, cumulative_us in imports if name == "roamon_verify_controller"][0]
+    print("import roamon_verify_controller: {:.1f} ms (budget {:.1f} ms)".format(controller_us / 1000,
+                                                                               args.budget_ms))
+    print("slowest modules (self time):")
+    for name, self_us, cumulative_us in sorted(imports, key=lambda item: item[1], reverse=True)[:TOP_MODULES]:
+        print("  {:<40} {:>8.1f} ms".format(name, self_us / 1000))
+    print("--help: {:.1f} ms (median of {} runs)".format(measure_help(args.runs) * 1000, args.runs))
+
+    failed = False
+    if heavy_modules:
+        print("FAIL: imported at start-up: {}".format(" ".join(heavy_modules)))
+        failed = True
+    if controller_us / 1000 > args.budget_ms:
+        print("FAIL: import time is over the budget")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+# encoding: UTF-8
+
+# Copyright (c) 2019-2020 Japan Network Information Center ("JPNIC")
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute and/or sublicense of
+# the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# 主な処理(load_all_data, rov, rov_with_asn, check_all_asn_in_vrps, check_all_prefixes_in_vrps, apply_updates)の時間を計る
+# generate_data.pyで作ったRIBとVRPs(とBGPのUPDATEの記録)を使うので、ネットワークもroutinatorも要らない
+# 最大RSS(ru_maxrss)は一度上がると下がらないので、規模ごとに別のプロセスで計る
+# 結果は保存してあるベースライン(baseline.json)と比べて、許容範囲より遅いか大きければ終了コード1で終わる
+#
+# 使い方:
+#   python benchmarks/run_benchmarks.py                      # 10kと100kを計ってベースラインと比べる
+#   python benchmarks/run_benchmarks.py --scale 1m           # 1mも計る
+#   python benchmarks/run_benchmarks.py --save-baseline      # 今回の結果をベースラインとして保存する
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+DIR_PATH_BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, DIR_PATH_BENCHMARKS)
+sys.path.insert(0, os.path.join(DIR_PATH_BENCHMARKS, ".."))
+
+import generate_data
+
+FILE_PATH_BASELINE = os.path.join(DIR_PATH_BENCHMARKS, "baseline.json")
+DIR_PATH_DATA_DEFAULT = os.path.join(tempfile.gettempdir(), "roamon-verify-bench")
+DEFAULT_SCALES = ["10k", "100k"]
+DEFAULT_TOLERANCE = 0.25
+# これより小さい差は誤差とみなす(すぐ終わるものが割合だけでREGRESSIONにならないように)
+MIN_SECONDS_DIFF = 0.05
+MIN_RSS_DIFF = 8 * 1024 * 1024
+# rovとrov_with_asnで調べるprefixとASNの数
+SAMPLE_PREFIXES = 10000
+SAMPLE_ASNS = 2000
+
+# 計るもの: (名前, 何を数えるか)
+BENCHMARKS = [
+    ("load_all_data", "routes"),
+    ("write_snapshots", "routes"),
+    ("load_all_data_snapshot", "routes"),
+    ("rov", "prefixes"),
+    ("rov_with_asn", "asns"),
+    ("check_all_asn_in_vrps", "asns"),
+    ("check_all_prefixes_in_vrps", "prefixes"),
+    ("apply_updates", "updates"),
+]
+
+
+# これまでの最大RSSをバイトで返す (Linuxはキロバイト、macOSはバイトで返ってくる)
+def _peak_rss():
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
+# funcを実行して {"seconds", "count", "peak_rss"} を返す
+def _measure(func, count):
+    start = time.perf_counter()
+    func()
+    return {"seconds": time.perf_counter() - start, "count": count, "peak_rss": _peak_rss()}
+
+
+# スナップショットを消す (load_all_dataにデータファイルそのものをパースさせるため)
+def _remove_snapshots(file_paths):
+    import roamon_verify_snapshot
+    for file_path in file_paths:
+        if os.path.exists(roamon_verify_snapshot.snapshot_path(file_path)):
+            os.remove(roamon_verify_snapshot.snapshot_path(file_path))
+
+
+# 1つの規模について全部計る(子プロセスの中で動く)。{名前: 計測結果} を返す
+def run_scale(scale, dir_path_data):
+    import roamon_verify_checker
+    import roamon_verify_output
+    import roamon_verify_snapshot
+
+    file_path_vrps, file_path_rib = generate_data.ensure_data_files(dir_path_data, scale)
+    _remove_snapshots([file_path_vrps, file_path_rib])
+    results = {}
+    data = {}
+
+    def load():
+        data.update(roamon_verify_checker.load_all_data(file_path_vrps, file_path_rib))
+
+    # 読み込みで増えた分だけを経路の数で割って、1経路あたりのメモリとする
+    rss_before_load = _peak_rss()
+    results["load_all_data"] = _measure(load, generate_data.SCALES[scale])
+    results["load_all_data"]["bytes_per_route"] = \
+        (results["load_all_data"]["peak_rss"] - rss_before_load) / generate_data.SCALES[scale]
+    vrps, rib = data["vrps"], data["rib"]
+
+    def write_snapshots():
+        roamon_verify_snapshot.write_vrp_snapshot(file_path_vrps)
+        roamon_verify_snapshot.write_snapshot(file_path_rib)
+
+    results["write_snapshots"] = _measure(write_snapshots, len(rib))
+    results["load_all_data_snapshot"] = _measure(
+        lambda: roamon_verify_checker.load_all_data(file_path_vrps, file_path_rib), len(rib))
+    _remove_snapshots([file_path_vrps, file_path_rib])
+
+    # 調べるprefixとASNは毎回同じものにする
+    rng = random.Random(generate_data.SEED)
+    sample_prefixes = rng.sample(sorted(rib.prefixes()), min(SAMPLE_PREFIXES, len(rib)))
+    all_asns = sorted(vrps.asns())
+    sample_asns = rng.sample(all_asns, min(SAMPLE_ASNS, len(all_asns)))
+
+    def rov():
+        for prefix in sample_prefixes:
+            roamon_verify_checker.rov(vrps, rib, prefix)
+
+    def rov_with_asn():
+        for asn in sample_asns:
+            roamon_verify_checker.rov_with_asn(vrps, rib, asn)
+
+    results["rov"] = _measure(rov, len(sample_prefixes))
+    results["rov_with_asn"] = _measure(rov_with_asn, len(sample_asns))
+
+    # 結果の書き出しも含めて計る(書き出し先は/dev/null)
+    with roamon_verify_output.open_writer("tsv", os.devnull) as writer:
+        results["check_all_asn_in_vrps"] = _measure(
+            lambda: roamon_verify_checker.check_all_asn_in_vrps(vrps, rib, writer=writer), len(all_asns))
+    with roamon_verify_output.open_writer("tsv", os.devnull) as writer:
+        results["check_all_prefixes_in_vrps"] = _measure(
+            lambda: roamon_verify_checker.check_all_prefixes_in_vrps(vrps, rib, writer=writer), len(vrps.prefixes()))
+
+    # BGPのUPDATEの記録を読みながらRIBに当てる (MRTの解析も含めて計る)
+    import roamon_verify_updates
+    file_path_updates = generate_data.updates_file_path(dir_path_data, scale)
+    live_rib = roamon_verify_updates.LiveRib.from_rib(rib)
+
+    def apply_updates():
+        event_lists = roamon_verify_updates.iter_mrt_update_events([file_path_updates])
+        for events in roamon_verify_updates.iter_batches(event_lists):
+            roamon_verify_updates.apply_updates(vrps, live_rib, events)
+
+    results["apply_updates"] = _measure(apply_updates, generate_data.SCALES[scale])
+    return results
+
+
+# 規模ごとに子プロセスでrun_scale()を実行して、結果を受け取る
+def _run_scale_in_subprocess(scale, dir_path_data):
+    env = dict(os.environ, TQDM_DISABLE="1")
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", scale, "--data-dir", dir_path_data],
+                            env=env, check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(output.decode("utf-8"))
+
+
+def _format_bytes(n_bytes):
+    return "{:.1f} MB".format(n_bytes / (1024 * 1024))
+
+
+# ベースラインと比べて、遅くなったか大きくなったものを [(規模, 名前, 何が, 今回, ベースライン), ...] で返す
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    for scale, scale_results in results.items():
+        for name, result in scale_results.items():
+            base = baseline.get("results", {}).get(scale, {}).get(name)
+            if base is None:
+                continue
+            if result["seconds"] > max(base["seconds"] * (1 + tolerance), base["seconds"] + MIN_SECONDS_DIFF):
+                regressions.append((scale, name, "seconds", result["seconds"], base["seconds"]))
+            if result["peak_rss"] > max(base["peak_rss"] * (1 + tolerance), base["peak_rss"] + MIN_RSS_DIFF):
+                regressions.append((scale, name, "peak_rss", result["peak_rss"], base["peak_rss"]))
+    return regressions
+
+
+# 結果を表にして表示する
+def print_report(results, baseline):
+    print("{:<6} {:<28} {:>9} {:>22} {:>10} {:>9}".format(
+        "scale", "benchmark", "seconds", "throughput", "peak RSS", "vs base"))
+    units = dict(BENCHMARKS)
+    for scale, scale_results in results.items():
+        for name, _ in BENCHMARKS:
+            result = scale_results[name]
+            throughput = result["count"] / result["seconds"] if result["seconds"] > 0 else float("inf")
+            base = baseline.get("results", {}).get(scale, {}).get(name)
+            change = "-" if base is None else "{:+.0%}".format(result["seconds"] / base["seconds"] - 1)
+            print("{:<6} {:<28} {:>9.3f} {:>22} {:>10} {:>9}".format(
+                scale, name, result["seconds"], "{:,.0f} {}/s".format(throughput, units[name]),
+                _format_bytes(result["peak_rss"]), change))
+        print("{:<6} {:<28} {:>9} {:>22}".format(scale, "(memory per route)", "", "{:,.0f} bytes".format(
+            scale_results["load_all_data"]["bytes_per_route"])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark roamon-verify with synthetic RIB and VRP files")
+    parser.add_argument("--scale", nargs="+", choices=sorted(generate_data.SCALES), default=DEFAULT_SCALES,
+                        help="scales to run (default: {})".format(" ".join(DEFAULT_SCALES)))
+    parser.add_argument("--data-dir", default=DIR_PATH_DATA_DEFAULT,
+                        help="directory to keep generated data (default: {})".format(DIR_PATH_DATA_DEFAULT))
+    parser.add_argument("--baseline", default=FILE_PATH_BASELINE, help="baseline file to compare with")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed slowdown or growth against the baseline (default: 0.25 = 25%%)")
+    parser.add_argument("--save-baseline", action="store_true", help="save results as the new baseline")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        json.dump(run_scale(args.child, args.data_dir), sys.stdout)
+        return
+
+    results = {}
+    for scale in args.scale:
+        # データを作る時間は計らないように、子プロセスの前に作っておく
+        generate_data.ensure_data_files(args.data_dir, scale)
+        generate_data.ensure_updates_file(args.data_dir, scale)
+        results[scale] = _run_scale_in_subprocess(scale, args.data_dir)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+
+    if args.save_baseline:
+        # 規模を絞って実行したときに、他の規模のベースラインは消さない
+        baseline_results = dict(baseline.get("results", {}), **results)
+        with open(args.baseline, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(),
+                       "results": baseline_results}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print_report(results, {})
+        print("saved baseline to {}".format(args.baseline))
+        return
+
+    print_report(results, baseline)
+    regressions = find_regressions(results, baseline, args.tolerance)
+    for scale, name, metric, value, base_value in regressions:
+        if metric == "seconds":
+            print("REGRESSION {} {}: {:.3f}s (baseline {:.3f}s)".format(scale, name, value, base_value))
+        else:
+            print("REGRESSION {} {}: peak RSS {} (baseline {})".format(
+                scale, name, _format_bytes(value), _format_bytes(base_value)))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# encoding: UTF-8
+
+# Copyright (c) 2019-2020 Japan Network Information Center ("JPNIC")
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute and/or sublicense of
+# the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# 経路をまとめてROVする (numpyを使う)
+# 経路を1つずつvalidate_route()するかわりに、(ネットワークアドレス, プレフィックス長, Origin AS)の配列を受け取り、
+# VRPのプレフィックス長ごとに「ネットワークアドレスを上位Lビットにした値」のソート済み配列を作って、
+# 全経路をnumpy.searchsortedで一度に引く。結果はRovResultのidの配列で返す
+# numpyが入っていなければis_available()がFalseになり、呼び出し側は今まで通り1つずつ検証する
+
+import logging
+from roamon_verify_checker import RovResult, validate_route
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+_RESULT_DTYPE = "uint8"
+
+
+# numpyが使えるか
+def is_available():
+    return np is not None
+
+
+# VRPsのうちIPバージョンが同じものを、プレフィックス長ごとに (L, 上位Lビットの配列, ASNの配列, maxLengthの配列) にする
+# 上位Lビットの配列は昇順で、同じprefixのVRPは隣り合う
+# IPv6は上位64bit(network_hi)しか見ないので、L > 64のものはkeysをNoneにしておく
+def _vrp_levels(vrps, version):
+    width = 32 if version == 4 else 64
+    if not hasattr(vrps, "columns"):
+        return _vrp_levels_from_trie(vrps, version, width)
+
+    columns = vrps.columns(version)
+    if version == 4:
+        networks = np.frombuffer(columns["network"], dtype=np.uint32).astype(np.uint64)
+    else:
+        networks = np.frombuffer(columns["network_hi"], dtype=np.uint64)
+    prefixlens = np.frombuffer(columns["prefixlen"], dtype=np.uint8)
+    asns = np.frombuffer(columns["asn"], dtype=np.uint32)
+    max_lengths = np.frombuffer(columns["value"], dtype=np.uint32)
+
+    # エントリは(ネットワークアドレス, プレフィックス長, ...)の順に並んでいるので、同じLのものだけ取り出してもkeysの昇順のまま
+    levels = []
+    for level in np.unique(prefixlens).tolist():
+        selected = prefixlens == level
+        if level > width:
+            keys = None
+        elif level == 0:
+            keys = np.zeros(int(selected.sum()), dtype=np.uint64)
+        else:
+            keys = networks[selected] >> np.uint64(width - level)
+        levels.append((level, keys, asns[selected], max_lengths[selected]))
+    return levels
+
+
+# VrpTrieの段(プレフィックス長ごとのハッシュ表)から同じものを作る。ハッシュ表のキーはそのまま上位Lビット
+def _vrp_levels_from_trie(vrp_trie, version, width):
+    levels = []
+    for level, table in vrp_trie.levels(version):
+        if level > width:
+            levels.append((level, None, None, None))
+            continue
+        keys, asns, max_lengths = [], [], []
+        # RTRで更新中でも壊れないように、表を一度にコピーしてからたどる
+        for key, vrps_of_prefix in sorted(table.items()):
+            for asn, max_length in vrps_of_prefix:
+                keys.append(key)
+                asns.append(asn)
+                max_lengths.append(max_length)
+        levels.append((level, np.array(keys, dtype=np.uint64), np.array(asns, dtype=np.uint32),
+                       np.array(max_lengths, dtype=np.uint32)))
+    return levels
+
+
+# 経路のネットワークアドレス(IPv6なら上位64bit)の配列をまとめて検証する
+def _validate(levels, width, networks, prefixlens, origins):
+    covered = np.zeros(len(networks), dtype=bool)
+    valid = np.zeros(len(networks), dtype=bool)
+    for level, keys, asns, max_lengths in levels:
+        if keys is None:
+            continue
+        # 長さLのVRPに含まれうるのは、プレフィックス長がL以上の経路だけ
+        candidates = np.nonzero(prefixlens >= level)[0]
+        if level == 0:
+            route_keys = np.zeros(len(candidates), dtype=np.uint64)
+        else:
+            route_keys = networks[candidates] >> np.uint64(width - level)
+        left = np.searchsorted(keys, route_keys, side="left")
+        right = np.searchsorted(keys, route_keys, side="right")
+        hit = right > left
+        candidates, left, right = candidates[hit], left[hit], right[hit]
+        covered[candidates] = True
+
+        # 同じprefixのVRPは隣り合っているので、k番目どうしを順に比べる
+        candidate_origins = origins[candidates]
+        candidate_prefixlens = prefixlens[candidates]
+        for k in range(int((right - left).max()) if len(candidates) else 0):
+            in_range = left + k < right
+            idx = np.minimum(left + k, len(asns) - 1)
+            matched = in_range & (asns[idx] == candidate_origins) & (asns[idx] != 0) \
+                & (candidate_prefixlens <= max_lengths[idx])
+            valid[candidates[matched]] = True
+
+    return np.where(valid, RovResult.VALID.id,
+                    np.where(covered, RovResult.INVALID.id, RovResult.NOT_FOUND.id)).astype(_RESULT_DTYPE)
+
+
+# IPv4の経路をまとめて検証して、RovResultのidの配列を返す
+# networks: ネットワークアドレスの整数, prefixlens: プレフィックス長, origins: Origin AS (どれも同じ長さの配列かリスト)
+def validate_routes_v4(vrps, networks, prefixlens, origins):
+    levels = _vrp_levels(vrps, 4)
+    return _validate(levels, 32, np.asarray(networks, dtype=np.uint64), np.asarray(prefixlens, dtype=np.uint8),
+                     np.asarray(origins, dtype=np.uint32))
+
+
+# IPv6の経路をまとめて検証して、RovResultのidの配列を返す。ネットワークアドレスは上位64bitと下位64bitの配列で渡す
+# 長さが64を超えるVRPがあるときは、それに含まれうる(プレフィックス長が64を超える)経路だけ1つずつ検証しなおす
+def validate_routes_v6(vrps, networks_hi, networks_lo, prefixlens, origins):
+    levels = _vrp_levels(vrps, 6)
+    networks_hi = np.asarray(networks_hi, dtype=np.uint64)
+    prefixlens = np.asarray(prefixlens, dtype=np.uint8)
+    origins = np.asarray(origins, dtype=np.uint32)
+    results = _validate(levels, 64, networks_hi, prefixlens, origins)
+
+    long_levels = [level for level, keys, _, _ in levels if keys is None]
+    if long_levels:
+        networks_lo = np.asarray(networks_lo, dtype=np.uint64)
+        for idx in np.nonzero(prefixlens >= min(long_levels))[0].tolist():
+            network_int = (int(networks_hi[idx]) << 64) | int(networks_lo[idx])
+            results[idx] = validate_route(vrps, 6, network_int, int(prefixlens[idx]), int(origins[idx])).id
+    return results
+
+
+# RIB(roamon_verify_snapshot.RibTable)の全経路をまとめて検証して、RovResultのidの配列をRIBのエントリの順番で返す
+def validate_rib(vrps, rib):
+    columns_v4 = rib.columns(4)
+    columns_v6 = rib.columns(6)
+    results_v4 = validate_routes_v4(vrps, np.frombuffer(columns_v4["network"], dtype=np.uint32),
+                                    np.frombuffer(columns_v4["prefixlen"], dtype=np.uint8),
+                                    np.frombuffer(columns_v4["asn"], dtype=np.uint32))
+    results_v6 = validate_routes_v6(vrps, np.frombuffer(columns_v6["network_hi"], dtype=np.uint64),
+                                    np.frombuffer(columns_v6["network_lo"], dtype=np.uint64),
+                                    np.frombuffer(columns_v6["prefixlen"], dtype=np.uint8),
+                                    np.frombuffer(columns_v6["asn"], dtype=np.uint32))
+    logger.debug("finish batch validation of {} routes".format(len(results_v4) + len(results_v6)))
+    return np.concatenate([results_v4, results_v6])
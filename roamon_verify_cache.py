@@ -0,0 +1,153 @@
+# encoding: UTF-8
+
+# Copyright (c) 2019-2020 Japan Network Information Center ("JPNIC")
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute and/or sublicense of
+# the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# rov()とrov_with_asn()の結果のキャッシュ (serveや、--input/--ip/--asnで同じprefixやASNを何度も問い合わせるとき用)
+#   * prefix -> ロンゲストマッチした経路とOrigin ASごとのROVの結果 (指定されたprefixを数値にしたものをキーにする)
+#   * ASN -> そのASが広告している経路全部のROVの結果
+# どちらも最大の個数を決めたLRUで、ヒットとミスの数を数える
+# キャッシュした結果は、そのときのVRPsとRIBのオブジェクト(とVrpTrieのgeneration)に結びつけておき、
+# 別のデータ(読み込み直したものなど)や中身の変わったデータで問い合わせられたら、全部捨ててから検索し直す
+
+import logging
+import threading
+from collections import OrderedDict
+from roamon_verify_checker import (match_and_validate, prefix_rov_result_structs, validate_as_routes,
+                                   asn_rov_result_struct)
+from roamon_verify_index import parse_prefix
+import roamon_verify_stats
+
+logger = logging.getLogger(__name__)
+
+# キャッシュする個数のデフォルト (prefixとASNそれぞれ)
+DEFAULT_CACHE_SIZE = 10000
+
+_MISSING = object()
+
+
+# 最大maxsize個まで持ち、あふれたら一番長く使われていないものから捨てるキャッシュ
+# serveでは複数のスレッドから使われるのでロックする
+class LruCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    # キーの値を返す。無ければ_MISSING
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups > 0 else None}
+
+
+# 中身が変わったかどうかを見分けるための、データの版 (RibTableは変更できないので、ずっと0)
+def _generation(data):
+    return getattr(data, "generation", 0)
+
+
+# rov()とrov_with_asn()をキャッシュ付きで行うクラス。関数の引数と返り値はroamon_verify_checkerのものと同じ
+class RovCache:
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.prefix_matches = LruCache(maxsize)
+        self.asn_routes = LruCache(maxsize)
+        # キャッシュした結果がどのデータのものか (VRPs, RIB, VRPsの版, RIBの版, 番号)
+        # 番号はデータが変わるたびに増やしてキーに含める(読み込み直しの途中で古いデータの問い合わせが残っていても、
+        # その結果が新しいデータの結果として使われないように)
+        self._bound = None
+        self._bind_lock = threading.Lock()
+
+    # 問い合わせに使うデータがキャッシュした結果のものと違えば、キャッシュを空にする。キーに含める番号を返す
+    # 前のデータのオブジェクトは、次に別のデータで問い合わせられるまで参照が残る
+    def _bind(self, vrps, rib):
+        bound = self._bound
+        if bound is not None and bound[0] is vrps and bound[1] is rib \
+                and bound[2] == _generation(vrps) and bound[3] == _generation(rib):
+            return bound[4]
+        with self._bind_lock:
+            epoch = 0
+            if self._bound is not None:
+                logger.debug("data has changed. clear ROV cache")
+                epoch = self._bound[4] + 1
+            self.prefix_matches.clear()
+            self.asn_routes.clear()
+            self._bound = (vrps, rib, _generation(vrps), _generation(rib), epoch)
+            return epoch
+
+    def rov(self, vrps, rib, specified_prefix):
+        epoch = self._bind(vrps, rib)
+        version, network_int, prefixlen = parse_prefix(specified_prefix)
+        key = (epoch, version, network_int, prefixlen)
+        matched = self.prefix_matches.get(key)
+        if matched is _MISSING:
+            roamon_verify_stats.cache_miss("rov_prefix")
+            matched = match_and_validate(vrps, rib, version, network_int, prefixlen)
+            self.prefix_matches.put(key, matched)
+        else:
+            roamon_verify_stats.cache_hit("rov_prefix")
+        return prefix_rov_result_structs(specified_prefix, matched)
+
+    def rov_with_asn(self, vrps, rib, specified_asn):
+        epoch = self._bind(vrps, rib)
+        key = (epoch, int(specified_asn))
+        results = self.asn_routes.get(key)
+        if results is _MISSING:
+            roamon_verify_stats.cache_miss("rov_asn")
+            results = validate_as_routes(vrps, rib, specified_asn)
+            self.asn_routes.put(key, results)
+        else:
+            roamon_verify_stats.cache_hit("rov_asn")
+        return asn_rov_result_struct(specified_asn, results)
+
+    def clear(self):
+        with self._bind_lock:
+            self.prefix_matches.clear()
+            self.asn_routes.clear()
+
+    def stats(self):
+        return {"prefix": self.prefix_matches.stats(), "asn": self.asn_routes.stats()}
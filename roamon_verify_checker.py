@@ -20,16 +20,35 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from netaddr import *
 import logging
 from tqdm import tqdm
 import math
-import pyasn
-import ipaddress
+import multiprocessing
+import time
+from array import array
+from bisect import bisect_right
+from collections import deque
+from collections.abc import Mapping
+from contextlib import contextmanager
 from enum import Enum
+from functools import partial
+from roamon_verify_index import VrpTrie, parse_prefix, format_prefix
+import roamon_verify_snapshot
+import roamon_verify_output
+import roamon_verify_stats
 
 logger = logging.getLogger(__name__)
 
+# 並列実行時、ワーカー1つあたりに割り当てるシャードの数 (ASごとの処理時間のばらつきをならすため、ワーカー数より多めに分割する)
+SHARDS_PER_WORKER = 16
+
+# 入力をストリームで処理するとき、1回にワーカーへ渡す対象の数
+STREAM_CHUNK_SIZE = 1000
+
+# 並列実行時にワーカープロセスが参照するVRPsとRIB (forkできる環境ではコピーされずにそのまま引き継がれる)
+_worker_vrps = None
+_worker_rib = None
+
 
 # リストをn等分する
 def divide_list_equally(target_list, divide_num):
@@ -54,7 +73,10 @@ class RovResult(Enum):
 
 
 # Prefixを指定してのROVの結果
+# 全ASNのROVでは数百万個作られるので、__dict__を持たないようにしておく
 class PrefixRovResultStruct:
+    __slots__ = ("roved_prefix", "matched_advertised_prefix", "advertising_asn", "rov_result")
+
     def __init__(self, roved_prefix, matched_advertised_prefix, advertising_asn, rov_result):
         self.roved_prefix = roved_prefix
         self.matched_advertised_prefix = matched_advertised_prefix
@@ -73,8 +95,33 @@ class PrefixRovResultStruct:
         return obj_to_dict
 
 
+# only-invalidの結果。ROA登録されたprefix(と同じか長いprefix)を、ROA登録したのとは別のASが広告していて、
+# その経路がROVでVALIDにならないもの(経路ハイジャックかもしれないもの)1件
+class ViolationResultStruct:
+    __slots__ = ("roa_asn", "roa_prefix", "roa_max_length", "advertised_prefix", "advertising_asn")
+
+    def __init__(self, roa_asn, roa_prefix, roa_max_length, advertised_prefix, advertising_asn):
+        self.roa_asn = roa_asn
+        self.roa_prefix = roa_prefix
+        self.roa_max_length = roa_max_length
+        self.advertised_prefix = advertised_prefix
+        self.advertising_asn = advertising_asn
+
+    def __str__(self):
+        return str(self.to_dict())
+
+    def to_dict(self):
+        return {"roa_asn": self.roa_asn,
+                "roa_prefix": self.roa_prefix,
+                "roa_max_length": self.roa_max_length,
+                "advertised_prefix": self.advertised_prefix,
+                "advertising_asn": self.advertising_asn}
+
+
 # ASNを指定してのROVの結果。 ASが広告するすべてのprefixについてROVした結果が格納される
 class AsnRovResultStruct:
+    __slots__ = ("specified_asn", "rov_results_dict", "advertised_prefixes", "__does_have_rov_failed_prefix")
+
     def __init__(self, specified_asn, rov_results_dict):
         self.specified_asn = specified_asn
         self.rov_results_dict = rov_results_dict
@@ -100,231 +147,691 @@ class AsnRovResultStruct:
                        }
         return obj_to_dict
 
-    # このASの広告するprefixたちでROVに失敗したものが1つでもないか調べる
+    # このASの広告するprefixたちでROVに失敗した(VALIDでない)ものが1つでもないか調べる。調べるのは最初に呼ばれたときだけ
     def does_have_rov_failed_prefix(self):
         if self.__does_have_rov_failed_prefix is None:
-            for rov_result_struct in self.rov_results_dict.values():
-                if rov_result_struct != RovResult.VALID:
-                    self.__does_have_rov_failed_prefix = True
-                    break
-            self.__does_have_rov_failed_prefix = False
-
+            self.__does_have_rov_failed_prefix = any(rov_result_struct.rov_result != RovResult.VALID
+                                                     for rov_result_struct in self.rov_results_dict.values())
         return self.__does_have_rov_failed_prefix
 
 
+# ASNを指定してのROVの結果をまとめて持つ表。{ASN: AsnRovResultStruct}のdictと同じように使える
+# 結果は1行に(prefixの整数, Origin AS, 結果のid)を詰めた配列で持ち、AsnRovResultStructやPrefixRovResultStructは取り出すときに作る
+# 同じASNの行は連続して並ぶ(ASNを追加した順、その中ではAsnRovResultStructのprefixの順)
+class AsnRovResultTable(Mapping):
+    __slots__ = ("_asns", "_asn_positions", "_offsets", "_versions", "_networks_hi", "_networks_lo", "_prefixlens",
+                 "_origins", "_results")
+
+    def __init__(self):
+        # 指定されたASN(指定されたときの値のまま)と、その行の範囲 (_offsets[番号]から_offsets[番号 + 1]の手前まで)
+        self._asns = []
+        self._asn_positions = {}
+        self._offsets = array("Q", [0])
+        # 1行ごとの列
+        self._versions = array("B")
+        self._networks_hi = array("Q")
+        self._networks_lo = array("Q")
+        self._prefixlens = array("B")
+        self._origins = array("I")
+        # RovResultのid。bytearrayなのでcount()やfind()で範囲を指定して数えたり探したりできる
+        self._results = bytearray()
+
+    # AsnRovResultStructを1つ追加する
+    def append(self, asn_rov_result_struct):
+        for prefix, prefix_rov_result_struct in asn_rov_result_struct.rov_results_dict.items():
+            version, network_int, prefixlen = parse_prefix(prefix)
+            self._versions.append(version)
+            self._networks_hi.append(network_int >> 64)
+            self._networks_lo.append(network_int & 0xFFFFFFFFFFFFFFFF)
+            self._prefixlens.append(prefixlen)
+            self._origins.append(prefix_rov_result_struct.advertising_asn)
+            self._results.append(prefix_rov_result_struct.rov_result.id)
+        self._asn_positions[asn_rov_result_struct.specified_asn] = len(self._asns)
+        self._asns.append(asn_rov_result_struct.specified_asn)
+        self._offsets.append(len(self._results))
+
+    def __getitem__(self, asn):
+        pos = self._asn_positions[asn]
+        result_dict = {}
+        for idx in range(self._offsets[pos], self._offsets[pos + 1]):
+            prefix_rov_result_struct = self._row(idx)
+            result_dict[prefix_rov_result_struct.roved_prefix] = prefix_rov_result_struct
+        return AsnRovResultStruct(asn, result_dict)
+
+    def __contains__(self, asn):
+        return asn in self._asn_positions
+
+    def __iter__(self):
+        return iter(self._asns)
+
+    def __len__(self):
+        return len(self._asns)
+
+    # 行の数 (ROVした経路の数)
+    def row_count(self):
+        return len(self._results)
+
+    # idx行目のPrefixRovResultStructを作る
+    def _row(self, idx):
+        network_int = (self._networks_hi[idx] << 64) | self._networks_lo[idx]
+        prefix = format_prefix(self._versions[idx], network_int, self._prefixlens[idx])
+        return PrefixRovResultStruct(prefix, prefix, self._origins[idx], _ROV_RESULTS_BY_ID[self._results[idx]])
+
+    # (指定されたASN, PrefixRovResultStruct)を順番に返すジェネレータ。rov_resultを指定すると、その結果の行だけ返す
+    # 表はコピーせず、条件に合う行をbytearray.find()で探しながら1つずつ作る
+    def rows(self, rov_result=None):
+        if rov_result is None:
+            for pos, asn in enumerate(self._asns):
+                for idx in range(self._offsets[pos], self._offsets[pos + 1]):
+                    yield asn, self._row(idx)
+            return
+        idx = self._results.find(rov_result.id)
+        while idx >= 0:
+            asn = self._asns[bisect_right(self._offsets, idx) - 1]
+            yield asn, self._row(idx)
+            idx = self._results.find(rov_result.id, idx + 1)
+
+    # 結果がrov_resultの行の数。asnを指定するとそのASNの行だけ数える
+    def count(self, rov_result, asn=None):
+        if asn is None:
+            return self._results.count(rov_result.id)
+        pos = self._asn_positions[asn]
+        return self._results.count(rov_result.id, self._offsets[pos], self._offsets[pos + 1])
+
+    # このASの広告するprefixたちでROVに失敗した(VALIDでない)ものが1つでもあるか
+    def does_have_rov_failed_prefix(self, asn):
+        pos = self._asn_positions[asn]
+        n_rows = self._offsets[pos + 1] - self._offsets[pos]
+        return self.count(RovResult.VALID, asn) != n_rows
+
+    # 全行の結果のidを返す。コピーしないので、numpy.frombuffer(table.result_codes(), dtype="uint8")でそのまま包める
+    def result_codes(self):
+        return memoryview(self._results)
+
+    # 配列のおおよそのバイト数
+    def nbytes(self):
+        columns = (self._offsets, self._versions, self._networks_hi, self._networks_lo, self._prefixlens, self._origins)
+        return sum(column.itemsize * len(column) for column in columns) + len(self._results)
+
+
+# RovResultのidから列挙型を引く表
+_ROV_RESULTS_BY_ID = {rov_result.id: rov_result for rov_result in RovResult}
+
+
+# RFC 6811に従って、経路(prefixとOrigin AS)をVRPsで検証する
+# 経路のprefixを含むVRPが1つも無ければNOT_FOUND、その中にOrigin ASが一致してmaxLength以内のものがあればVALID、無ければINVALID
+# (AS0のVRPはどのASにも一致しない)
+def validate_route(vrps, version, network_int, prefixlen, origin_asn):
+    covering_vrps = vrps.covering_vrps_parsed(version, network_int, prefixlen)
+    if len(covering_vrps) == 0:
+        return RovResult.NOT_FOUND
+    for _, asn, max_length in covering_vrps:
+        if asn == origin_asn and asn != 0 and prefixlen <= max_length:
+            return RovResult.VALID
+    return RovResult.INVALID
+
+
+# 指定されたprefixにロンゲストマッチする経路をBGPの経路情報から探し、Origin ASごとに検証する (rov()の前半。キャッシュ用)
+# (ロンゲストマッチしたprefix文字列, [(Origin AS, RovResult), ...]) を返す。経路広告されていなければNone
+def match_and_validate(vrps, rib, version, network_int, prefixlen):
+    matched_routes = rib.search_best_routes(version, network_int, prefixlen)
+    if matched_routes is None:
+        return None
+
+    # ロンゲストマッチしたprefixと、それを広告してたASNたちを取り出す
+    # 検証するのは実際に広告されてた経路(ロンゲストマッチしたprefixとそれを広告してたAS)
+    matched_network_int, matched_prefixlen, origins = matched_routes
+    return (format_prefix(version, matched_network_int, matched_prefixlen),
+            [(advertising_asn, validate_route(vrps, version, matched_network_int, matched_prefixlen, advertising_asn))
+             for advertising_asn, _ in origins])
+
+
+# match_and_validate()の結果から、rov()の返り値(PrefixRovResultStructのリスト)を作る
+def prefix_rov_result_structs(specified_prefix, matched):
+    if matched is None:
+        logger.debug("The spefied prefix doesn't exist in RIB.")
+        return [PrefixRovResultStruct(specified_prefix, None, None, RovResult.NOT_ADVERTISED)]
+    matched_advertised_prefix, results = matched
+    return [PrefixRovResultStruct(specified_prefix, matched_advertised_prefix, advertising_asn, rov_result)
+            for advertising_asn, rov_result in results]
+
+
 # あるprefixについてROV (Route Origin Validation) する関数
+# 指定されたprefixにロンゲストマッチする経路をOrigin ASごとに検証し、PrefixRovResultStructのリストを返す
+# (複数のASが広告しているprefix(MOAS)なら、Origin ASの数だけ結果がある。経路広告されていなければNOT_ADVERTISEDが1つ)
+# (match_and_validate()とprefix_rov_result_structs()を合わせたものと同じだが、1つずつ呼ぶことが多いので中間のリストを作らない)
 def rov(vrps, rib, specified_prefix):
     # 指定されたprefixにロンゲストマッチするprefixをBGPの経路情報から探す
-    target_ip_parsed = ipaddress.ip_network(specified_prefix)
-    ip_lookup_result_rib = rib.radix.search_best(str(target_ip_parsed.network_address), target_ip_parsed.prefixlen)
+    version, network_int, prefixlen = parse_prefix(specified_prefix)
+    matched_routes = rib.search_best_routes(version, network_int, prefixlen)
 
     # 経路広告されてなかったならここで終了
-    does_exist_in_rib = ip_lookup_result_rib is not None
-    if not does_exist_in_rib:
+    if matched_routes is None:
         logger.debug("The spefied prefix doesn't exist in RIB.")
-        return PrefixRovResultStruct(specified_prefix, None, None, RovResult.NOT_ADVERTISED)
-
-    # Lookup spedified prefix in vrps
-    specified_prefix_parsed = ipaddress.ip_network(specified_prefix)
-    matched_in_vrps = vrps.radix.search_best(str(specified_prefix_parsed.network_address), specified_prefix_parsed.prefixlen)
-    if matched_in_vrps is None:
-        logger.debug("{} is not matched in VRPs.".format(specified_prefix))
-        return PrefixRovResultStruct(specified_prefix, None, None, RovResult.NOT_FOUND)
-
-    # ロンゲストマッチしたprefixと、それを広告してたASNを取り出す
-    advertising_asn = ip_lookup_result_rib.asn
-    matched_advertised_prefix = ip_lookup_result_rib.prefix
-
-    #logger.debug("target_prefix: {}".format(matched_advertised_prefix))
+        return [PrefixRovResultStruct(specified_prefix, None, None, RovResult.NOT_ADVERTISED)]
+
+    # ロンゲストマッチしたprefixと、それを広告してたASNたちを取り出す
+    matched_network_int, matched_prefixlen, origins = matched_routes
+    matched_advertised_prefix = format_prefix(version, matched_network_int, matched_prefixlen)
+
+    # 検証するのは実際に広告されてた経路(ロンゲストマッチしたprefixとそれを広告してたAS)
+    result_structs = []
+    for advertising_asn, _ in origins:
+        rov_result = validate_route(vrps, version, matched_network_int, matched_prefixlen, advertising_asn)
+        result_structs.append(PrefixRovResultStruct(specified_prefix, matched_advertised_prefix, advertising_asn,
+                                                    rov_result))
+    return result_structs
+
+
+# あるprefixと範囲の重なる、広告されている経路を全部ROVする関数 (rov()が検証するのはロンゲストマッチした経路だけ)
+# more_specificsなら指定されたprefixと同じか長い経路を、less_specificsなら指定されたprefixを含む(同じか短い)経路を検証し、
+# RIBでの並び(ネットワークアドレス、プレフィックス長の順)でPrefixRovResultStructのリストを返す。経路がなければNOT_ADVERTISEDが1つ
+# 経路はRIBの索引の部分木と親のたどりで探すので、かかる時間はRIBの大きさによらず、見つかった経路の数に比例する
+def rov_range(vrps, rib, specified_prefix, more_specifics=True, less_specifics=False):
+    version, network_int, prefixlen = parse_prefix(specified_prefix)
+    entry_indexes = []
+    if less_specifics:
+        # 同じprefixの経路は、more_specificsならwithin_indexes()のほうで拾う
+        for idx in rib.covering_indexes(version, network_int, prefixlen):
+            if not more_specifics or rib.entry(idx)[2] < prefixlen:
+                entry_indexes.append(idx)
+        # covering_indexes()は長いprefixから返すので、RIBでの並びに直す
+        entry_indexes.reverse()
+    if more_specifics:
+        entry_indexes.extend(rib.within_indexes(version, network_int, prefixlen))
+
+    if len(entry_indexes) == 0:
+        logger.debug("No route overlapping the specified prefix exists in RIB.")
+        return [PrefixRovResultStruct(specified_prefix, None, None, RovResult.NOT_ADVERTISED)]
+
+    result_structs = []
+    for idx in entry_indexes:
+        _, route_network_int, route_prefixlen, origin_asn, _ = rib.entry(idx)
+        rov_result = validate_route(vrps, version, route_network_int, route_prefixlen, origin_asn)
+        result_structs.append(PrefixRovResultStruct(specified_prefix,
+                                                    format_prefix(version, route_network_int, route_prefixlen),
+                                                    origin_asn, rov_result))
+    return result_structs
+
+
+# 与えられたASNが広告してた経路を全部検証し、[(prefix文字列, RovResult), ...] をprefix文字列の順で返す。広告してなければNone
+# 同じprefixを他のASも広告していても(MOAS)、検証するのはこのASが広告した経路
+# RibTableなら、prefixを文字列にしてからパースし直さずに、エントリの整数をそのまま検証する
+def validate_as_routes(vrps, rib, specified_asn):
+    origin_asn = int(specified_asn)
+    if hasattr(rib, "as_entry_indexes"):
+        entry_indexes = rib.as_entry_indexes(origin_asn)
+        if entry_indexes is None:
+            return None
+        results = []
+        for idx in entry_indexes:
+            version, network_int, prefixlen, _, _ = rib.entry(idx)
+            results.append((format_prefix(version, network_int, prefixlen),
+                            validate_route(vrps, version, network_int, prefixlen, origin_asn)))
+        results.sort(key=lambda result: result[0])
+        return results
 
-    # TODO: pyasnのget_as_prefixes()はget_as_prefixes_effective()とどう違う？帰ってくるのがsetとlistという違いがあるが...
-    prefix_list_in_vrps = vrps.get_as_prefixes(advertising_asn)
+    prefix_list_in_rib = rib.get_as_prefixes(specified_asn)
+    if prefix_list_in_rib is None:
+        return None
+    # (setの順番は実行ごとに変わりうるので、出力順を固定するためにソートしておく)
+    return [(prefix, validate_route(vrps, *parse_prefix(prefix), origin_asn)) for prefix in sorted(prefix_list_in_rib)]
 
-    # ROAに登録されてるプレフィックスは、BGP経路情報の上で、指定されたprefixにロンゲストマッチしたprefixをカバーできているか調べる
-    # RIBのエントリのprefixは、必ずROA登録されてるprefixよりも小さいはず。(割り当て時より細分化して広告されることはあっても逆はないはず)
-    valid_flag = IPSet([matched_advertised_prefix]).issubset(IPSet(prefix_list_in_vrps))
-    rov_result = RovResult.VALID if valid_flag else RovResult.INVALID
 
-    result_struct = PrefixRovResultStruct(specified_prefix, matched_advertised_prefix, advertising_asn, rov_result)
-    # logger.debug("to_dict_test {}".format(result_struct.to_dict()))
-    return result_struct
+# validate_as_routes()の結果から、rov_with_asn()の返り値(AsnRovResultStruct)を作る
+def asn_rov_result_struct(specified_asn, results):
+    if results is None:
+        logger.debug("ASN doesn't exist in RIB")
+        return AsnRovResultStruct(specified_asn, {})
+    origin_asn = int(specified_asn)
+    return AsnRovResultStruct(specified_asn, {prefix: PrefixRovResultStruct(prefix, prefix, origin_asn, rov_result)
+                                              for prefix, rov_result in results})
 
 
 # 与えられたASNが広告してたprefixを調べ、全部ROVする
 def rov_with_asn(vrps, rib, specified_asn):
-    # 与えられたASNが広告してるprefixを調べる
-    prefix_list_in_rib = rib.get_as_prefixes(specified_asn)
+    return asn_rov_result_struct(specified_asn, validate_as_routes(vrps, rib, specified_asn))
+
+
+# 経路(prefixとOrigin AS)を含むVRPたち covering_vrps ([(VRPのプレフィックス長, ASN, maxLength), ...]) から、
+# その経路が他のASのROAに違反しているかを調べ、違反していればROA登録したAS(のVRP)ごとにViolationResultStructを返すジェネレータ
+# 経路がRFC 6811でVALIDなら(同じASの、maxLength以内のVRPがあれば)違反ではない。roa_asnsを指定すると、そのASたちのROAに対する違反だけ返す
+def _route_violations(version, network_int, prefixlen, origin_asn, covering_vrps, roa_asns=None):
+    for _, asn, max_length in covering_vrps:
+        if asn == origin_asn and asn != 0 and prefixlen <= max_length:
+            return
+    max_prefixlen = 32 if version == 4 else 128
+    advertised_prefix = format_prefix(version, network_int, prefixlen)
+    for vrp_prefixlen, asn, max_length in covering_vrps:
+        if asn == origin_asn or (roa_asns is not None and asn not in roa_asns):
+            continue
+        shift = max_prefixlen - vrp_prefixlen
+        roa_prefix = format_prefix(version, (network_int >> shift) << shift, vrp_prefixlen)
+        yield ViolationResultStruct(asn, roa_prefix, max_length, advertised_prefix, origin_asn)
+
+
+# RIBの全経路について、他のASがROA登録したprefix(と同じか長いprefix)を広告している違反を探すジェネレータ
+# VRPsとRIBをそれぞれ(ネットワークアドレス, プレフィックス長)の順に並べて1回ずつ前から読むだけで済ませる (経路ごとにVRPsを引かない)
+# 読みながら「今の経路のアドレスを含むVRP」をスタックに積んでおく。prefixどうしは入れ子か重ならないかのどちらかなので、
+# スタックは外側から内側へ入れ子になっていて、経路の手前で範囲が終わっているものを上から捨てれば、残りがその経路を含むVRPになる
+# 結果はRIBの経路の順に返す。roa_asnsを指定すると、そのASたちのROAに対する違反だけ返す
+def scan_violations(vrps, rib, roa_asns=None):
+    for version in (4, 6):
+        max_prefixlen = 32 if version == 4 else 128
+        vrp_entries = iter(vrps.entries(version))
+        next_vrp = next(vrp_entries, None)
+        # 積んでいるVRP [(VRPのプレフィックス長, ASN, maxLength), ...] と、それぞれの範囲の末尾アドレス
+        stack = []
+        stack_ends = []
+        for network_int, prefixlen, origin_asn, _ in rib.entries(version):
+            # この経路より前に並ぶ(同じネットワークアドレスなら同じか短い)VRPを積む
+            while next_vrp is not None and (next_vrp[0], next_vrp[1]) <= (network_int, prefixlen):
+                vrp_network_int, vrp_prefixlen, asn, max_length = next_vrp
+                while stack_ends and stack_ends[-1] < vrp_network_int:
+                    stack.pop()
+                    stack_ends.pop()
+                stack.append((vrp_prefixlen, asn, max_length))
+                stack_ends.append(vrp_network_int + (1 << (max_prefixlen - vrp_prefixlen)) - 1)
+                next_vrp = next(vrp_entries, None)
+            while stack_ends and stack_ends[-1] < network_int:
+                stack.pop()
+                stack_ends.pop()
+            # どのVRPにも含まれない経路(NOT_FOUND)は違反ではない
+            if stack:
+                yield from _route_violations(version, network_int, prefixlen, origin_asn, stack, roa_asns)
+
+
+# 指定されたprefixと同じか長い、広告されている経路について、他のASのROAに違反しているものを探すジェネレータ
+def scan_violations_within_prefix(vrps, rib, specified_prefix):
+    version, network_int, prefixlen = parse_prefix(specified_prefix)
+    for idx in rib.within_indexes(version, network_int, prefixlen):
+        _, route_network_int, route_prefixlen, origin_asn, _ = rib.entry(idx)
+        covering_vrps = vrps.covering_vrps_parsed(version, route_network_int, route_prefixlen)
+        yield from _route_violations(version, route_network_int, route_prefixlen, origin_asn, covering_vrps)
+
+
+# VRPsのファイルを読み込む。元のファイルより新しいスナップショットがあれば、パースせずにそれをmmapして使う
+def _load_vrps(file_path_vrps):
+    if roamon_verify_snapshot.is_snapshot_fresh(file_path_vrps):
+        roamon_verify_stats.cache_hit("snapshot")
+        return roamon_verify_snapshot.SnapshotVrpDB(roamon_verify_snapshot.snapshot_path(file_path_vrps))
+    roamon_verify_stats.cache_miss("snapshot")
+    return VrpTrie.from_file(file_path_vrps)
+
+
+# RIBのファイルを読み込む。スナップショットについてはVRPsと同じ
+def _load_rib(file_path_rib):
+    if roamon_verify_snapshot.is_snapshot_fresh(file_path_rib):
+        roamon_verify_stats.cache_hit("snapshot")
+        return roamon_verify_snapshot.RibTable(roamon_verify_snapshot.snapshot_path(file_path_rib))
+    roamon_verify_stats.cache_miss("snapshot")
+    return roamon_verify_snapshot.RibTable.from_file(file_path_rib)
+
+
+# ファイルパスを与えるとVRPsとRIBのファイルを読み込む
+# VRPsはmaxLengthと複数のOrigin ASを保持できるVrpTrie、RIBはprefixごとに全部のOrigin ASを保持できるRibTableで読み込む
+def load_all_data(file_path_vrps, file_path_rib):
+    asndb_vrps = load_vrps(file_path_vrps)
+    asndb_rib = load_rib(file_path_rib)
 
-    # 広告してなければここで終了
-    does_exist_in_rib = not (prefix_list_in_rib is None)
-    if not does_exist_in_rib:
-        logger.debug("ASN doesn't exist in RIB")
-        return AsnRovResultStruct(specified_asn, {})
+    return {"vrps": asndb_vrps, "rib": asndb_rib}
 
-    # 与えられたASNが広告してたprefixを全部ROVする
-    result_dict = {}
-    for prefix in prefix_list_in_rib:
-        result_dict[prefix] = rov(vrps, rib, prefix)
-
-    asn_rov_result_struct = AsnRovResultStruct(specified_asn, result_dict)
-    # logger.debug("to_dict_test {}".format(asn_rov_result_struct.to_dict()))
-    return asn_rov_result_struct
-
-
-# 指定されたASがROA登録したprefixが他のROA登録していないASに勝手に(同じかより小さいプレフィックスで)経路広告されていないか調べる
-# TODO: 検討して使わないなら消す
-def is_violated_asn(vrps, rib, specified_asn):
-    # 　指令されたASがROA登録したprefixを調べる
-    registered_prefixes_by_target_asn = vrps.get_as_prefixes(specified_asn)
-
-    # 指令されたASがROA登録したprefixたちについて、それより小さい(経路選択時に勝っちゃう)prefixが経路広告されてないか調べる
-    longest_matched_prefixes_and_asn = []
-    for prefix in registered_prefixes_by_target_asn:
-        prefix_parsed = ipaddress.ip_network(prefix)
-        # logger.debug("HOGEHOGE! netaddr {} netpref {} org_pref {}".format(network_addr, network_prefix, prefix) )
-        matched = rib.radix.search_best(str(prefix_parsed.network_address), prefix_parsed.prefixlen)
-        # 検索失敗時はNoneが返る
-        if matched is not None:
-            longest_matched_prefixes_and_asn.append({"prefix": matched.prefix, "asn": matched.asn})
-
-    # 指定されたASがROA登録してたPrefixより、経路選択時に優先されちゃう(=プレフィックスが同じかより小さい)現実に広告されてた経路を広告してたASは、ROA登録してたのか確かめる
-    for suspiciouses in longest_matched_prefixes_and_asn:
-        registered_prefixes = vrps.get_as_prefixes(suspiciouses["asn"])
-        is_violate_flag = None
-        # そのASがROA登録してない場合
-        if registered_prefixes is None:
-            logger.debug(
-                "longest_matched_prefix {} advertised by AS{} are not ROA registered.".format(suspiciouses["prefix"],
-                                                                                              suspiciouses["asn"]))
-            # ROA登録してないだけで意図した正当な経路広告なのか、それとも経路ハイジャックなのかわからない...
-            # なので潜在的に経路ハイジャックですということでTrue
-            is_violate_flag = True
-        else:
-            # そのASがROA登録しててかつ、経路広告してるprefixがROA登録されてるprefixでちゃんとカバーされてるかどうか
-            # logger.debug("HOGEHOGE! prefix {} asn {}".format(suspiciouses["prefix"], suspiciouses["asn"]) )
-            is_roa_registered = IPSet([suspiciouses["prefix"]]).issubset(
-                IPSet(vrps.get_as_prefixes(suspiciouses["asn"])))
-            is_violate_flag = not is_roa_registered
-
-        # TODO: プリントじゃなくてなんか返す形にしたほうがいい...
-        logger.info("{} {} {} {}".format(specified_asn, suspiciouses["prefix"], suspiciouses["asn"], is_violate_flag))
-
-
-# 指定されたIPアドレス(/32に限らない)を経路広告してたASと、それをROA登録したASが同じかどうか調べる
-# TODO: これROVとやること被ってるので消す?
-def is_violated_prefix(vrps, rib, specified_prefix):
-    # 指定されたIPアドレス(/32に限らない)にロンゲストマッチするprefixを広告してるASを探す
-    specified_prefix_parsed = ipaddress.ip_network(specified_prefix)
-    matched_in_rib = rib.radix.search_best(str(specified_prefix_parsed.network_address),
-                                           specified_prefix_parsed.prefixlen)
-    is_violated_flag = None
-    # 検索失敗時(指定IPは経路広告されていない)
-    if matched_in_rib is None:
-        logger.debug("This ip {} is not longest matched in RIB.".format(specified_prefix))
-        is_violated_flag = False
-        return is_violated_flag
-
-    route_advertising_asn = matched_in_rib.asn
-
-    # 指定されたIPアドレス(/32に限らない)にロンゲストマッチするprefixをROA登録してるASを調べる
-    matched_in_vrps = rib.radix.search_best(str(specified_prefix_parsed.network_address),
-                                            specified_prefix_parsed.prefixlen)
-    # ROA登録されてなかった場合、単にROA登録してないだけであって経路ハイジャックかどうか全くわからんのでFalse
-    if matched_in_vrps is None:
-        logger.debug("This ip {} is not longest matched in VRPs.".format(specified_prefix))
-        is_violated_flag = False
-        return is_violated_flag
-    route_registering_asn = matched_in_vrps.asn
-
-    # 経路広告してるASとROA登録したASが違うなら経路ハイジャックとしてる.
-    #  だけど、例えばROA登録を、AS hogeが/16で、AS fugaが/24でしていたとする。経路広告はAS hogeのみが行ってた場合、おそらく当事者たちでは合意が取れているにもかかわらず「経路ハイジャック！」として検知されてしまう (検索でヒットするのはAS fugaのほうだから、ROA登録したASと広告してるASが異なるという判断)
-    #  しかし、ROAを使ってOrigin ASを検証する場合、上のようなのは「OriginASが正当でない」として検出されるワケだから、別にいっか！ROAをちゃんと管理しないやつがわるい。
-    is_violated_flag = not (route_advertising_asn == route_registering_asn)
-
-    return is_violated_flag
-
-
-# ファイルパスを与えるとVRPsとRIBのpyasn用のファイルを読み込む
-def load_all_data(file_path_vrps, file_path_rib):
-    asndb_vrps = pyasn.pyasn(file_path_vrps)
+
+# VRPsのファイルだけ読み込む (RIBをBGPのUPDATEから作るときなど)
+def load_vrps(file_path_vrps):
+    with roamon_verify_stats.phase("load_vrps"):
+        vrps = _load_vrps(file_path_vrps)
     logger.debug("finish load vrps from {}".format(file_path_vrps))
-    asndb_rib = pyasn.pyasn(file_path_rib)
+    return vrps
+
+
+# RIBのファイルだけ読み込む (VRPsをRTRで受け取るときなど)
+def load_rib(file_path_rib):
+    with roamon_verify_stats.phase("load_rib"):
+        rib = _load_rib(file_path_rib)
     logger.debug("finish load rib from {}".format(file_path_rib))
+    return rib
 
-    return {"vrps": asndb_vrps, "rib": asndb_rib}
 
+# ワーカープロセスの初期化。VRPsとRIBをプロセスごとに1回だけ受け取る
+def _init_worker(vrps, rib):
+    global _worker_vrps, _worker_rib
+    _worker_vrps = vrps
+    _worker_rib = rib
+
+
+# ワーカープロセスで実行される関数たち。シャード(ASNやprefixのリスト)をまとめて処理する
+# AsnRovResultStructはdict_keysを持っていてpickleできないので、ASNと結果のdictの組で返す
+# --statsでASごとのコストを記録できるように、対象ごとにワーカーの中でかかった秒数も付けて返す
+def _rov_with_asn_shard(asns):
+    results = []
+    for asn in asns:
+        start = time.perf_counter()
+        rov_results_dict = rov_with_asn(_worker_vrps, _worker_rib, asn).rov_results_dict
+        results.append((asn, rov_results_dict, time.perf_counter() - start))
+    return results
+
+
+def _rov_shard(prefixes):
+    return [rov(_worker_vrps, _worker_rib, prefix) for prefix in prefixes]
 
-# ASNのリストを渡し、そのASらが広告している全てのprefixに対してROVを行う
-def check_specified_asns(vrps, rib, target_asns):
-    asn_rov_result_struct_dict = {}
-    for asn in tqdm(target_asns):
-        asn_rov_result_struct = rov_with_asn(vrps, rib, asn)
-        logger.debug(" restype: {} res:   {}".format(type(asn_rov_result_struct), str(asn_rov_result_struct)))
-
-        # 処理が進むにつれ結果がでてきてほしい(貯めて最後に一気に出るのはいや)のでここでプリントしてしまう
-        for prefix, rov_res in asn_rov_result_struct.rov_results_dict.items():
-            print(asn, end="\t")
-            print(prefix, end="\t")
-            # print(rov_res.matched_advertised_prefix, end="\t")
-            # print(rov_res.advertising_asn, end="\t")
-            print(rov_res.rov_result)
-
-        asn_rov_result_struct_dict[asn] = asn_rov_result_struct
-    return asn_rov_result_struct_dict
-
-
-# prefixのリストを渡し、全てについてROVをする
-def check_specified_prefixes(vrps, rib, specified_prefixes):
-    result = {}
-    for prefix in tqdm(specified_prefixes):
-        result[prefix] = rov(vrps, rib, prefix)
 
-        # 処理が進むにつれ結果がでてきてほしいのでここでプリントしてしまう
-        print(prefix, end="\t")
-        # print(result[prefix].matched_advertised_prefix, end="\t")
-        # print(result[prefix].advertising_asn, end="\t")
-        print(result[prefix].rov_result)
+def _rov_range_shard(more_specifics, less_specifics, prefixes):
+    return [rov_range(_worker_vrps, _worker_rib, prefix, more_specifics, less_specifics) for prefix in prefixes]
 
+
+def _rov_target_shard(targets):
+    results = []
+    for kind, target in targets:
+        start = time.perf_counter()
+        result = _to_picklable(_rov_target(_worker_vrps, _worker_rib, kind, target))
+        results.append((result, time.perf_counter() - start))
+    return results
+
+
+# AsnRovResultStructはpickleできないので、ワーカーから返すときは(ASN, 結果のdict)の組にする
+def _to_picklable(result_struct):
+    if isinstance(result_struct, AsnRovResultStruct):
+        return result_struct.specified_asn, result_struct.rov_results_dict
+    return result_struct
+
+
+def _from_picklable(result):
+    if isinstance(result, tuple):
+        return AsnRovResultStruct(*result)
     return result
 
 
-# TODO: 検討して使わないなら消す
-def check_violation_specified_asns(vrps, rib, target_asns):
-    for asn in tqdm(target_asns):
-        is_violated_asn(vrps, rib, asn)
+# ワーカープロセスのプールを作る
+def _create_pool(vrps, rib, workers):
+    # forkできるならforkして、読み込み済みのデータを子プロセスにそのまま引き継ぐ (spawnのときはpickleして渡される)
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context()
+    return context.Pool(workers, initializer=_init_worker, initargs=(vrps, rib))
+
+
+# 対象のリストをシャードに分けてプロセスプールで処理し、結果を入力と同じ順番で1つずつ返すジェネレータ
+def _imap_shards(vrps, rib, shard_func, targets, workers):
+    targets = list(targets)
+    if len(targets) == 0:
+        return
+
+    shards = divide_list_equally(targets, workers * SHARDS_PER_WORKER)
+    with _create_pool(vrps, rib, workers) as pool:
+        # imapは結果を入力と同じ順番で返すので、ワーカー数によらず出力順は同じになる
+        for shard_result in pool.imap(shard_func, shards):
+            for result in shard_result:
+                yield result
+
+
+# 長さのわからない対象の列をチャンクに分けてプロセスプールで処理し、結果を入力と同じ順番で1つずつ返すジェネレータ
+# Pool.imapは入力を先読みし続けてしまうので、処理中のチャンクをワーカー数の2倍までに抑えてメモリ使用量を一定にする
+def _imap_chunks_streaming(vrps, rib, shard_func, chunks, workers):
+    with _create_pool(vrps, rib, workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(shard_func, (chunk,)))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+
+# イテレータを指定された個数ずつのリストに分けて返すジェネレータ
+def _chunked(iterable, chunk_size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# 指定されたASNたちをROVした結果(AsnRovResultStruct)を順番に返すジェネレータ
+# cache(roamon_verify_cache.RovCache)を渡すと、1プロセスのときはそれを通して検索する
+def _rov_with_asns(vrps, rib, target_asns, workers, cache=None):
+    if workers <= 1:
+        rov_with_asn_func = rov_with_asn if cache is None else cache.rov_with_asn
+        for asn in target_asns:
+            yield rov_with_asn_func(vrps, rib, asn)
+    else:
+        # ASごとのコスト(--stats)には、結果を待った時間ではなくワーカーで測った時間を使う
+        for asn, rov_results_dict, seconds in _imap_shards(vrps, rib, _rov_with_asn_shard, target_asns, workers):
+            roamon_verify_stats.set_worker_item_seconds(seconds)
+            yield AsnRovResultStruct(asn, rov_results_dict)
+
+
+# 指定されたprefixたちをROVした結果(PrefixRovResultStructのリスト)を順番に返すジェネレータ
+# more_specificsかless_specificsを指定すると、rov_range()で範囲の重なる経路を全部検証する (cacheは使わない)
+def _rov_prefixes(vrps, rib, specified_prefixes, workers, cache=None, more_specifics=False, less_specifics=False):
+    if more_specifics or less_specifics:
+        if workers <= 1:
+            for prefix in specified_prefixes:
+                yield rov_range(vrps, rib, prefix, more_specifics, less_specifics)
+        else:
+            shard_func = partial(_rov_range_shard, more_specifics, less_specifics)
+            yield from _imap_shards(vrps, rib, shard_func, specified_prefixes, workers)
+    elif workers <= 1:
+        rov_func = rov if cache is None else cache.rov
+        for prefix in specified_prefixes:
+            yield rov_func(vrps, rib, prefix)
+    else:
+        yield from _imap_shards(vrps, rib, _rov_shard, specified_prefixes, workers)
+
+
+# 入力ファイルの1行から、ROVする対象を("ip", prefix)か("asn", ASN)の組として取り出す
+# 空行と#から始まるコメント行はNone。ASNは"64511"でも"AS64511"でもよい
+def parse_target_line(line):
+    tokens = line.split()
+    if len(tokens) == 0 or tokens[0].startswith("#"):
+        return None
+    token = tokens[0]
+    if token[:2].upper() == "AS" and token[2:].isdigit():
+        return "asn", token[2:]
+    if token.isdigit():
+        return "asn", token
+    return "ip", token
+
+
+# 行のイテレータ(ファイルオブジェクトなど)から、ROVする対象を順番に返すジェネレータ
+# prefixとして読めない行は、何行目かをログに出して読み飛ばす (1行の書き間違いで全体を止めない)
+def iter_targets(lines):
+    for line_number, line in enumerate(lines, 1):
+        target = parse_target_line(line)
+        if target is None:
+            continue
+        if target[0] == "ip":
+            try:
+                parse_prefix(target[1])
+            except ValueError as e:
+                logger.warning("skip line {}: {}".format(line_number, e))
+                roamon_verify_stats.count("skipped_lines")
+                continue
+        yield target
+
+
+# 対象1つをROVする。prefixならPrefixRovResultStructのリスト、ASNならAsnRovResultStructを返す
+def _rov_target(vrps, rib, kind, target, cache=None):
+    if cache is not None:
+        return cache.rov_with_asn(vrps, rib, target) if kind == "asn" else cache.rov(vrps, rib, target)
+    if kind == "asn":
+        return rov_with_asn(vrps, rib, target)
+    return rov(vrps, rib, target)
+
+
+# ("ip", prefix)か("asn", ASN)の組の列を受け取り、ROVの結果を計算できたそばから入力と同じ順番で返すジェネレータ
+# 結果を貯め込まないので、入力がどれだけ長くてもメモリ使用量は一定
+def rov_targets_streaming(vrps, rib, targets, workers=1, cache=None):
+    if workers <= 1:
+        for kind, target in targets:
+            yield _rov_target(vrps, rib, kind, target, cache)
+    else:
+        chunks = _chunked(targets, STREAM_CHUNK_SIZE)
+        for result, seconds in _imap_chunks_streaming(vrps, rib, _rov_target_shard, chunks, workers):
+            roamon_verify_stats.set_worker_item_seconds(seconds)
+            yield _from_picklable(result)
+
+
+# 結果の書き出し先。指定されてなければ標準出力にTSVで書き出す
+@contextmanager
+def _writer_or_default(writer, columns=roamon_verify_output.COLUMNS):
+    if writer is not None:
+        yield writer
+        writer.flush()
+    else:
+        with roamon_verify_output.open_writer(columns=columns) as default_writer:
+            yield default_writer
+
+
+# prefixを指定したROVの結果(PrefixRovResultStructのリスト)を統計に数える。広告されていなければ検証はしていない
+def _count_prefix_results(prefix_rov_result_structs):
+    roamon_verify_stats.count("rib_lookups")
+    if prefix_rov_result_structs[0].rov_result != RovResult.NOT_ADVERTISED:
+        roamon_verify_stats.count("routes_validated", len(prefix_rov_result_structs))
+
 
+# ASNのリストを渡し、そのASらが広告している全てのprefixに対してROVを行う
+# workersに2以上を指定すると、その数のプロセスで並列に処理する
+# 結果はwriter(roamon_verify_output.RovResultWriter)に書き出す。指定されてなければ標準出力にTSVで書き出す
+# resultsに計算済みの結果(AsnRovResultStructの列)を渡すと、それを書き出す
+# summary(roamon_verify_summary.AsnRovSummary)を渡すと、書き出すのと同じループでASごとの結果を数える
+# 結果はAsnRovResultTable ({ASN: AsnRovResultStruct}のように使える) で返す
+def check_specified_asns(vrps, rib, target_asns, workers=1, writer=None, results=None, cache=None, summary=None):
+    if results is None:
+        results = _rov_with_asns(vrps, rib, target_asns, workers, cache)
+    asn_rov_result_table = AsnRovResultTable()
+    with _writer_or_default(writer) as writer:
+        for asn_rov_result_struct in tqdm(roamon_verify_stats.timed(results, "validate"), total=len(target_asns)):
+            logger.debug(" restype: {} res:   {}".format(type(asn_rov_result_struct), str(asn_rov_result_struct)))
+            routes = len(asn_rov_result_struct.rov_results_dict)
+            roamon_verify_stats.count("routes_validated", routes)
+            roamon_verify_stats.record_asn_cost(asn_rov_result_struct.specified_asn, routes)
+
+            # 処理が進むにつれ結果がでてきてほしい(貯めて最後に一気に出るのはいや)のでここで書き出してしまう
+            with roamon_verify_stats.phase("output"):
+                writer.write_asn_result(asn_rov_result_struct)
+            if summary is not None:
+                with roamon_verify_stats.phase("summary"):
+                    summary.add(asn_rov_result_struct)
+
+            asn_rov_result_table.append(asn_rov_result_struct)
+    return asn_rov_result_table
+
+
+# prefixのリストを渡し、全てについてROVをする。結果は {prefix: [PrefixRovResultStruct, ...]} (Origin ASごと)
+# more_specifics、less_specificsを指定すると、ロンゲストマッチした経路ではなく、範囲の重なる経路を全部検証する (rov_range())
+def check_specified_prefixes(vrps, rib, specified_prefixes, workers=1, writer=None, cache=None,
+                             more_specifics=False, less_specifics=False):
+    result = {}
+    with _writer_or_default(writer) as writer:
+        for prefix_rov_result_structs in tqdm(roamon_verify_stats.timed(
+                _rov_prefixes(vrps, rib, specified_prefixes, workers, cache, more_specifics, less_specifics),
+                "validate"), total=len(specified_prefixes)):
+            prefix = prefix_rov_result_structs[0].roved_prefix
+            result[prefix] = prefix_rov_result_structs
+            _count_prefix_results(prefix_rov_result_structs)
+
+            # 処理が進むにつれ結果がでてきてほしいのでここで書き出してしまう
+            with roamon_verify_stats.phase("output"):
+                for prefix_rov_result_struct in prefix_rov_result_structs:
+                    writer.write_prefix_result(prefix_rov_result_struct)
 
-# IPアドレス("8.8.8.0/24"とか"8.8.8.8"とか)を与えて、経路ハイジャック的なのを調べる
-# TODO: 検討して使わないなら消す
-def check_violation_specified_prefixes(vrps, rib, specified_prefixes):
-    for prefix in tqdm(specified_prefixes):
-        print('{} {}'.format(str(prefix), is_violated_prefix(vrps, rib, prefix)))
+    return result
 
 
-# VRPsに出てくる全てのASNに対して、RIBとVRPsの食い違いがないか調べる
-def check_all_asn_in_vrps(vrps, rib):
-    all_target_asns = set()
-    for node in vrps.radix.nodes():
-        all_target_asns.add(node.asn)
+# ("ip", prefix)か("asn", ASN)の組の列を渡し、全てについてROVして結果を順次書き出す
+# check_specified_asns()などと違って結果を返さない(貯め込まない)ので、数百万行の入力でもメモリを食わない
+def check_targets_streaming(vrps, rib, targets, workers=1, writer=None, cache=None):
+    with _writer_or_default(writer) as writer:
+        for result_struct in tqdm(roamon_verify_stats.timed(rov_targets_streaming(vrps, rib, targets, workers, cache),
+                                                            "validate")):
+            if isinstance(result_struct, AsnRovResultStruct):
+                routes = len(result_struct.rov_results_dict)
+                roamon_verify_stats.count("routes_validated", routes)
+                roamon_verify_stats.record_asn_cost(result_struct.specified_asn, routes)
+                with roamon_verify_stats.phase("output"):
+                    writer.write_asn_result(result_struct)
+            else:
+                _count_prefix_results(result_struct)
+                with roamon_verify_stats.phase("output"):
+                    for prefix_rov_result_struct in result_struct:
+                        writer.write_prefix_result(prefix_rov_result_struct)
+
+
+# 違反(ViolationResultStructの列)をwriterに順次書き出し、書き出した数を返す
+# 全経路を調べると違反は大量になりうるので、貯め込まずに書き出したそばから捨てる
+def _write_violations(violations, writer):
+    n_violations = 0
+    with _writer_or_default(writer, roamon_verify_output.VIOLATION_COLUMNS) as writer:
+        for violation in tqdm(roamon_verify_stats.timed(violations, "validate")):
+            roamon_verify_stats.count("violations")
+            with roamon_verify_stats.phase("output"):
+                writer.write_violation(violation)
+            n_violations += 1
+    return n_violations
+
+
+# 指定されたASたちがROA登録したprefix(と同じか長いprefix)を、別のASが広告していて、その経路がVALIDにならないものを探す
+# 結果はwriter(roamon_verify_output.RovResultWriter)に書き出し、書き出した違反の数を返す (結果はメモリに貯めない)
+def check_violation_specified_asns(vrps, rib, target_asns, writer=None):
+    roa_asns = set(int(asn) for asn in target_asns)
+    return _write_violations(scan_violations(vrps, rib, roa_asns), writer)
+
+
+# IPアドレス("8.8.8.0/24"とか"8.8.8.8"とか)を与えて、それと同じか長い広告された経路のうち、他のASのROAに違反しているものを探す
+def check_violation_specified_prefixes(vrps, rib, specified_prefixes, writer=None):
+    violations = (violation for prefix in specified_prefixes
+                  for violation in scan_violations_within_prefix(vrps, rib, prefix))
+    return _write_violations(violations, writer)
+
+
+# roamon_verify_batch.validate_rib()でまとめて検証したRIBの全経路の結果から、指定されたASNたちの結果(AsnRovResultStruct)を
+# 順番に返すジェネレータ。rov_with_asn()を1つずつ呼んだときと同じ結果を同じ順番で返す
+def _rov_with_asns_batch(rib, result_ids, target_asns):
+    for asn in target_asns:
+        entry_indexes = rib.as_entry_indexes(asn)
+        if entry_indexes is None:
+            yield AsnRovResultStruct(asn, {})
+            continue
+        origin_asn = int(asn)
+        result_dict = {}
+        for prefix, idx in sorted((rib.prefix(idx), idx) for idx in entry_indexes):
+            result_dict[prefix] = PrefixRovResultStruct(prefix, prefix, origin_asn,
+                                                         _ROV_RESULTS_BY_ID[int(result_ids[idx])])
+        yield AsnRovResultStruct(asn, result_dict)
+
 
-    return check_specified_asns(vrps, rib, all_target_asns)
+# VRPsに出てくる全てのASNに対して、RIBとVRPsの食い違いがないか調べる
+# 1プロセスでnumpyが使えるなら、RIBの全経路をまとめて検証する(結果は同じ)
+# summary(roamon_verify_summary.AsnRovSummary)を渡すと、ASごとの集計も同じループで作る
+def check_all_asn_in_vrps(vrps, rib, workers=1, writer=None, summary=None):
+    all_target_asns = sorted(vrps.asns())
 
+    import roamon_verify_batch
+    if workers <= 1 and roamon_verify_batch.is_available():
+        # 全経路を1回で検証するので、ASごとにかかった時間は測れない
+        roamon_verify_stats.disable_asn_costs("all routes were validated at once with numpy")
+        with roamon_verify_stats.phase("validate_batch"):
+            result_ids = roamon_verify_batch.validate_rib(vrps, rib)
+        return check_specified_asns(vrps, rib, all_target_asns, workers, writer,
+                                    results=_rov_with_asns_batch(rib, result_ids, all_target_asns), summary=summary)
+    return check_specified_asns(vrps, rib, all_target_asns, workers, writer, summary=summary)
 
-def check_all_prefixes_in_vrps(vrps, rib):
-    all_target_prefixes = set()
-    for node in vrps.radix.nodes():
-        all_target_prefixes.add(node.prefix)
 
-    return check_specified_prefixes(vrps, rib, all_target_prefixes)
+def check_all_prefixes_in_vrps(vrps, rib, workers=1, writer=None):
+    all_target_prefixes = vrps.prefixes()
 
+    return check_specified_prefixes(vrps, rib, sorted(all_target_prefixes), workers, writer)
 
-# TODO: 検討して使わないなら消す
-def check_violation_all_asn_in_vrps(vrps, rib):
-    all_target_asns = set()
-    for node in vrps.radix.nodes():
-        all_target_asns.add(node.asn)
 
-    check_violation_specified_asns(vrps, rib, all_target_asns)
+# RIBの全経路について、他のASのROAに違反しているものを探す
+# VRPsとRIBを並べて1回ずつ読むだけなので、時間はデータの大きさに比例する
+def check_violation_all_asn_in_vrps(vrps, rib, writer=None):
+    return _write_violations(scan_violations(vrps, rib), writer)
 
 
 def main():
@@ -22,113 +22,546 @@
 
 # 引数の処理はここを参考にした：https://qiita.com/oohira/items/308bbd33a77200a35a3d
 
+# シェルのループから何度も呼ばれるので、起動を速くするためにimportした時点では何もしない
+# コンフィグの読み込みとロゴの描画はmain()で、サブコマンドでしか使わないモジュール(requests, tqdmなどを読み込むもの)は
+# それぞれのサブコマンドの関数の中でimportする
+
 import argparse
-import roamon_verify_checker
-import roamon_verify_getter
-import os
+import sys
 import logging
-from pyfiglet import Figlet
 import configparser
 
 # ログ関係の設定 (適当)
 logger = logging.getLogger(__name__)
 
+# デフォルトのコンフィグファイル (カレントディレクトリ)
+FILE_PATH_CONFIG = 'config.ini'
+
+# --profileのときに標準エラー出力に表示する関数の数
+PROFILE_PRINT_LINES = 30
+
+# --cache-sizeのデフォルト。roamon_verify_cache.DEFAULT_CACHE_SIZEと同じ値
+# (roamon_verify_cacheはroamon_verify_checkerを通してtqdmをimportするので、起動時にはimportしない)
+DEFAULT_CACHE_SIZE = 10000
+
+# ファイルの保存先 (load_config()で設定する)
+dir_path_data = None
+file_path_vrps = None
+file_path_rib = None
+# RouteViewsのアーカイブのURL (ミラーや手元のテスト用のHTTPサーバを使うときに書く。Noneならroamon_verify_getterのデフォルト)
+routeviews_archive_url = None
+
+
 # コンフィグファイルのロード
-config = configparser.ConfigParser()
-config.read('config.ini')
-config_roamon_verify = config["roamon-verify"]
-# ファイルの保存先
-dir_path_data = config_roamon_verify["dir_path_data"]
-file_path_vrps = config_roamon_verify["file_path_vrps"]
-file_path_rib = config_roamon_verify["file_path_rib"]
+def load_config(file_path_config):
+    global dir_path_data, file_path_vrps, file_path_rib, routeviews_archive_url
+    config = configparser.ConfigParser()
+    config.read(file_path_config)
+    config_roamon_verify = config["roamon-verify"]
+    dir_path_data = config_roamon_verify["dir_path_data"]
+    file_path_vrps = config_roamon_verify["file_path_vrps"]
+    file_path_rib = config_roamon_verify["file_path_rib"]
+    routeviews_archive_url = config_roamon_verify.get("routeviews_archive_url")
+
 
 # ロゴの描画
-f = Figlet(font='slant')
-print(f.renderText('roamon'))
+def print_banner():
+    from pyfiglet import Figlet
+    f = Figlet(font='slant')
+    print(f.renderText('roamon'))
+
+
+# --timeの型。roamon_verify_discoveryは--timeが指定されたときだけimportする
+def _parse_time(text):
+    import roamon_verify_discovery
+    return roamon_verify_discovery.parse_timestamp(text)
+
+
+# RIBのデータ取得
+def _get_rib(args):
+    import roamon_verify_getter
+    import roamon_verify_snapshot
+    import roamon_verify_stats
+    archive_url = routeviews_archive_url or roamon_verify_getter.ROUTEVIEWS_ARCHIVE_URL
+    routes = roamon_verify_getter.fetch_rib_data(dir_path_data, file_path_rib, args.collector, args.workers,
+                                                 archive_url, args.time)
+    # 次回からの起動を速くするため、mmapで読めるスナップショットも作っておく
+    with roamon_verify_stats.phase("write_snapshot"):
+        roamon_verify_snapshot.write_snapshot(file_path_rib, routes=routes)
+
+
+# VRPs (Verified ROA Payloads)の取得
+def _get_vrps(args):
+    import roamon_verify_getter
+    import roamon_verify_snapshot
+    import roamon_verify_stats
+    # 取得したVRPをそのまま使ってスナップショットを作る (保存したファイルは読み直さない)
+    vrps = roamon_verify_getter.fetch_vrps_data(file_path_vrps)
+    with roamon_verify_stats.phase("write_snapshot"):
+        roamon_verify_snapshot.write_vrp_snapshot(file_path_vrps, vrps=vrps)
 
 
 # getサブコマンドの実際の処理を記述するコールバック関数
+# RIBのダウンロード・パースとroutinatorでのVRPの生成は互いに関係ないので、--allのときは同時に進める
 def command_get(args):
-    # RIBのデータ取得
+    from concurrent.futures import ThreadPoolExecutor
+    tasks = []
     if args.all or args.bgp:
-        roamon_verify_getter.fetch_rib_data(dir_path_data, file_path_rib)
-
-    # VRPs (Verified ROA Payloads)の取得
+        tasks.append(_get_rib)
     if args.all or args.roa:
-        roamon_verify_getter.fetch_vrps_data(file_path_vrps)
+        tasks.append(_get_vrps)
+    if not tasks:
+        return
+
+    with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+        futures = [executor.submit(task, args) for task in tasks]
+        # 片方が失敗しても、もう片方は最後まで進めてから例外を出す
+        for future in futures:
+            future.result()
 
 
 # 検証サブコマンド　checkのとき呼ばれる関数
 def command_check(args):
+    import roamon_verify_checker
+    import roamon_verify_output
     data = roamon_verify_checker.load_all_data(file_path_vrps, file_path_rib)
+    # --asn, --ip, --inputで同じprefixやASNが何度も出てきたら、前の結果を使う
+    cache = None
+    if args.cache_size > 0 and (args.asn is not None or args.ip is not None or args.input is not None):
+        import roamon_verify_cache
+        cache = roamon_verify_cache.RovCache(args.cache_size)
 
-    # オプション指定されてる場合はそれをやる
-    if args.asn is not None:
-        roamon_verify_checker.check_specified_asns(data["vrps"], data["rib"], args.asn)
-    if args.ip is not None:
-        roamon_verify_checker.check_specified_prefixes(data["vrps"], data["rib"], args.ip)
+    with roamon_verify_output.open_writer(args.format, args.output, args.gzip) as writer:
+        # オプション指定されてる場合はそれをやる
+        if args.asn is not None:
+            roamon_verify_checker.check_specified_asns(data["vrps"], data["rib"], args.asn, args.workers, writer,
+                                                       cache=cache)
+        if args.ip is not None:
+            roamon_verify_checker.check_specified_prefixes(data["vrps"], data["rib"], args.ip, args.workers, writer,
+                                                           cache=cache, more_specifics=args.more_specifics,
+                                                           less_specifics=args.less_specifics)
+        # ファイル(-なら標準入力)から1行ずつ読んで、読んだそばからROVして出力する
+        if args.input is not None:
+            input_file = sys.stdin if args.input == "-" else open(args.input, "r")
+            with input_file:
+                targets = roamon_verify_checker.iter_targets(input_file)
+                roamon_verify_checker.check_targets_streaming(data["vrps"], data["rib"], targets, args.workers, writer,
+                                                              cache=cache)
 
-    # なんのオプションも指定されてないとき
-    # (argparseはオプションのなかのハイフンをアンダーバーに置き換える。(all-asnsだとall引くasnsだと評価されるため))
-    if args.all_asn == True or (args.ip is None and args.asn is None):
-        roamon_verify_checker.check_all_asn_in_vrps(data["vrps"], data["rib"])
+        # なんのオプションも指定されてないとき
+        # (argparseはオプションのなかのハイフンをアンダーバーに置き換える。(all-asnsだとall引くasnsだと評価されるため))
+        if args.all_asn == True or (args.ip is None and args.asn is None and args.input is None):
+            summary = None
+            if args.summary is not None:
+                import roamon_verify_summary
+                summary = roamon_verify_summary.AsnRovSummary(data["vrps"])
+            if args.state is not None:
+                # 前回の結果からの差分だけROVしなおす
+                import roamon_verify_incremental
+                change_stream = open(args.changes, "w") if args.changes is not None else None
+                try:
+                    roamon_verify_incremental.check_all_asn_in_vrps_incremental(data["vrps"], data["rib"], args.state,
+                                                                                writer, change_stream, summary)
+                finally:
+                    if change_stream is not None:
+                        change_stream.close()
+            else:
+                roamon_verify_checker.check_all_asn_in_vrps(data["vrps"], data["rib"], args.workers, writer, summary)
+            if summary is not None:
+                summary.write(args.summary, {"vrps": file_path_vrps, "rib": file_path_rib})
 
 
+# only-invalidサブコマンド。ROA登録されたprefixを別のASが広告している(経路ハイジャックかもしれない)経路を書き出す
 def command_check_violation(args):
+    import roamon_verify_checker
+    import roamon_verify_output
+    if args.workers is not None:
+        logger.warning("--workers has no effect on only-invalid: the whole table is checked in a single pass")
     data = roamon_verify_checker.load_all_data(file_path_vrps, file_path_rib)
 
-    # オプション指定されてる場合はそれをやる
-    if args.asn is not None:
-        roamon_verify_checker.check_violation_specified_asns(data["vrps"], data["rib"], args.asn)
-    if args.ip is not None:
-        roamon_verify_checker.check_violation_specified_ips(data["vrps"], data["rib"], args.ip)
+    with roamon_verify_output.open_writer(args.format, args.output, args.gzip,
+                                          roamon_verify_output.VIOLATION_COLUMNS) as writer:
+        # オプション指定されてる場合はそれをやる
+        if args.asn is not None:
+            roamon_verify_checker.check_violation_specified_asns(data["vrps"], data["rib"], args.asn, writer)
+        if args.ip is not None:
+            roamon_verify_checker.check_violation_specified_prefixes(data["vrps"], data["rib"], args.ip, writer)
+
+        # なんのオプションも指定されてないとき
+        # (argparseはオプションのなかのハイフンをアンダーバーに置き換える。(all-asnsだとall引くasnsだと評価されるため))
+        if args.all_asn == True or (args.ip is None and args.asn is None):
+            roamon_verify_checker.check_violation_all_asn_in_vrps(data["vrps"], data["rib"], writer)
+
+
+# serveサブコマンド。データを読み込んだままにして、HTTPでROVの問い合わせに答える
+def command_serve(args):
+    # 重いモジュールではないが、serveのときしか使わないのでここでimportする
+    import roamon_verify_server
+    rtr_address = _parse_host_port(args.rtr) if args.rtr is not None else None
+    roamon_verify_server.serve(file_path_vrps, file_path_rib,
+                               host=args.host, port=args.port, unix_socket_path=args.unix_socket,
+                               reload_interval=args.reload_interval, cache_size=args.cache_size,
+                               rtr_address=rtr_address, rtr_version=args.rtr_version)
+
+
+# "ホスト:ポート"を(ホスト, ポート)にする。IPv6のアドレスは"[::1]:3323"のように書く
+def _parse_host_port(address):
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise argparse.ArgumentTypeError("address must be given as HOST:PORT: {}".format(address))
+    return host.strip("[]"), int(port)
+
+
+# rtrサブコマンド。RTRでVRPsを受け取り続け、VRPsが変わるたびに影響を受ける経路だけROVしなおして、結果の変化を書き出す
+# 変化は--changesと同じ「ASN prefix 前の結果 新しい結果」の形
+def command_rtr(args):
+    import roamon_verify_checker
+    import roamon_verify_rtr
+    rib = roamon_verify_checker.load_rib(file_path_rib)
+    client = roamon_verify_rtr.RtrClient(*_parse_host_port(args.server), version=args.rtr_version,
+                                         record_path=args.record)
+    change_stream = sys.stdout if args.changes is None else open(args.changes, "a")
+    live_table = None
+    updates = 0
+
+    def on_update(vrp_changes):
+        nonlocal live_table, updates
+        if live_table is None:
+            # 最初の同期のあとに全経路をROVしておく
+            live_table = roamon_verify_rtr.LiveRovTable(client.vrps, rib)
+            logger.info("validated {} routes: {}".format(len(rib), " ".join(
+                "{} {}".format(rov_result, count) for rov_result, count in live_table.counts().items())))
+            return True
+        for change in live_table.revalidate(vrp_changes):
+            change_stream.write("{}\t{}\t{}\t{}\n".format(change.origin_asn, change.prefix,
+                                                        change.old_rov_result or "-",
+                                                        change.new_rov_result or "-"))
+        change_stream.flush()
+        updates += 1
+        return args.updates == 0 or updates < args.updates
+
+    try:
+        client.run(on_update)
+    finally:
+        if change_stream is not sys.stdout:
+            change_stream.close()
+
 
-    # なんのオプションも指定されてないとき
-    # (argparseはオプションのなかのハイフンをアンダーバーに置き換える。(all-asnsだとall引くasnsだと評価されるため))
-    if args.all_asn == True or (args.ip is None and args.asn is None):
-        roamon_verify_checker.check_violation_all_asn_in_vrps(data["vrps"], data["rib"])
+# updatesサブコマンド。BGPのUPDATEをRIBに当てながら、経路が増えたりなくなったりしたところのROVの結果を書き出す
+def command_updates(args):
+    import roamon_verify_checker
+    import roamon_verify_mrt
+    import roamon_verify_updates
+    vrps = roamon_verify_checker.load_vrps(file_path_vrps)
+    if args.rib_mrt is not None:
+        live_rib = roamon_verify_updates.LiveRib.from_peer_routes(roamon_verify_mrt.read_mrt_peer_routes(args.rib_mrt))
+    elif args.empty_rib:
+        live_rib = roamon_verify_updates.LiveRib()
+    else:
+        live_rib = roamon_verify_updates.LiveRib.from_rib(roamon_verify_checker.load_rib(file_path_rib))
+
+    # ExaBGPとBMPの記録のファイル。最後にchange_streamと一緒に閉じる
+    input_file = None
+    if args.mrt is not None:
+        event_lists = roamon_verify_updates.iter_mrt_update_events(args.mrt)
+    elif args.exabgp is not None:
+        input_file = sys.stdin if args.exabgp == '-' else open(args.exabgp, 'r')
+        event_lists = roamon_verify_updates.iter_polled(roamon_verify_updates.iter_exabgp_events(input_file),
+                                                        args.batch_interval)
+    elif args.bmp_file is not None:
+        input_file = open(args.bmp_file, 'rb')
+        event_lists = roamon_verify_updates.iter_bmp_events(input_file, args.bmp_file)
+    else:
+        event_lists = roamon_verify_updates.iter_bmp_listener(*_parse_host_port(args.bmp), args.batch_interval)
+
+    change_stream = sys.stdout if args.changes is None else open(args.changes, 'a')
+    try:
+        for events in roamon_verify_updates.iter_batches(event_lists, args.batch_size, args.batch_interval):
+            for change in roamon_verify_updates.apply_updates(vrps, live_rib, events):
+                change_stream.write("{}\t{}\t{}\t{}\n".format(change.origin_asn, change.prefix,
+                                                            change.old_rov_result or "-",
+                                                            change.new_rov_result or "-"))
+            change_stream.flush()
+    finally:
+        if change_stream is not sys.stdout:
+            change_stream.close()
+        if input_file is not None and input_file is not sys.stdin:
+            input_file.close()
+        if args.save_rib is not None:
+            roamon_verify_mrt.write_rib_file({(prefix, origin_asn): peer_count
+                                              for prefix, origin_asn, peer_count in live_rib.routes()},
+                                             args.save_rib)
+            logger.info("saved {} routes to {}".format(len(live_rib), args.save_rib))
+
+
+# historyサブコマンド。過去のRIBとVRPsの列を順番にROVして、結果の推移を書き出す
+def command_history(args):
+    import roamon_verify_history
+    roamon_verify_history.run_history(args.manifest, args.output, args.workers)
+
+
+# reportサブコマンド。rov --summaryで書き出したASごとの集計を、検証しなおさずに引いて書き出す
+def command_report(args):
+    import roamon_verify_output
+    import roamon_verify_summary
+    with roamon_verify_summary.SummaryDB(args.summary) as summary_db:
+        info = summary_db.info()
+        logger.info("summary of {} ASNs created at {}".format(info.get("asns"), info.get("created_at")))
+        records = summary_db.query(args.sort, args.top, args.any_invalid, args.asn)
+    with roamon_verify_output.open_writer(args.format, args.output,
+                                          columns=roamon_verify_summary.SUMMARY_COLUMNS) as writer:
+        for record in records:
+            if record["coverage"] is not None:
+                record["coverage"] = round(record["coverage"], 4)
+            writer.write_record(record)
+
+
+# サブコマンドを実行する。--statsなどが指定されていれば統計を取り、--profileならcProfileで計測する
+def run_command(args):
+    import roamon_verify_stats
+    want_stats = args.stats is not None or args.stats_prometheus is not None
+    run_stats = roamon_verify_stats.enable(args.command_name) if want_stats else None
+    profile = None
+    if args.profile is not None:
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
+    try:
+        args.handler(args)
+    finally:
+        if profile is not None:
+            import pstats
+            profile.disable()
+            profile.dump_stats(args.profile)
+            pstats.Stats(profile, stream=sys.stderr).sort_stats("cumulative").print_stats(PROFILE_PRINT_LINES)
+        if run_stats is not None:
+            run_stats.finish()
+            roamon_verify_stats.report(run_stats, sys.stderr, args.stats, args.stats_top, args.stats_prometheus)
 
 
 def command_help(args):
-    print(parser.parse_args([args.command, '--help']))
+    print(build_parser().parse_args([args.command, '--help']))
     # TODO: ヘルプをうまくやる
 
 
 # コマンドラインパーサーを作成
-parser = argparse.ArgumentParser(description='ROA - BGP rov command !')
-subparsers = parser.add_subparsers()
-
-# get コマンドの parser を作成
-parser_add = subparsers.add_parser('get', help="see `get -h`. It's command to fetch data.")
-parser_add.add_argument('--all', action='store_true', help='specify retrieve type ALL (default)')
-parser_add.add_argument('--roa', action='store_true', help='specify retrieve type only ROA')
-parser_add.add_argument('--bgp', action='store_true', help='specify retrieve type only BGP')
-# parser_add.add_argument('-p', '--path', default="/tmp", help='specify data dirctory')
-parser_add.set_defaults(handler=command_get)
-
-# rov コマンドの parser を作成
-parser_commit = subparsers.add_parser('rov', help="see `get -h`. It's command to check route.")
-parser_commit.add_argument('--all-asn', nargs='*', help='check ALL ASNs (default)')
-parser_commit.add_argument('--asn', nargs='*', help='specify target ASNs (default: ALL)')
-parser_commit.add_argument('--ip', nargs='*', help='specify target IPs such as 203.0.113.0/24 or 203.0.113.5.')
-parser_commit.set_defaults(handler=command_check)
-
-# only-invalidコマンドのパーサ
-parser_commit = subparsers.add_parser('only-invalid', help="see `get -h`. It's command to validate route origin.")
-parser_commit.add_argument('--all-asn', nargs='*', help='check ALL ASNs (default)')
-parser_commit.add_argument('--asn', nargs='*', help='specify target ASNs (default: ALL)')
-parser_commit.add_argument('--ip', nargs='*', help='specify target IPs such as 203.0.113.0/24 or 203.0.113.5.')
-parser_commit.set_defaults(handler=command_check_violation)
-
-# help コマンドの parser を作成
-parser_help = subparsers.add_parser('help', help='see `help -h`')
-parser_help.add_argument('command', help='command name which help is shown')
-parser_help.set_defaults(handler=command_help)
-
-# コマンドライン引数をパースして対応するハンドラ関数を実行
-args = parser.parse_args()
-if hasattr(args, 'handler'):
-    args.handler(args)
-else:
-    # 未知のサブコマンドの場合はヘルプを表示
-    parser.print_help()
+def build_parser():
+    import roamon_verify_output
+    import roamon_verify_stats
+    parser = argparse.ArgumentParser(description='ROA - BGP rov command !')
+    subparsers = parser.add_subparsers()
+
+    # どのサブコマンドにも共通のオプション
+    parser_common = argparse.ArgumentParser(add_help=False)
+    parser_common.add_argument('-q', '--quiet', action='store_true', help='do not print the banner')
+    parser_common.add_argument('--config', default=FILE_PATH_CONFIG, metavar='FILE',
+                               help='configuration file (default: {} in the current directory)'.format(
+                                   FILE_PATH_CONFIG))
+
+    # 統計とプロファイルのオプション。処理をするサブコマンドに共通
+    parser_stats = argparse.ArgumentParser(add_help=False)
+    parser_stats.add_argument('--stats', nargs='?', const='text', choices=['text', 'json'],
+                              help='print counters, per-phase times and the most expensive ASNs to stderr '
+                                   'after the run (text or json, default: text)')
+    parser_stats.add_argument('--stats-top', type=int, default=roamon_verify_stats.DEFAULT_TOP_N, metavar='N',
+                              help='number of the most expensive ASNs shown by --stats (default: {})'.format(
+                                  roamon_verify_stats.DEFAULT_TOP_N))
+    parser_stats.add_argument('--stats-prometheus', metavar='FILE',
+                              help='write the stats to FILE in Prometheus text format '
+                                   '(for the node exporter textfile collector)')
+    parser_stats.add_argument('--profile', metavar='FILE',
+                              help='profile the run with cProfile, dump pstats to FILE and print a summary to stderr')
+
+    # get コマンドの parser を作成
+    parser_add = subparsers.add_parser('get', parents=[parser_common, parser_stats],
+                                       help="see `get -h`. It's command to fetch data.")
+    parser_add.add_argument('--all', action='store_true', help='specify retrieve type ALL (default)')
+    parser_add.add_argument('--roa', action='store_true', help='specify retrieve type only ROA')
+    parser_add.add_argument('--bgp', action='store_true', help='specify retrieve type only BGP')
+    parser_add.add_argument('--collector', action='append', metavar='NAME',
+                            help='RouteViews collector to fetch RIB from, such as route-views.linx '
+                                 '(can be repeated, default: route-views2)')
+    parser_add.add_argument('--workers', type=int, default=1,
+                            help='number of processes to parse RIBs of collectors in parallel (default: 1)')
+    parser_add.add_argument('--time', type=_parse_time, metavar='TIME',
+                            help='fetch the RIB closest to TIME (UTC) instead of the latest one, '
+                                 'such as 20200101.0000 or 2020-01-01T00:00')
+    # parser_add.add_argument('-p', '--path', default="/tmp", help='specify data dirctory')
+    parser_add.set_defaults(handler=command_get, command_name='get')
+
+    # rov コマンドの parser を作成
+    parser_commit = subparsers.add_parser('rov', parents=[parser_common, parser_stats],
+                                          help="see `get -h`. It's command to check route.")
+    parser_commit.add_argument('--all-asn', nargs='*', help='check ALL ASNs (default)')
+    parser_commit.add_argument('--asn', nargs='*', help='specify target ASNs (default: ALL)')
+    parser_commit.add_argument('--ip', nargs='*', help='specify target IPs such as 203.0.113.0/24 or 203.0.113.5.')
+    parser_commit.add_argument('--more-specifics', action='store_true',
+                               help='with --ip, verify every announced route equal to or more specific than each '
+                                    'prefix instead of the longest match')
+    parser_commit.add_argument('--less-specifics', action='store_true',
+                               help='with --ip, verify every announced route covering each prefix '
+                                    'instead of the longest match')
+    parser_commit.add_argument('--input', metavar='FILE',
+                               help='read target prefixes/ASNs line by line from FILE ("-" for stdin)')
+    parser_commit.add_argument('--workers', type=int, default=1, help='number of worker processes (default: 1)')
+    parser_commit.add_argument('--format', choices=sorted(roamon_verify_output.WRITER_CLASSES), default='tsv',
+                               help='output format (default: tsv)')
+    parser_commit.add_argument('--output', metavar='FILE', help='write results to FILE instead of stdout')
+    parser_commit.add_argument('--gzip', action='store_true',
+                               help='compress output with gzip (implied when --output ends with .gz)')
+    parser_commit.add_argument('--state', metavar='FILE',
+                               help='keep results in FILE and re-verify only prefixes affected by changes '
+                                    'since the last run')
+    parser_commit.add_argument('--changes', metavar='FILE',
+                               help='with --state, write changed results (ASN, prefix, old, new) to FILE as TSV')
+    parser_commit.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE,
+                               help='number of prefix and ASN results kept for repeated targets of --asn, --ip and '
+                                    '--input (single process only). 0 disables the cache (default: {})'.format(
+                                        DEFAULT_CACHE_SIZE))
+    parser_commit.add_argument('--summary', metavar='FILE',
+                               help='when verifying all ASNs, also write per-ASN counts of results '
+                                    'to FILE (SQLite) for the report command')
+    parser_commit.set_defaults(handler=command_check, command_name='rov')
+
+    # only-invalidコマンドのパーサ
+    parser_commit = subparsers.add_parser('only-invalid', parents=[parser_common, parser_stats],
+                                          help="see `get -h`. It's command to validate route origin.")
+    parser_commit.add_argument('--all-asn', nargs='*', help='check ALL ASNs (default)')
+    parser_commit.add_argument('--asn', nargs='*', help='report only violations of ROAs of these ASNs (default: ALL)')
+    parser_commit.add_argument('--ip', nargs='*',
+                               help='check routes equal to or more specific than these prefixes, '
+                                    'such as 203.0.113.0/24 or 203.0.113.5.')
+    # 全経路を1回読むだけで済むようになったので並列にはしない。今までのスクリプトが動くように受け付けて、効かないことを警告する
+    parser_commit.add_argument('--workers', type=int, help=argparse.SUPPRESS)
+    parser_commit.add_argument('--format', choices=sorted(roamon_verify_output.WRITER_CLASSES), default='tsv',
+                               help='output format (default: tsv)')
+    parser_commit.add_argument('--output', metavar='FILE', help='write results to FILE instead of stdout')
+    parser_commit.add_argument('--gzip', action='store_true',
+                               help='compress output with gzip (implied when --output ends with .gz)')
+    parser_commit.set_defaults(handler=command_check_violation, command_name='only-invalid')
+
+    # serveコマンドのパーサ
+    parser_serve = subparsers.add_parser('serve', parents=[parser_common],
+                                         help="see `serve -h`. It's command to run ROV query server.")
+    parser_serve.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    parser_serve.add_argument('--port', type=int, default=8080, help='port to listen on (default: 8080)')
+    parser_serve.add_argument('--unix-socket', help='listen on this unix domain socket instead of TCP')
+    parser_serve.add_argument('--reload-interval', type=int, default=60,
+                              help='seconds between checks for updated data files. 0 disables reloading (default: 60)')
+    parser_serve.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE,
+                              help='number of prefix and ASN results to cache. 0 disables the cache (default: {})'.format(
+                                  DEFAULT_CACHE_SIZE))
+    parser_serve.add_argument('--rtr', metavar='HOST:PORT',
+                              help='receive VRPs from this RTR cache (routinator, stayrtr, ...) instead of '
+                                   'file_path_vrps and apply its updates as they come')
+    parser_serve.add_argument('--rtr-version', type=int, choices=[0, 1], default=1,
+                              help='RTR protocol version to start with. falls back to 0 if the cache does not '
+                                   'support 1 (default: 1)')
+    parser_serve.set_defaults(handler=command_serve)
+
+    # rtrコマンドのパーサ
+    parser_rtr = subparsers.add_parser('rtr', parents=[parser_common],
+                                       help="see `rtr -h`. It's command to follow VRPs from an RTR cache and "
+                                            "print changed ROV results.")
+    parser_rtr.add_argument('--server', metavar='HOST:PORT', required=True,
+                            help='RTR cache to connect to, such as 127.0.0.1:3323')
+    parser_rtr.add_argument('--rtr-version', type=int, choices=[0, 1], default=1,
+                            help='RTR protocol version to start with. falls back to 0 if the cache does not '
+                                 'support 1 (default: 1)')
+    parser_rtr.add_argument('--changes', metavar='FILE',
+                            help='append changed results (ASN, prefix, old, new) to FILE instead of stdout')
+    parser_rtr.add_argument('--record', metavar='FILE',
+                            help='append received PDUs to FILE (can be replayed with tools/rtr_replay_server.py)')
+    parser_rtr.add_argument('--updates', type=int, default=0, metavar='N',
+                            help='exit after N updates following the first full sync. 0 runs forever (default: 0)')
+    parser_rtr.set_defaults(handler=command_rtr)
+
+    # updatesコマンドのパーサ
+    parser_updates = subparsers.add_parser('updates', parents=[parser_common, parser_stats],
+                                           help="see `updates -h`. It's command to apply BGP updates to the RIB "
+                                                "and print routes appeared or withdrawn with their ROV results.")
+    parser_updates_source = parser_updates.add_mutually_exclusive_group(required=True)
+    parser_updates_source.add_argument('--mrt', nargs='+', metavar='FILE',
+                                       help='MRT files of BGP updates (BGP4MP, such as updates.*.bz2 of routeviews)')
+    parser_updates_source.add_argument('--exabgp', metavar='FILE',
+                                       help='JSON messages of the ExaBGP API, one per line ("-" for stdin)')
+    parser_updates_source.add_argument('--bmp', metavar='HOST:PORT',
+                                       help='listen for BMP sessions from routers on HOST:PORT')
+    parser_updates_source.add_argument('--bmp-file', metavar='FILE', help='recorded BMP messages')
+    parser_updates_rib = parser_updates.add_mutually_exclusive_group()
+    parser_updates_rib.add_argument('--rib-mrt', metavar='FILE',
+                                    help='start from this MRT RIB dump (TABLE_DUMP_V2) instead of the RIB file, '
+                                         'so that withdrawals remove the routes of each peer')
+    parser_updates_rib.add_argument('--empty-rib', action='store_true',
+                                    help='start from an empty RIB (for BMP and ExaBGP sending full tables)')
+    parser_updates.add_argument('--changes', metavar='FILE',
+                                help='append changed results (ASN, prefix, old, new) to FILE instead of stdout')
+    parser_updates.add_argument('--batch-size', type=int, default=10000, metavar='N',
+                                help='apply updates in batches of N (default: 10000)')
+    parser_updates.add_argument('--batch-interval', type=float, default=1.0, metavar='SECONDS',
+                                help='apply updates at least every SECONDS (default: 1.0)')
+    parser_updates.add_argument('--save-rib', metavar='FILE',
+                                help='write the updated RIB to FILE (the format of the RIB file) at exit')
+    parser_updates.set_defaults(handler=command_updates, command_name='updates')
+
+    # historyコマンドのパーサ
+    parser_history = subparsers.add_parser('history', parents=[parser_common, parser_stats],
+                                           help="see `history -h`. It's command to track ROV results over "
+                                                "archived snapshots.")
+    parser_history.add_argument('manifest',
+                                help='file listing snapshots, one "label<TAB>rib<TAB>vrps" per line '
+                                     '("-" for unchanged)')
+    parser_history.add_argument('--output', metavar='FILE',
+                                help='write the time series to FILE instead of stdout '
+                                     '(gzip-compressed if it ends with .gz)')
+    parser_history.add_argument('--workers', type=int, default=1,
+                                help='number of processes to read upcoming snapshots in parallel (default: 1)')
+    parser_history.set_defaults(handler=command_history, command_name='history')
+
+    # reportコマンドのパーサ
+    parser_report = subparsers.add_parser('report', parents=[parser_common, parser_stats],
+                                          help="see `report -h`. It's command to show per-ASN counts of results "
+                                               "written by `rov --summary`.")
+    parser_report.add_argument('summary', help='summary file written by `rov --summary`')
+    # 並べ替えられる列はroamon_verify_summary.SORT_COLUMNSと同じ (checkerまでimportしないように、ここに書き並べておく)
+    parser_report.add_argument('--sort', default='invalid',
+                               choices=['routes', 'valid', 'invalid', 'not_found', 'not_advertised', 'coverage'],
+                               help='sort ASNs by this count in descending order (default: invalid)')
+    parser_report.add_argument('--top', type=int, metavar='N', help='show only the first N ASNs (default: all)')
+    parser_report.add_argument('--any-invalid', action='store_true', help='show only ASNs with any INVALID route')
+    parser_report.add_argument('--asn', nargs='+', help='show only these ASNs (64511 or AS64511)')
+    parser_report.add_argument('--format', choices=sorted(roamon_verify_output.WRITER_CLASSES), default='tsv',
+                               help='output format (default: tsv)')
+    parser_report.add_argument('--output', metavar='FILE', help='write results to FILE instead of stdout')
+    parser_report.set_defaults(handler=command_report, command_name='report')
+
+    # help コマンドの parser を作成
+    parser_help = subparsers.add_parser('help', help='see `help -h`')
+    parser_help.add_argument('command', help='command name which help is shown')
+    parser_help.set_defaults(handler=command_help)
+    return parser
+
+
+# コマンドライン引数をパースして対応するハンドラ関数を実行 (console scriptのroamon-verifyもここから始まる)
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not hasattr(args, 'handler'):
+        # 未知のサブコマンドの場合はヘルプを表示
+        parser.print_help()
+        return
+    if args.handler is command_help:
+        args.handler(args)
+        return
+
+    load_config(args.config)
+    if not args.quiet:
+        print_banner()
+    if hasattr(args, 'command_name'):
+        run_command(args)
+    else:
+        args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
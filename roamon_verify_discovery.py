@@ -0,0 +1,214 @@
+# encoding: UTF-8
+
+# Copyright (c) 2019-2020 Japan Network Information Center ("JPNIC")
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute and/or sublicense of
+# the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# RouteViewsのアーカイブからRIBのファイルを探す
+# 一覧ページ(月のディレクトリの一覧 "bgpdata/"と、月ごとのRIBの一覧 "bgpdata/2020.01/RIBS/")はリンクだけ取り出してキャッシュし、
+# 次からはETag/Last-Modifiedで条件付きリクエストをする(変わっていなければ304が返るので、転送もパースもしない)
+# 表の何行目かではなく、ディレクトリ名"YYYY.MM/"とファイル名"rib.YYYYMMDD.HHMM.bz2"の日時から選ぶので、最新のものだけでなく
+# 指定した日時に一番近いRIBも選べる
+
+import codecs
+import hashlib
+import json
+import logging
+import os
+import re
+import urllib.parse
+from datetime import datetime, timedelta
+from html.parser import HTMLParser
+import roamon_verify_stats
+
+logger = logging.getLogger(__name__)
+
+# 一覧ページのキャッシュを置くディレクトリの名前 (dir_path_dataの中に作る)
+LISTING_CACHE_DIR_NAME = "listing_cache"
+LISTING_READ_SIZE = 64 * 1024
+HTTP_TIMEOUT = 60
+
+_MONTH_DIR_PATTERN = re.compile(r"^(\d{4})\.(\d{2})/$")
+_RIB_FILE_PATTERN = re.compile(r"^rib\.(\d{8})\.(\d{4})\.bz2$")
+
+
+# 一覧ページの<a href="...">だけを拾うパーサ。ページ全体を木にしないので、読んだそばからfeed()できる
+class _LinkParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag != "a":
+            return
+        for name, value in attrs:
+            if name == "href" and value is not None:
+                self.links.append(value)
+
+
+# HTTPのレスポンスを少しずつ読みながらパースして、リンクのリストを返す
+def _parse_links(res):
+    parser = _LinkParser()
+    decoder = codecs.getincrementaldecoder(res.encoding or "utf-8")(errors="replace")
+    for chunk in res.iter_content(LISTING_READ_SIZE):
+        parser.feed(decoder.decode(chunk))
+    parser.feed(decoder.decode(b"", final=True))
+    parser.close()
+    return parser.links
+
+
+# 一覧ページのリンクのキャッシュ。URLごとに1つのJSONファイル({"url", "etag", "last_modified", "links"})で持つ
+class ListingCache:
+    def __init__(self, session, dir_path_cache=None):
+        self._session = session
+        self._dir_path_cache = dir_path_cache
+        self._memory = {}
+        if dir_path_cache is not None:
+            os.makedirs(dir_path_cache, exist_ok=True)
+
+    def _file_path(self, url):
+        return os.path.join(self._dir_path_cache, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json")
+
+    def _load(self, url):
+        if url in self._memory:
+            return self._memory[url]
+        if self._dir_path_cache is None or not os.path.exists(self._file_path(url)):
+            return None
+        with open(self._file_path(url), "r") as f:
+            entry = json.load(f)
+        self._memory[url] = entry
+        return entry
+
+    # 一時ファイルに書いてからrenameする(同時に動いている別のgetが読みかけのファイルを壊さないため)
+    def _store(self, url, entry):
+        self._memory[url] = entry
+        if self._dir_path_cache is None:
+            return
+        file_path = self._file_path(url)
+        file_path_tmp = "{}.tmp{}".format(file_path, os.getpid())
+        with open(file_path_tmp, "w") as f:
+            json.dump(entry, f)
+        os.replace(file_path_tmp, file_path)
+
+    # 一覧ページのリンクのリストを返す
+    # キャッシュがあれば条件付きリクエストをして、304ならキャッシュを使う。revalidate=Falseならキャッシュがあるときはリクエストもしない
+    # (過去の月のRIBの一覧はもう変わらないので)
+    def links(self, url, revalidate=True):
+        cached = self._load(url)
+        if cached is not None and not revalidate:
+            roamon_verify_stats.cache_hit("listing")
+            return cached["links"]
+
+        headers = {}
+        if cached is not None:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        with self._session.get(url, headers=headers, stream=True, timeout=HTTP_TIMEOUT) as res:
+            if res.status_code == 304 and cached is not None:
+                logger.debug("listing {} is not modified".format(url))
+                roamon_verify_stats.cache_hit("listing")
+                return cached["links"]
+            res.raise_for_status()
+            roamon_verify_stats.cache_miss("listing")
+            links = _parse_links(res)
+            entry = {"url": url, "etag": res.headers.get("ETag"), "last_modified": res.headers.get("Last-Modified"),
+                     "links": links}
+        logger.debug("fetched listing {} ({} links)".format(url, len(links)))
+        self._store(url, entry)
+        return links
+
+
+# 月のディレクトリの一覧から [(datetime(年, 月, 1), ディレクトリ名), ...] を古い順に返す
+def _month_dirs(links):
+    months = {}
+    for link in links:
+        matched = _MONTH_DIR_PATTERN.match(link)
+        if matched is not None:
+            months[datetime(int(matched.group(1)), int(matched.group(2)), 1)] = link
+    return sorted(months.items())
+
+
+# RIBの一覧から [(RIBの日時, ファイル名), ...] を古い順に返す
+def _rib_files(links):
+    ribs = {}
+    for link in links:
+        matched = _RIB_FILE_PATTERN.match(link)
+        if matched is not None:
+            ribs[datetime.strptime(matched.group(1) + matched.group(2), "%Y%m%d%H%M")] = link
+    return sorted(ribs.items())
+
+
+# RIBを探すクラス。base_urlはコレクタの"bgpdata/"のURL
+class RibFinder:
+    def __init__(self, listing_cache, base_url):
+        self._listing_cache = listing_cache
+        self._base_url = base_url
+        self._months = None
+
+    def months(self):
+        if self._months is None:
+            self._months = _month_dirs(self._listing_cache.links(self._base_url))
+        return self._months
+
+    # 月のディレクトリのRIBの一覧を [(RIBの日時, URL), ...] で返す
+    # 新しいほうの2か月(月が変わった直後は前の月の最後のRIBが遅れて置かれることがある)以外はもう増えないので、
+    # キャッシュがあれば問い合わせない
+    def ribs_in_month(self, month_dir):
+        is_recent_month = month_dir in [recent_month_dir for _, recent_month_dir in self.months()[-2:]]
+        ribs_url = urllib.parse.urljoin(urllib.parse.urljoin(self._base_url, month_dir), "RIBS/")
+        links = self._listing_cache.links(ribs_url, revalidate=is_recent_month)
+        return [(rib_time, urllib.parse.urljoin(ribs_url, file_name)) for rib_time, file_name in _rib_files(links)]
+
+    # 最新のRIBの (日時, URL) を返す。無ければNone
+    # (最新の月のディレクトリが空なことがあるので、RIBのある月まで遡る)
+    def latest(self):
+        for _, month_dir in reversed(self.months()):
+            ribs = self.ribs_in_month(month_dir)
+            if ribs:
+                return ribs[-1]
+        return None
+
+    # 指定した日時(UTCのnaiveなdatetime)に一番近いRIBの (日時, URL) を返す。無ければNone
+    # 月の境目の近くだと隣の月のRIBのほうが近いことがあるので、指定した日時に近い月から順に見ていく
+    def closest(self, timestamp):
+        best = None
+        for month, month_dir in sorted(self.months(), key=lambda month_and_dir: abs(month_and_dir[0] - timestamp)):
+            # その月のRIBはどれも月初めから31日以内なので、見つけたものより確実に遠い月まで来たら終わり
+            if best is not None and abs(month - timestamp) - timedelta(days=31) > abs(best[0] - timestamp):
+                break
+            for rib in self.ribs_in_month(month_dir):
+                if best is None or abs(rib[0] - timestamp) < abs(best[0] - timestamp):
+                    best = rib
+        return best
+
+
+# "20200101.0000"や"2020-01-01T00:00"のような日時の文字列を、UTCのnaiveなdatetimeにする
+def parse_timestamp(text):
+    for time_format in ("%Y%m%d.%H%M", "%Y%m%d%H%M", "%Y%m%d"):
+        try:
+            return datetime.strptime(text, time_format)
+        except ValueError:
+            pass
+    timestamp = datetime.fromisoformat(text)
+    if timestamp.tzinfo is not None:
+        timestamp = (timestamp - timestamp.utcoffset()).replace(tzinfo=None)
+    return timestamp
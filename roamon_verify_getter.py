@@ -20,94 +20,215 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import argparse
 # import roamon_diff_checker
 import subprocess
 import os
+import hashlib
 import logging
-from pyfiglet import Figlet
+from concurrent.futures import ThreadPoolExecutor
 import requests
-import bs4
+import requests.adapters
+import roamon_verify_discovery
+import roamon_verify_mrt
+import roamon_verify_stats
+import roamon_verify_vrps
 import urllib.parse
 from urllib.parse import urlparse
 
 # ログ関係の設定 (適当)
 logger = logging.getLogger(__name__)
 
+# HTTPのタイムアウト(秒)と、同じホストへの接続をプールしておく数
+HTTP_TIMEOUT = 60
+HTTP_POOL_SIZE = 8
+# ダウンロード中のファイルの拡張子。途中で止まったら、次はこのファイルの続きからダウンロードする
+DOWNLOAD_PART_SUFFIX = ".part"
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
 
-def _get_latest_rib_url_in_month(base_url, month):
-    # 上で得たディレクトリの中のRIBSディレクトリへアクセスするURLを生成 (例: "2020.1/RIBS/")
-    month_url = urllib.parse.urljoin(base_url, month)
-    ribs_in_month_url = urllib.parse.urljoin(month_url, "RIBS/")
-
-    # RIBSディレクトリの中にあるファイルを最終更新順に並べたページを取得
-    payload = {"C": "M", "O": "D"}  # 最終更新(MOD)で降順(DESC)に並び替え
-    ribs_list_res = requests.get(ribs_in_month_url, params=payload)
-    soup_ribs_list = bs4.BeautifulSoup(ribs_list_res.text, "html.parser")
-    
-    # 最新のファイル名を取得
-    latest_rib_a_tag = soup_ribs_list.select("tr")[3].a
-    # (最新の月のディレクトリが空なことがある)
-    if latest_rib_a_tag is None:
-        return None
-    else:
-        latest_rib_file_name = latest_rib_a_tag.get("href")
-        latest_rib_download_url = urllib.parse.urljoin(ribs_in_month_url, latest_rib_file_name)
-        return latest_rib_download_url
+_session = None
 
 
-# 最新のRIBファイルをダウンロードするためのURLを得る (pyasnに同じ機能はある)
-def get_latest_rib_url():
-    # 年月が名前となったディレクトリ一覧を、最終更新順に並べたページを取得
-    payload = {"C": "M", "O": "D"}  # 最終更新(MOD)で降順(DESC)に並び替え
-    base_url = 'http://archive.routeviews.org/bgpdata/'
-    month_list_res = requests.get(base_url, params=payload)
+# 一覧ページの取得とダウンロードで使い回すHTTPのセッション。接続をプールしておき、毎回TCPの接続からやり直さない
+def _get_session():
+    global _session
+    if _session is None:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE,
+                                                max_retries=3)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _session = session
+    return _session
 
-    # 最終更新が一番あとのディレクトリの名前を取得("2020.1/"とか)
-    soup_month_list = bs4.BeautifulSoup(month_list_res.text, "html.parser")
-    latest_month_row = soup_month_list.select("tr")[3]
-    latest_month = latest_month_row.a.get("href")
 
-    # その月の中で最新のRIBファイルのURLを取得
-    latest_rib_download_url = _get_latest_rib_url_in_month(base_url, latest_month)
+# Content-Rangeヘッダ("bytes 100-199/1000"や"bytes */1000")から (先頭の位置, 全体のサイズ) を得る。分からなければNone
+def _parse_content_range(content_range):
+    if content_range is None or not content_range.startswith("bytes "):
+        return None, None
+    byte_range, _, total = content_range[len("bytes "):].partition("/")
+    start = int(byte_range.partition("-")[0]) if byte_range != "*" else None
+    return start, int(total) if total.isdigit() else None
 
-    # 最新の月のディレクトリが空なことがある。そのときは1つ前のディレクトリの中を探す
-    if latest_rib_download_url is None:
-        second_latest_month_row =  soup_month_list.select("tr")[4]
-        second_latest_month = second_latest_month_row.a.get("href")
-        latest_rib_download_url = _get_latest_rib_url_in_month(base_url, second_latest_month)
 
-    return latest_rib_download_url
+# ファイルのハッシュ値を16進で返す
+def _file_digest(file_path, algorithm):
+    digest = hashlib.new(algorithm)
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 
-def fetch_rib_data(dir_path_data, file_path_ipasndb):
-    logger.debug("start fetch RIB data")
+# urlのファイルをfile_pathにダウンロードする
+# まず「file_path.part」に書き込み、前回のダウンロードが途中で止まっていればRangeヘッダで続きから再開する
+# サーバの返したサイズと一致するか(checksumに(アルゴリズム名, 16進のダイジェスト)を渡せばハッシュ値も)確かめてからrenameするので、
+# file_pathがあれば必ず完全なファイル
+def download_file(url, file_path, checksum=None):
+    file_path_part = file_path + DOWNLOAD_PART_SUFFIX
+    offset = os.path.getsize(file_path_part) if os.path.exists(file_path_part) else 0
+    # 圧縮して送られるとサイズを比べられないので、そのまま送ってもらう
+    headers = {"Accept-Encoding": "identity"}
+    if offset > 0:
+        headers["Range"] = "bytes={}-".format(offset)
+
+    with _get_session().get(url, headers=headers, stream=True, timeout=HTTP_TIMEOUT) as res:
+        if res.status_code == 416:
+            # 一時ファイルにもう全部そろっている。ただし全体のサイズが分からなければ確かめようがないので、最初からやりなおす
+            expected_size = _parse_content_range(res.headers.get("Content-Range"))[1]
+            if expected_size is None:
+                logger.warning("{} returned 416 without the size. download again from the start".format(url))
+            else:
+                logger.debug("{} is already downloaded".format(file_path_part))
+            mode = None
+        elif res.status_code == 206:
+            start, expected_size = _parse_content_range(res.headers.get("Content-Range"))
+            if start != offset:
+                raise ValueError("server returned unexpected range for {}: {}".format(
+                    url, res.headers.get("Content-Range")))
+            logger.debug("resume download of {} from {} bytes".format(url, offset))
+            mode = "ab"
+        else:
+            # Rangeに対応していないサーバなら最初からダウンロードしなおす
+            res.raise_for_status()
+            content_length = res.headers.get("Content-Length")
+            expected_size = int(content_length) if content_length is not None else None
+            mode = "wb"
+
+        if mode is not None:
+            with open(file_path_part, mode) as f:
+                for chunk in res.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+
+    if res.status_code == 416 and expected_size is None:
+        os.remove(file_path_part)
+        return download_file(url, file_path, checksum)
+
+    size = os.path.getsize(file_path_part)
+    if expected_size is not None and size != expected_size:
+        # 足りなければ次回は続きから、多すぎるなら壊れているので最初からやりなおす
+        if size > expected_size:
+            os.remove(file_path_part)
+        raise ValueError("size of {} is {} bytes, but expected {} bytes".format(url, size, expected_size))
+    if checksum is not None:
+        algorithm, expected_digest = checksum
+        digest = _file_digest(file_path_part, algorithm)
+        if digest != expected_digest.lower():
+            os.remove(file_path_part)
+            raise ValueError("{} digest of {} is {}, but expected {}".format(algorithm, url, digest, expected_digest))
+
+    os.replace(file_path_part, file_path)
+    logger.debug("downloaded {} ({} bytes)".format(file_path, size))
+    return file_path
+
+
+# RIBを取得するコレクタ。route-views2以外はアーカイブのURLが"<コレクタ名>/bgpdata/"になる
+# アーカイブのURLはconfig.iniのrouteviews_archive_urlで変えられる(ミラーや手元のテスト用のHTTPサーバを使うとき)
+DEFAULT_RIB_COLLECTOR = "route-views2"
+ROUTEVIEWS_ARCHIVE_URL = "http://archive.routeviews.org/"
+
+
+def _get_collector_base_url(collector, archive_url=ROUTEVIEWS_ARCHIVE_URL):
+    if collector == DEFAULT_RIB_COLLECTOR:
+        return urllib.parse.urljoin(archive_url, "bgpdata/")
+    return urllib.parse.urljoin(archive_url, "{}/bgpdata/".format(collector))
+
+
+# 一覧ページのキャッシュ。dir_path_dataごとに1つ作って使い回す
+_listing_caches = {}
+
+
+def _get_listing_cache(dir_path_data=None):
+    if dir_path_data not in _listing_caches:
+        dir_path_cache = None
+        if dir_path_data is not None:
+            dir_path_cache = os.path.join(dir_path_data, roamon_verify_discovery.LISTING_CACHE_DIR_NAME)
+        _listing_caches[dir_path_data] = roamon_verify_discovery.ListingCache(_get_session(), dir_path_cache)
+    return _listing_caches[dir_path_data]
+
+
+# RIBファイルをダウンロードするためのURLを得る (pyasnに同じ機能はある)
+# timestampを指定しなければ最新のもの、指定すればその日時(UTC)に一番近いもの。一覧ページはdir_path_dataの中にキャッシュする
+def get_rib_url(collector=DEFAULT_RIB_COLLECTOR, archive_url=ROUTEVIEWS_ARCHIVE_URL, timestamp=None,
+                dir_path_data=None):
+    finder = roamon_verify_discovery.RibFinder(_get_listing_cache(dir_path_data),
+                                               _get_collector_base_url(collector, archive_url))
+    found = finder.latest() if timestamp is None else finder.closest(timestamp)
+    if found is None:
+        raise ValueError("no RIB file is found for collector {}".format(collector))
+    rib_time, rib_url = found
+    logger.debug("found RIB of {} at {}".format(rib_time, rib_url))
+    return rib_url
+
 
-    # 最新のRIBファイルのダウンロードURLを得る
-    download_url = get_latest_rib_url()
+# 最新のRIBファイルをダウンロードするためのURLを得る
+def get_latest_rib_url(collector=DEFAULT_RIB_COLLECTOR, archive_url=ROUTEVIEWS_ARCHIVE_URL):
+    return get_rib_url(collector, archive_url)
+
+
+# コレクタの最新の(timestampを指定すればその日時に一番近い)RIBファイルをdir_path_dataにダウンロードして、そのパスを返す
+# どのコレクタもファイル名は"rib.YYYYMMDD.HHMM.bz2"なので、route-views2以外はコレクタ名を頭につけて保存する
+def _download_rib(dir_path_data, collector, archive_url=ROUTEVIEWS_ARCHIVE_URL, timestamp=None):
+    # RIBファイルのダウンロードURLを得る
+    download_url = get_rib_url(collector, archive_url, timestamp, dir_path_data)
     logger.debug("downloadurl: {}".format(download_url))
     download_file_name = os.path.basename(urlparse(download_url).path)
+    if collector != DEFAULT_RIB_COLLECTOR:
+        download_file_name = "{}.{}".format(collector, download_file_name)
     logger.debug("download file name: {}".format(download_file_name))
     # 最新のRIBファイルをダウンロードした場合のあるべきファイルパスを得る
     download_file_path = os.path.join(dir_path_data, download_file_name)
 
-    # TODO: 同名のファイルがあっても、それはダウンロード途中でキャンセルされた残骸かもしれない。ハッシュ値を見るべき(だが面倒なのでやってない)
-    # すでに同名のファイルがあるならダウンロードはスキップ
+    # download_file()は確かめてからrenameするので、同名のファイルがあればそれは完全にダウンロードできたもの。ダウンロードはスキップ
     if os.path.exists(download_file_path):
-        logger.debug("latest RIB file are exists at {}! The download is canceled.".format(download_file_path))
+        logger.debug("RIB file are exists at {}! The download is canceled.".format(download_file_path))
+        roamon_verify_stats.cache_hit("rib_download")
     else:
-        logger.debug("latest RIB file are NOT exists at {}! Downloading...".format(download_file_path))
-        subprocess.check_output(
-            "cd {} ; wget {}".format(dir_path_data, download_url),
-            shell=True,
-            universal_newlines=True
-        )
-        logger.debug("downloaded: {}".format(download_file_path))
+        logger.debug("RIB file are NOT exists at {}! Downloading...".format(download_file_path))
+        roamon_verify_stats.cache_miss("rib_download")
+        download_file(download_url, download_file_path)
+    return download_file_path
+
+
+# 各コレクタの最新の(timestampを指定すればその日時に一番近い)RIBを並列にダウンロードし、
+# MRTのままworkers個のプロセスで並列にパースして、「prefix<TAB>ASN<TAB>ピア数」の形式でfile_path_ribに保存する
+# パースした経路の (prefix文字列, Origin AS, ピア数) のリストを返すので、呼び出し側はファイルを読み直さずにスナップショットを作れる
+def fetch_rib_data(dir_path_data, file_path_rib, collectors=None, workers=1, archive_url=ROUTEVIEWS_ARCHIVE_URL,
+                   timestamp=None):
+    logger.debug("start fetch RIB data")
+    if not collectors:
+        collectors = [DEFAULT_RIB_COLLECTOR]
+    with roamon_verify_stats.phase("download_rib"), \
+            ThreadPoolExecutor(max_workers=min(len(collectors), HTTP_POOL_SIZE)) as executor:
+        download_file_paths = list(executor.map(
+            lambda collector: _download_rib(dir_path_data, collector, archive_url, timestamp), collectors))
 
     logger.debug("start parse RIB data")
-    # pyasnの機能でRIBファイルをパースしてpyasnが読める形式に変換する
-    subprocess.check_output("pyasn_util_convert.py --single {} {}".format(download_file_path, file_path_ipasndb),
-                            shell=True)
+    with roamon_verify_stats.phase("parse_rib"):
+        peer_counts = roamon_verify_mrt.read_mrt_routes_parallel(download_file_paths, workers)
+        roamon_verify_mrt.write_rib_file(peer_counts, file_path_rib)
+    roamon_verify_stats.count("rib_routes", len(peer_counts))
+    logger.debug("finish parse RIB data ({} routes)".format(len(peer_counts)))
+    return [(prefix, origin_asn, peer_count) for (prefix, origin_asn), peer_count in peer_counts.items()]
 
 
 # ↓めんどくさいからShellScriptワンライナーで対応することにしました
@@ -120,13 +241,27 @@ def fetch_rib_data(dir_path_data, file_path_ipasndb):
 #             f_dat.writelines(";")
 
 
+# routinatorでVRPのリストを得るコマンド。CSVで出力させて、標準出力を直接読む
+ROUTINATOR_VRPS_COMMAND = ["routinator", "vrps", "--format", "csv"]
+# docker上のroutinatorで同じことをするコマンド (出力を読むだけなので-itは付けない)
+DOCKER_ROUTINATOR_VRPS_COMMAND = ["sudo", "docker", "exec", "routinator"] + ROUTINATOR_VRPS_COMMAND
+
+
+# routinatorの出力を読んだそばからパースして、「prefix<TAB>ASN<TAB>maxLength」の形式でfile_path_vrpsに保存する
+# 取得したVRPの (prefix文字列, ASN, maxLength) のリストを返すので、呼び出し側はファイルを読み直さずにインデックスを作れる
+# VRPsはpyasnでなくVrpTrieで読み込むので、AS0のVRPも消さずに残す(RFC 6811ではAS0のVRPに一致する経路はINVALIDになる)
+def _fetch_vrps_with_command(command, file_path_vrps):
+    vrps = list(roamon_verify_vrps.iter_command_vrps(command, "csv"))
+    roamon_verify_vrps.write_vrps_file(vrps, file_path_vrps)
+    return vrps
+
+
 def fetch_vrps_data(file_path_vrps):
-    # routinatorでROAを取得 & 検証してVRPのリストを得て、さらにpyasnが読み込める形式に直す(cutコマンド以降が整形部分)
-    # TODO: pyasnがASN 0を許容しないので、`grep -v 'AS0'`を入れてAS0のとこを消してる。将来的にはpyasnを改造してASN 0を読み込めるようにすべき...らしい
-    subprocess.check_output(
-        "routinator vrps 2>/dev/null | tail -n +2  | grep -v 'AS0' |cut -d, -f1,2 | tr ',' ' ' | cut -c 3- | awk '{print $2 \"\\t\" $1}'    > " + file_path_vrps,
-        shell=True)
+    with roamon_verify_stats.phase("fetch_vrps"):
+        vrps = _fetch_vrps_with_command(ROUTINATOR_VRPS_COMMAND, file_path_vrps)
+    roamon_verify_stats.count("vrps", len(vrps))
     logger.debug("finish fetch vrps")
+    return vrps
 
 
 # VRPを入手するのに、docker上でroutinatorを動かす版。前使ってた
@@ -144,13 +279,12 @@ nlnetlabs/routinator init -f --accept-arin-rpa",
     subprocess.check_output(
         "sudo docker run -d --rm --name routinator -v routinator-tals:/home/routinator/.rpki-cache/tals nlnetlabs/routinator",
         shell=True)
-    # routinatorでROAを取得 & 検証してVRPのリストを得て、さらにpyasnが読み込める形式に直す(cutコマンド以降が整形部分)
-    # TODO: pyasnがASN 0を許容しないので、`grep -v 'AS0'`を入れてAS0のとこを消してる。将来的にはpyasnを改造してASN 0を読み込めるようにすべき...らしい
-    subprocess.check_output(
-        "sudo docker exec -it routinator /bin/sh -c 'routinator vrps 2>/dev/null | tail -n +2'  | grep -v 'AS0' |cut -d, -f1,2 | tr ',' ' ' | cut -c 3- | awk '{print $2 \"\\t\" $1}'    > " + file_path_vrps,
-        shell=True)
-    # routinatorのコンテナを止める(と同時に消える)
-    subprocess.check_output(
-        "sudo docker stop routinator",
-        shell=True)
+    try:
+        vrps = _fetch_vrps_with_command(DOCKER_ROUTINATOR_VRPS_COMMAND, file_path_vrps)
+    finally:
+        # routinatorのコンテナを止める(と同時に消える)
+        subprocess.check_output(
+            "sudo docker stop routinator",
+            shell=True)
     logger.debug("finish fetch vrps")
+    return vrps
@@ -0,0 +1,255 @@
+# encoding: UTF-8
+
+# Copyright (c) 2019-2020 Japan Network Information Center ("JPNIC")
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute and/or sublicense of
+# the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# 過去のRIBとVRPsの列(日ごとのスナップショットなど)を順番にROVして、ROVの結果の推移を時系列のファイルに書き出す
+# スナップショットごとにVRPsのトライやRIBを作りなおしてcheck_all_asn_in_vrps()するかわりに、1つ前のスナップショットとの差分
+# (追加・削除されたVRPと経路)だけをトライや経路の集合に反映し、影響を受けるprefixの経路だけ検証しなおす
+# (影響を受けるprefixの決め方はroamon_verify_incrementalと同じ)
+#
+# 入力はスナップショットの一覧のファイル。1行に「ラベル<TAB>RIBのファイル<TAB>VRPsのファイル」
+# RIBはMRTのダンプ(bz2/gzipでもよい)か「prefix<TAB>ASN」のファイル。VRPsはroamon_verify_vrpsが読める形式
+# ファイルが"-"なら1つ前のスナップショットと同じものを使う (VRPsはRIBほど頻繁に保存していないときなど)
+#
+# 出力は1行1レコードのTSV (.gzならgzipで圧縮する)
+#   snapshot<TAB>ラベル<TAB>経路の数<TAB>VALID<TAB>INVALID<TAB>NOT_FOUND<TAB>結果が変わった経路の数
+#   asn<TAB>ラベル<TAB>ASN<TAB>VALID<TAB>INVALID<TAB>NOT_FOUND
+# asnのレコードは、前のスナップショットから数が変わったASの分だけ書く (最初のスナップショットでは全部のAS)
+
+import gzip
+import logging
+import multiprocessing
+import sys
+from tqdm import tqdm
+from roamon_verify_checker import validate_route, RovResult
+from roamon_verify_index import VrpTrie, parse_prefix
+from roamon_verify_incremental import PrefixSpace, find_affected_prefixes
+from roamon_verify_snapshot import read_rib_file
+from roamon_verify_vrps import read_vrps_file
+import roamon_verify_mrt
+
+logger = logging.getLogger(__name__)
+
+# 集計するROVの結果 (NOT_ADVERTISEDは広告されている経路の検証では出てこない)
+SUMMARY_RESULTS = [RovResult.VALID, RovResult.INVALID, RovResult.NOT_FOUND]
+_SUMMARY_COLUMNS = {rov_result: idx for idx, rov_result in enumerate(SUMMARY_RESULTS)}
+
+
+# スナップショットの一覧を読んで [(ラベル, RIBのファイル or None, VRPsのファイル or None), ...] を返す (Noneは前と同じ)
+def read_manifest(lines):
+    manifest = []
+    for line in lines:
+        if line.startswith("#") or not line.strip():
+            continue
+        columns = line.rstrip("\r\n").split("\t")
+        if len(columns) != 3:
+            raise ValueError("manifest line must be 'label<TAB>rib<TAB>vrps': {}".format(line.rstrip()))
+        label, file_path_rib, file_path_vrps = columns
+        manifest.append((label,
+                         None if file_path_rib == "-" else file_path_rib,
+                         None if file_path_vrps == "-" else file_path_vrps))
+    if manifest and (manifest[0][1] is None or manifest[0][2] is None):
+        raise ValueError("the first snapshot in manifest must have both rib and vrps")
+    return manifest
+
+
+# RIBのファイルを読んで経路 (prefix文字列, Origin AS) の集合を返す
+def read_rib_routes(file_path_rib):
+    if roamon_verify_mrt.is_mrt_file(file_path_rib):
+        return set(roamon_verify_mrt.read_mrt_routes(file_path_rib))
+    return set((prefix, origin_asn) for prefix, origin_asn, _ in read_rib_file(file_path_rib))
+
+
+# スナップショット1つ分のファイルを読む。(ラベル, 経路の集合 or None, VRPの集合 or None) を返す
+# 並列に読むときはワーカープロセスで呼ばれる
+def _load_snapshot(manifest_entry):
+    label, file_path_rib, file_path_vrps = manifest_entry
+    rib_routes = read_rib_routes(file_path_rib) if file_path_rib is not None else None
+    vrp_tuples = set(read_vrps_file(file_path_vrps)) if file_path_vrps is not None else None
+    return label, rib_routes, vrp_tuples
+
+
+# スナップショットを順番に読むジェネレータ。workersが2以上なら、その数のプロセスで先のスナップショットを読んでおく
+# (読み込み(特にMRTのパース)に比べて差分の反映は軽いので、読み込みだけ並列にする)
+def _iter_snapshots(manifest, workers):
+    if workers <= 1:
+        for manifest_entry in manifest:
+            yield _load_snapshot(manifest_entry)
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            yield from pool.imap(_load_snapshot, manifest)
+
+
+# スナップショットをまたいで使い回すROVの状態
+# VRPsのトライ、経路の集合、RIBのprefixの並び、結果、ASごとの結果の数を持ち、次のスナップショットとの差分だけ反映する
+class HistoryState:
+    def __init__(self):
+        self.vrp_trie = VrpTrie()
+        self.vrp_tuples = set()
+        self.rib_routes = set()
+        self._origins_by_prefix = {}
+        self._rib_prefix_space = PrefixSpace([])
+        # {(prefix, Origin AS): RovResult} (VRPsに出てくるASの経路だけ。check_all_asn_in_vrps()と同じ)
+        self.results = {}
+        # {ASN: [VALID, INVALID, NOT_FOUND]} と、全体の [VALID, INVALID, NOT_FOUND]
+        self.asn_counts = {}
+        self.total_counts = [0] * len(SUMMARY_RESULTS)
+        # 前回書き出したあとに数が変わったかもしれないAS
+        self._dirty_asns = set()
+
+    def _set_result(self, key, rov_result):
+        old_rov_result = self.results.get(key)
+        if old_rov_result == rov_result:
+            return False
+        origin_asn = key[1]
+        counts = self.asn_counts.setdefault(origin_asn, [0] * len(SUMMARY_RESULTS))
+        if old_rov_result is not None:
+            counts[_SUMMARY_COLUMNS[old_rov_result]] -= 1
+            self.total_counts[_SUMMARY_COLUMNS[old_rov_result]] -= 1
+        if rov_result is None:
+            del self.results[key]
+        else:
+            self.results[key] = rov_result
+            counts[_SUMMARY_COLUMNS[rov_result]] += 1
+            self.total_counts[_SUMMARY_COLUMNS[rov_result]] += 1
+        self._dirty_asns.add(origin_asn)
+        return True
+
+    # VRPの差分をトライに反映する
+    def _apply_vrps(self, vrp_tuples):
+        for vrp in self.vrp_tuples - vrp_tuples:
+            self.vrp_trie.remove(*vrp)
+        for vrp in vrp_tuples - self.vrp_tuples:
+            self.vrp_trie.add(*vrp)
+        self.vrp_tuples = vrp_tuples
+
+    # 経路の差分を、prefixごとのOrigin ASとprefixの並びに反映する
+    def _apply_routes(self, rib_routes):
+        added_prefixes = []
+        removed_prefixes = []
+        for prefix, origin_asn in self.rib_routes - rib_routes:
+            origins = self._origins_by_prefix[prefix]
+            origins.discard(origin_asn)
+            if not origins:
+                del self._origins_by_prefix[prefix]
+                removed_prefixes.append(prefix)
+        for prefix, origin_asn in rib_routes - self.rib_routes:
+            if prefix not in self._origins_by_prefix:
+                self._origins_by_prefix[prefix] = set()
+                added_prefixes.append(prefix)
+            self._origins_by_prefix[prefix].add(origin_asn)
+        self._rib_prefix_space.update(added_prefixes, removed_prefixes)
+        self.rib_routes = rib_routes
+
+    # 次のスナップショットを反映する (Noneは前と同じ)。結果が変わった経路の数を返す
+    def apply(self, rib_routes, vrp_tuples):
+        if rib_routes is None:
+            rib_routes = self.rib_routes
+        if vrp_tuples is None:
+            vrp_tuples = self.vrp_tuples
+        old_vrp_tuples, old_rib_routes = self.vrp_tuples, self.rib_routes
+        old_target_asns = set(asn for _, asn, _ in old_vrp_tuples)
+
+        self._apply_vrps(vrp_tuples)
+        self._apply_routes(rib_routes)
+        target_asns = set(asn for _, asn, _ in vrp_tuples)
+        affected_prefixes = find_affected_prefixes(old_vrp_tuples, old_rib_routes, vrp_tuples, rib_routes,
+                                                    self._rib_prefix_space)
+        logger.debug("{} prefixes are affected by the changes".format(len(affected_prefixes)))
+
+        n_changed = 0
+        # 消えた経路と、VRPsから消えたASの経路の結果を消す
+        for key in old_rib_routes - rib_routes:
+            n_changed += self._set_result(key, None)
+        removed_asns = old_target_asns - target_asns
+        if removed_asns:
+            for key in [key for key in self.results if key[1] in removed_asns]:
+                n_changed += self._set_result(key, None)
+
+        # 影響を受けたprefixの経路だけ検証しなおす
+        for prefix in affected_prefixes:
+            parsed_prefix = parse_prefix(prefix)
+            for origin_asn in self._origins_by_prefix.get(prefix, ()):
+                if origin_asn in target_asns:
+                    rov_result = validate_route(self.vrp_trie, *parsed_prefix, origin_asn)
+                    n_changed += self._set_result((prefix, origin_asn), rov_result)
+        return n_changed
+
+    # 前回書き出したあとに数が変わったASの (ASN, [VALID, INVALID, NOT_FOUND]) を返し、書き出し済みにする
+    def pop_changed_asn_counts(self, last_written_counts):
+        changed = []
+        for asn in sorted(self._dirty_asns):
+            counts = self.asn_counts.get(asn, [0] * len(SUMMARY_RESULTS))
+            if last_written_counts.get(asn) != counts:
+                changed.append((asn, list(counts)))
+                last_written_counts[asn] = list(counts)
+            if not any(counts):
+                self.asn_counts.pop(asn, None)
+        self._dirty_asns = set()
+        return changed
+
+
+# 時系列のファイルを開く。.gzならgzipで圧縮する
+def _open_output(file_path_output):
+    if file_path_output.endswith(".gz"):
+        return gzip.open(file_path_output, "wt")
+    return open(file_path_output, "w")
+
+
+# スナップショットの一覧を順番にROVして、スナップショットごとの集計とASごとの推移をstreamに書き出す
+def write_history(manifest, stream, workers=1):
+    state = HistoryState()
+    last_written_counts = {}
+    for label, rib_routes, vrp_tuples in tqdm(_iter_snapshots(manifest, workers), total=len(manifest)):
+        n_changed = state.apply(rib_routes, vrp_tuples)
+        stream.write("snapshot\t{}\t{}\t{}\t{}\n".format(label, len(state.results),
+                                                        "\t".join(str(count) for count in state.total_counts),
+                                                        n_changed))
+        for asn, counts in state.pop_changed_asn_counts(last_written_counts):
+            stream.write("asn\t{}\t{}\t{}\n".format(label, asn, "\t".join(str(count) for count in counts)))
+        stream.flush()
+        logger.info("{}: {} results, {} changed".format(label, len(state.results), n_changed))
+
+
+# スナップショットの一覧のファイルを読んで、時系列のファイル(Noneなら標準出力)に書き出す
+def run_history(file_path_manifest, file_path_output=None, workers=1):
+    with open(file_path_manifest, "r") as f:
+        manifest = read_manifest(f)
+    if file_path_output is None or file_path_output == "-":
+        write_history(manifest, sys.stdout, workers)
+    else:
+        with _open_output(file_path_output) as stream:
+            write_history(manifest, stream, workers)
+
+
+# 時系列のファイルを読んで、レコードを1つずつ返すジェネレータ
+# ("snapshot", ラベル, 経路の数, {RovResult: 数}, 結果が変わった経路の数) か ("asn", ラベル, ASN, {RovResult: 数})
+def read_history(file_path_history):
+    open_file = gzip.open if file_path_history.endswith(".gz") else open
+    with open_file(file_path_history, "rt") as f:
+        for line in f:
+            columns = line.rstrip("\n").split("\t")
+            if columns[0] == "snapshot":
+                counts = dict(zip(SUMMARY_RESULTS, map(int, columns[3:6])))
+                yield "snapshot", columns[1], int(columns[2]), counts, int(columns[6])
+            elif columns[0] == "asn":
+                counts = dict(zip(SUMMARY_RESULTS, map(int, columns[3:6])))
+                yield "asn", columns[1], int(columns[2]), counts
@@ -0,0 +1,240 @@
+# encoding: UTF-8
+
+# Copyright (c) 2019-2020 Japan Network Information Center ("JPNIC")
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute and/or sublicense of
+# the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# 差分だけROVしなおす (インクリメンタルROV)
+# check_all_asn_in_vrps()と同じ結果(VRPsに出てくるASが広告してる全経路のROV結果)を、前回の結果をもとに作る。
+# 前回のVRPsとRIBと結果を状態ファイルに保存しておき、今回の入力との差分を取って、影響を受けるprefixの経路だけ検証しなおす。
+# 影響を受けるのは次のprefix
+#   * RIBで経路(prefixとOrigin ASの組)が追加・削除されたprefix
+#   * 追加・削除されたVRPのprefixに含まれるprefix
+#   * 新しくVRPsに出てきたASが広告してるprefix
+
+import logging
+import os
+import pickle
+from bisect import bisect_left, bisect_right
+from heapq import merge
+from roamon_verify_checker import validate_route, RovResult, PrefixRovResultStruct, AsnRovResultStruct
+from roamon_verify_index import parse_prefix
+
+logger = logging.getLogger(__name__)
+
+STATE_FORMAT_VERSION = 3
+
+
+# 前回の状態を読み込む。ファイルが無いか形式が違うときはNone (全部ROVしなおす)
+def load_state(file_path_state):
+    if file_path_state is None or not os.path.exists(file_path_state):
+        return None
+    with open(file_path_state, "rb") as f:
+        state = pickle.load(f)
+    if state.get("version") != STATE_FORMAT_VERSION:
+        logger.info("state file {} has different format version. recompute all.".format(file_path_state))
+        return None
+    return state
+
+
+# 状態を保存する。途中で落ちても前回の状態ファイルが壊れないように、一時ファイルに書いてからrenameする
+def save_state(file_path_state, vrp_tuples, rib_routes, results):
+    state = {"version": STATE_FORMAT_VERSION,
+             "vrps": vrp_tuples,
+             "rib": rib_routes,
+             # RovResultのEnumをそのままpickleするとクラスの定義が変わったときに読めなくなるので、名前で持つ
+             "results": {key: rov_result.name for key, rov_result in results.items()}}
+    file_path_tmp = "{}.tmp{}".format(file_path_state, os.getpid())
+    with open(file_path_tmp, "wb") as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(file_path_tmp, file_path_state)
+
+
+# RIBのprefixを(IPバージョン, ネットワークアドレス, プレフィックス長)の昇順に並べたもの。重なるprefixを探すのに使う
+class PrefixSpace:
+    def __init__(self, prefixes):
+        self._keys = sorted((parse_prefix(prefix), prefix) for prefix in prefixes)
+        self._parsed = [key for key, _ in self._keys]
+
+    # 指定されたprefixに含まれる(同じか長い)prefixを全部返す
+    # RFC 6811ではVRPが影響するのはそのVRPに含まれる経路だけなので、これで十分
+    def covered(self, prefix):
+        version, network_int, prefixlen = parse_prefix(prefix)
+        max_prefixlen = 32 if version == 4 else 128
+
+        # ネットワークアドレスが範囲内で、プレフィックス長が同じか長いもの
+        last_address = network_int + (1 << (max_prefixlen - prefixlen)) - 1
+        low = bisect_left(self._parsed, (version, network_int, prefixlen))
+        high = bisect_right(self._parsed, (version, last_address, max_prefixlen))
+        return [self._keys[idx][1] for idx in range(low, high)]
+
+    # prefixを追加・削除する。変わるものがごく少なければ(k*k < n)、その場所に挿入・削除する
+    # それより多ければ、追加するものだけ並べて、削除するものを除きながら今の並びと1回で併合する (O(n + k log k))
+    def update(self, added_prefixes, removed_prefixes):
+        n_changes = len(added_prefixes) + len(removed_prefixes)
+        if n_changes * n_changes < len(self._keys):
+            for prefix in removed_prefixes:
+                idx = bisect_left(self._keys, (parse_prefix(prefix), prefix))
+                del self._keys[idx]
+                del self._parsed[idx]
+            for prefix in added_prefixes:
+                key = (parse_prefix(prefix), prefix)
+                idx = bisect_left(self._keys, key)
+                self._keys.insert(idx, key)
+                self._parsed.insert(idx, key[0])
+            return
+        removed_prefixes = set(removed_prefixes)
+        added_keys = sorted((parse_prefix(prefix), prefix) for prefix in added_prefixes)
+        self._keys = list(merge((key for key in self._keys if key[1] not in removed_prefixes), added_keys))
+        self._parsed = [key for key, _ in self._keys]
+
+
+# 読み込んだVRPsとRIBから、差分を取るための集合を作る
+def _snapshot_inputs(vrps, rib):
+    vrp_tuples = set(vrps.vrps())
+    rib_routes = set((prefix, origin_asn) for prefix, origin_asn, _ in rib.routes())
+    return vrp_tuples, rib_routes
+
+
+# {prefix: [Origin AS, ...]} にする
+def _origins_by_prefix(rib_routes):
+    origins_by_prefix = {}
+    for prefix, origin_asn in rib_routes:
+        origins_by_prefix.setdefault(prefix, []).append(origin_asn)
+    return origins_by_prefix
+
+
+# ROVの結果の変化1件 (前後どちらかはNoneのことがある = 結果の集合に追加された or 消えた)
+class RovResultChange:
+    def __init__(self, prefix, origin_asn, old_rov_result, new_rov_result):
+        self.prefix = prefix
+        self.origin_asn = origin_asn
+        self.old_rov_result = old_rov_result
+        self.new_rov_result = new_rov_result
+
+    def __str__(self):
+        return str(self.to_dict())
+
+    def to_dict(self):
+        return {"prefix": self.prefix,
+                "origin_asn": self.origin_asn,
+                "old_rov_result": self.old_rov_result,
+                "new_rov_result": self.new_rov_result}
+
+
+# インクリメンタルにROVする。({(prefix, 広告元ASN): RovResult}, [RovResultChange, ...]) を返す
+# file_path_stateに前回の状態があればそれとの差分だけROVしなおし、最後に今回の状態を保存する
+def rov_incremental(vrps, rib, file_path_state):
+    vrp_tuples, rib_routes = _snapshot_inputs(vrps, rib)
+    target_asns = set(asn for _, asn, _ in vrp_tuples)
+
+    state = load_state(file_path_state)
+    if state is None:
+        previous_results = {}
+        affected_prefixes = set(prefix for prefix, origin in rib_routes if origin in target_asns)
+    else:
+        previous_results = {key: RovResult[name] for key, name in state["results"].items()}
+        affected_prefixes = find_affected_prefixes(state["vrps"], state["rib"], vrp_tuples, rib_routes)
+    logger.debug("{} prefixes are affected by the changes".format(len(affected_prefixes)))
+
+    # 影響を受けてない結果は前回のものをそのまま使う
+    results = {}
+    for (prefix, origin), rov_result in previous_results.items():
+        if prefix in affected_prefixes or origin not in target_asns or (prefix, origin) not in rib_routes:
+            continue
+        results[(prefix, origin)] = rov_result
+
+    # 影響を受けたprefixの経路だけ検証しなおす
+    origins_by_prefix = _origins_by_prefix(rib_routes)
+    for prefix in affected_prefixes:
+        for origin in origins_by_prefix.get(prefix, []):
+            if origin in target_asns:
+                results[(prefix, origin)] = validate_route(vrps, *parse_prefix(prefix), origin)
+
+    changes = []
+    for key in sorted(set(previous_results) | set(results), key=_result_sort_key):
+        old_rov_result = previous_results.get(key)
+        new_rov_result = results.get(key)
+        if old_rov_result != new_rov_result:
+            changes.append(RovResultChange(key[0], key[1], old_rov_result, new_rov_result))
+
+    save_state(file_path_state, vrp_tuples, rib_routes, results)
+    return results, changes
+
+
+# 前回と今回のVRPsとRIBを比べ、ROVの結果が変わりうるRIBのprefixを返す
+# 今回のRIBのprefixのPrefixSpaceを持っていればrib_prefix_spaceに渡す (無ければ必要なときに作る)
+def find_affected_prefixes(old_vrp_tuples, old_rib_routes, new_vrp_tuples, new_rib_routes, rib_prefix_space=None):
+    # RIBで経路が追加・削除されたprefix
+    affected_prefixes = set(prefix for prefix, _ in old_rib_routes ^ new_rib_routes)
+
+    # 追加・削除されたVRP (maxLengthが変わったものも含む) に含まれるprefix
+    changed_vrp_prefixes = set(prefix for prefix, _, _ in old_vrp_tuples ^ new_vrp_tuples)
+    if changed_vrp_prefixes:
+        if rib_prefix_space is None:
+            rib_prefix_space = PrefixSpace(set(prefix for prefix, _ in new_rib_routes))
+        for vrp_prefix in changed_vrp_prefixes:
+            affected_prefixes.update(rib_prefix_space.covered(vrp_prefix))
+
+    # 新しくVRPsに出てきたASが広告してるprefix (前回は結果の集合に入ってなかったので)
+    added_asns = set(asn for _, asn, _ in new_vrp_tuples) - set(asn for _, asn, _ in old_vrp_tuples)
+    if added_asns:
+        for prefix, origin in new_rib_routes:
+            if origin in added_asns:
+                affected_prefixes.add(prefix)
+
+    return affected_prefixes
+
+
+# 結果はcheck_all_asn_in_vrps()と同じく、ASN順、その中ではprefix順に並べる
+def _result_sort_key(key):
+    prefix, origin = key
+    return origin, prefix
+
+
+# 結果をASごとにまとめて、ASごとの集計(roamon_verify_summary.AsnRovSummary)に数える
+# check_all_asn_in_vrps()と同じく、VRPsに出てくるASは経路を広告していなくても1行になる
+def _add_to_summary(summary, vrps, results):
+    results_by_asn = {}
+    for (prefix, origin), rov_result in results.items():
+        results_by_asn.setdefault(origin, {})[prefix] = PrefixRovResultStruct(prefix, prefix, origin, rov_result)
+    for asn in sorted(vrps.asns()):
+        summary.add(AsnRovResultStruct(asn, results_by_asn.get(asn, {})))
+
+
+# インクリメンタルにROVして、全体の結果をwriterに、変化をchange_streamに書き出す
+# summary(roamon_verify_summary.AsnRovSummary)を渡すと、ASごとの集計も作る
+def check_all_asn_in_vrps_incremental(vrps, rib, file_path_state, writer, change_stream=None, summary=None):
+    results, changes = rov_incremental(vrps, rib, file_path_state)
+
+    for (prefix, origin) in sorted(results, key=_result_sort_key):
+        result_struct = PrefixRovResultStruct(prefix, prefix, origin, results[(prefix, origin)])
+        writer.write_prefix_result(result_struct, origin)
+    writer.flush()
+
+    if change_stream is not None:
+        for change in changes:
+            change_stream.write("{}\t{}\t{}\t{}\n".format(change.origin_asn, change.prefix,
+                                                        change.old_rov_result or "-",
+                                                        change.new_rov_result or "-"))
+        change_stream.flush()
+    if summary is not None:
+        _add_to_summary(summary, vrps, results)
+    logger.info("{} results, {} changed".format(len(results), len(changes)))
+    return results, changes
@@ -0,0 +1,206 @@
+# encoding: UTF-8
+
+# Copyright (c) 2019-2020 Japan Network Information Center ("JPNIC")
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute and/or sublicense of
+# the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import socket
+from roamon_verify_vrps import read_vrps_file
+
+logger = logging.getLogger(__name__)
+
+
+# prefix文字列("192.0.2.0/24"とか"2001:db8::/32"とか)を (IPバージョン, ネットワークアドレスの整数, プレフィックス長) に変換する
+# ipaddress.ip_networkより速いので、大量のprefixを扱うところではこっちを使う
+def parse_prefix(prefix):
+    address, _, prefixlen = prefix.partition("/")
+    if ":" in address:
+        version, max_prefixlen, family = 6, 128, socket.AF_INET6
+    else:
+        version, max_prefixlen, family = 4, 32, socket.AF_INET
+    # アドレスの書式がおかしいとinet_ptonはOSErrorを投げるので、プレフィックス長がおかしいときと同じValueErrorにする
+    try:
+        address_int = int.from_bytes(socket.inet_pton(family, address), "big")
+    except OSError:
+        raise ValueError("invalid prefix: {}".format(prefix))
+    prefixlen = int(prefixlen) if prefixlen else max_prefixlen
+    if not 0 <= prefixlen <= max_prefixlen:
+        raise ValueError("invalid prefix length: {}".format(prefix))
+
+    # ホスト部が立っていても(203.0.113.5/24とか)ネットワークアドレスに丸める
+    host_bits = max_prefixlen - prefixlen
+    network_int = (address_int >> host_bits) << host_bits
+    return version, network_int, prefixlen
+
+
+# アドレスの整数をアドレスの文字列に戻す
+def format_address(version, address_int):
+    if version == 4:
+        return socket.inet_ntop(socket.AF_INET, address_int.to_bytes(4, "big"))
+    return socket.inet_ntop(socket.AF_INET6, address_int.to_bytes(16, "big"))
+
+
+# (IPバージョン, ネットワークアドレスの整数, プレフィックス長) をprefix文字列に戻す
+def format_prefix(version, network_int, prefixlen):
+    return "{}/{}".format(format_address(version, network_int), prefixlen)
+
+
+# VRP (Validated ROA Payload) を持つトライ
+# プレフィックス長ごとにハッシュ表を用意し、それを短い順に並べたもの。ノード(prefix)ごとに(ASN, maxLength)のリストを持つので、
+# 同じprefixを違うASがROA登録していても上書きされない。
+# あるprefixを含むVRPは、短い方から各段のハッシュ表を1回ずつ引くだけで全部見つかる (段の数は実際に存在するプレフィックス長の種類数)
+class VrpTrie:
+    def __init__(self):
+        # {IPバージョン: [(プレフィックス長, {ネットワーク部の整数: ((ASN, maxLength), ...)}), ...]} (プレフィックス長の昇順)
+        # RTRで更新している間も他のスレッドが検索できるように、段のリストとprefixごとのタプルは変更せずに作りなおして差し替える
+        # (ハッシュ表や_vrps_by_asnを丸ごとたどるときは、list(table.items())などで一度にコピーしてからたどる)
+        self._levels = {4: [], 6: []}
+        # {ASN: {(prefix文字列, maxLength), ...}}
+        self._vrps_by_asn = {}
+        self._count = 0
+        # 中身が変わるたびに増える番号 (roamon_verify_cacheが、古い検索結果を捨てるのに使う)
+        self.generation = 0
+
+    # VRPsのファイル(このツールの形式かroutinatorの出力)からトライを作る
+    @classmethod
+    def from_file(cls, file_path_vrps):
+        return cls.from_vrps(read_vrps_file(file_path_vrps))
+
+    # (prefix文字列, ASN, maxLength) の列からトライを作る
+    @classmethod
+    def from_vrps(cls, vrps):
+        vrp_trie = cls()
+        for prefix, asn, max_length in vrps:
+            vrp_trie.add(prefix, asn, max_length)
+        logger.debug("finish build vrp trie with {} VRPs".format(len(vrp_trie)))
+        return vrp_trie
+
+    def __len__(self):
+        return self._count
+
+    # 指定されたプレフィックス長の段のハッシュ表を返す。create=Trueなら無いときは作る
+    def _get_level(self, version, prefixlen, create=False):
+        levels = self._levels[version]
+        for idx, (level_prefixlen, table) in enumerate(levels):
+            if level_prefixlen == prefixlen:
+                return table
+            if level_prefixlen > prefixlen:
+                break
+        else:
+            idx = len(levels)
+        if not create:
+            return None
+        table = {}
+        # RTRで更新している間も他のスレッドが段を順に見ていられるように、リストは作りなおして差し替える
+        self._levels[version] = levels[:idx] + [(prefixlen, table)] + levels[idx:]
+        return table
+
+    # VRPを1つ追加する。すでにあれば何もしない
+    def add(self, prefix, asn, max_length):
+        version, network_int, prefixlen = parse_prefix(prefix)
+        max_prefixlen = 32 if version == 4 else 128
+        table = self._get_level(version, prefixlen, create=True)
+        key = network_int >> (max_prefixlen - prefixlen)
+        entries = table.get(key, ())
+        if (asn, max_length) in entries:
+            return
+        table[key] = entries + ((asn, max_length),)
+        self._vrps_by_asn.setdefault(asn, set()).add((format_prefix(version, network_int, prefixlen), max_length))
+        self._count += 1
+        self.generation += 1
+
+    # VRPを1つ取り除く。無ければ何もしない
+    def remove(self, prefix, asn, max_length):
+        version, network_int, prefixlen = parse_prefix(prefix)
+        max_prefixlen = 32 if version == 4 else 128
+        table = self._get_level(version, prefixlen)
+        key = network_int >> (max_prefixlen - prefixlen)
+        entries = table.get(key, ()) if table is not None else ()
+        if (asn, max_length) not in entries:
+            return
+        entries = tuple(entry for entry in entries if entry != (asn, max_length))
+        if entries:
+            table[key] = entries
+        else:
+            del table[key]
+            if not table:
+                self._levels[version] = [level for level in self._levels[version] if level[1] is not table]
+        vrps_of_asn = self._vrps_by_asn[asn]
+        vrps_of_asn.discard((format_prefix(version, network_int, prefixlen), max_length))
+        if not vrps_of_asn:
+            del self._vrps_by_asn[asn]
+        self._count -= 1
+        self.generation += 1
+
+    # IPバージョンごとの段を [(プレフィックス長, {ネットワーク部の整数: ((ASN, maxLength), ...)}), ...] で返す (プレフィックス長の昇順)
+    # 中身はコピーしないので変更しないこと
+    def levels(self, version):
+        return self._levels[version]
+
+    # IPバージョンごとに全てのVRPを (ネットワークアドレスの整数, プレフィックス長, ASN, maxLength) の昇順のリストで返す
+    # (roamon_verify_snapshotの表のentries()と同じ並び)
+    def entries(self, version):
+        max_prefixlen = 32 if version == 4 else 128
+        entries = []
+        for level_prefixlen, table in self._levels[version]:
+            shift = max_prefixlen - level_prefixlen
+            for key, vrps_of_prefix in list(table.items()):
+                network_int = key << shift
+                for asn, max_length in vrps_of_prefix:
+                    entries.append((network_int, level_prefixlen, asn, max_length))
+        entries.sort()
+        return entries
+
+    # 指定されたprefixを含む(同じか短い)VRPを全部返す。[(VRPのプレフィックス長, ASN, maxLength), ...] (短い順)
+    def covering_vrps_parsed(self, version, network_int, prefixlen):
+        max_prefixlen = 32 if version == 4 else 128
+        found = []
+        for level_prefixlen, table in self._levels[version]:
+            if level_prefixlen > prefixlen:
+                break
+            entries = table.get(network_int >> (max_prefixlen - level_prefixlen))
+            if entries is not None:
+                for asn, max_length in entries:
+                    found.append((level_prefixlen, asn, max_length))
+        return found
+
+    def covering_vrps(self, prefix):
+        return self.covering_vrps_parsed(*parse_prefix(prefix))
+
+    # VRPsに出てくるASNを全部返す
+    def asns(self):
+        return set(self._vrps_by_asn)
+
+    # VRPsに出てくるprefixを全部返す
+    def prefixes(self):
+        return set(prefix for vrps_of_asn in list(self._vrps_by_asn.values()) for prefix, _ in tuple(vrps_of_asn))
+
+    # 与えられたASNがROA登録したprefixを全部返す (pyasnのget_as_prefixes()と同じく、なければNone)
+    def get_as_prefixes(self, asn):
+        vrps_of_asn = self._vrps_by_asn.get(int(asn))
+        if vrps_of_asn is None:
+            return None
+        return set(prefix for prefix, _ in tuple(vrps_of_asn))
+
+    # 全てのVRPを (prefix文字列, ASN, maxLength) で返す
+    def vrps(self):
+        for asn, vrps_of_asn in list(self._vrps_by_asn.items()):
+            for prefix, max_length in tuple(vrps_of_asn):
+                yield prefix, asn, max_length
@@ -0,0 +1,401 @@
+# encoding: UTF-8
+
+# Copyright (c) 2019-2020 Japan Network Information Center ("JPNIC")
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute and/or sublicense of
+# the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# MRT形式(RFC 6396)のRIBダンプ(TABLE_DUMP_V2)と、UPDATEの記録(BGP4MP)を読む
+# pyasn_util_convert.pyで中間ファイルを作るかわりに、bz2/gzipを展開しながらレコードを1つずつ読んで、prefixとOrigin ASの組(経路)を取り出す。
+# prefixごとにOrigin ASを1つに絞らず、MOASの経路も全部残す。
+# 複数のコレクタ(route-views2, route-views.linxなど)のRIBは別々のプロセスで並列に読んでからまとめる
+# BGPのUPDATEメッセージの解析は、BMPで受け取ったUPDATEにも使う (roamon_verify_updates)
+
+import bz2
+import gzip
+import logging
+import multiprocessing
+import os
+import socket
+import struct
+
+logger = logging.getLogger(__name__)
+
+# MRTのヘッダ: タイムスタンプ, タイプ, サブタイプ, 長さ
+_MRT_HEADER = struct.Struct(">IHHI")
+_UINT16 = struct.Struct(">H")
+_UINT32 = struct.Struct(">I")
+
+MRT_TYPE_TABLE_DUMP_V2 = 13
+MRT_TYPE_BGP4MP = 16
+MRT_TYPE_BGP4MP_ET = 17
+# TABLE_DUMP_V2のサブタイプのうち、ユニキャストのRIBのもの: {サブタイプ: (IPバージョン, ADD-PATHかどうか)}
+_RIB_SUBTYPES = {2: (4, False), 4: (6, False), 8: (4, True), 10: (6, True)}
+_SUBTYPE_PEER_INDEX_TABLE = 1
+# BGP4MPのサブタイプのうち、ピアから受け取ったBGPメッセージのもの: {サブタイプ: (AS番号のバイト数, ADD-PATHかどうか)}
+# (コレクタが送った側のメッセージ(*_LOCAL)は読まない)
+_BGP4MP_MESSAGE_SUBTYPES = {1: (2, False), 4: (4, False), 8: (2, True), 9: (4, True)}
+# BGP4MPのサブタイプのうち、セッションの状態の変化のもの: {サブタイプ: AS番号のバイト数}
+_BGP4MP_STATE_CHANGE_SUBTYPES = {0: 2, 5: 4}
+_BGP_STATE_ESTABLISHED = 6
+
+# BGPメッセージ: マーカー(16), 長さ(2), タイプ(1)
+BGP_HEADER_SIZE = 19
+BGP_MESSAGE_UPDATE = 2
+# AFIとSAFI (MP_REACH_NLRI/MP_UNREACH_NLRIのうちユニキャストだけ読む)
+_AFI_VERSIONS = {1: 4, 2: 6}
+_SAFI_UNICAST = 1
+
+# BGPのパス属性
+_ATTR_FLAG_EXTENDED_LENGTH = 0x10
+_ATTR_TYPE_AS_PATH = 2
+_ATTR_TYPE_MP_REACH_NLRI = 14
+_ATTR_TYPE_MP_UNREACH_NLRI = 15
+_ATTR_TYPE_AS4_PATH = 17
+_AS_PATH_SEGMENT_AS_SET = 1
+_AS_PATH_SEGMENT_AS_SEQUENCE = 2
+
+# デフォルトルートはROVの対象にしない (pyasn_util_convert.pyと同じ)
+_DEFAULT_ROUTES = ("0.0.0.0/0", "::/0")
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_BZ2_MAGIC = b"BZh"
+
+
+# MRTのファイルを開く。bz2とgzipは先頭のマジックナンバーを見て、展開しながら読めるように開く
+def open_mrt_file(file_path_mrt):
+    with open(file_path_mrt, "rb") as f:
+        magic = f.read(3)
+    if magic.startswith(_BZ2_MAGIC):
+        return bz2.open(file_path_mrt, "rb")
+    if magic.startswith(_GZIP_MAGIC):
+        return gzip.open(file_path_mrt, "rb")
+    return open(file_path_mrt, "rb")
+
+
+# ファイルがTABLE_DUMP_V2のMRTか(「prefix<TAB>ASN」のテキストのRIBのファイルではないか)調べる。先頭のレコードのタイプを見る
+def is_mrt_file(file_path):
+    with open_mrt_file(file_path) as stream:
+        header = stream.read(_MRT_HEADER.size)
+    if len(header) < _MRT_HEADER.size:
+        return False
+    _, mrt_type, _, _ = _MRT_HEADER.unpack(header)
+    return mrt_type == MRT_TYPE_TABLE_DUMP_V2
+
+
+# MRTのレコードを (タイプ, サブタイプ, 中身のbytes) で1つずつ返すジェネレータ
+def iter_mrt_records(stream):
+    while True:
+        header = stream.read(_MRT_HEADER.size)
+        if len(header) < _MRT_HEADER.size:
+            return
+        _, mrt_type, mrt_subtype, length = _MRT_HEADER.unpack(header)
+        body = stream.read(length)
+        if len(body) < length:
+            raise ValueError("MRT record is truncated")
+        yield mrt_type, mrt_subtype, body
+
+
+# AS_PATH属性からOrigin ASを取り出す。最後のセグメントがAS_SEQUENCEならその右端のAS、
+# AS_SETだったりAS_PATHが空だったり(iBGPで受け取った自AS発の経路)するとOrigin ASは決まらないのでNone (RFC 6811のNONE)
+# TABLE_DUMP_V2のAS_PATHは常に4バイトASN。BGP4MPの古いサブタイプなどでは2バイト(asn_size=2)
+def _origin_from_as_path(body, pos, end, asn_size=4):
+    asn_struct = _UINT32 if asn_size == 4 else _UINT16
+    origin_asn = None
+    while pos < end:
+        segment_type = body[pos]
+        count = body[pos + 1]
+        pos += 2
+        if segment_type == _AS_PATH_SEGMENT_AS_SEQUENCE and count > 0:
+            origin_asn = asn_struct.unpack_from(body, pos + asn_size * (count - 1))[0]
+        elif segment_type == _AS_PATH_SEGMENT_AS_SET:
+            origin_asn = None
+        pos += asn_size * count
+    return origin_asn
+
+
+# パス属性を順に見てAS_PATHを探し、Origin ASを返す
+def _origin_from_attributes(body, pos, end):
+    while pos < end:
+        flags = body[pos]
+        attr_type = body[pos + 1]
+        if flags & _ATTR_FLAG_EXTENDED_LENGTH:
+            length = _UINT16.unpack_from(body, pos + 2)[0]
+            pos += 4
+        else:
+            length = body[pos + 2]
+            pos += 3
+        if attr_type == _ATTR_TYPE_AS_PATH:
+            return _origin_from_as_path(body, pos, pos + length)
+        pos += length
+    return None
+
+
+# RIBのレコードのprefixを文字列にする
+def _parse_rib_prefix(body, version):
+    prefixlen = body[4]
+    n_bytes = (prefixlen + 7) // 8
+    if version == 4:
+        address = socket.inet_ntop(socket.AF_INET, body[5:5 + n_bytes].ljust(4, b"\0"))
+    else:
+        address = socket.inet_ntop(socket.AF_INET6, body[5:5 + n_bytes].ljust(16, b"\0"))
+    return "{}/{}".format(address, prefixlen), 5 + n_bytes
+
+
+# RIBのレコードの各エントリ(ピアごとの経路)のOrigin ASをリストで返す。Origin ASの決まらないエントリは飛ばす
+def _parse_rib_origins(body, pos, is_add_path):
+    entry_count = _UINT16.unpack_from(body, pos)[0]
+    pos += 2
+    origins = []
+    for _ in range(entry_count):
+        # ピアの番号(2), 受信時刻(4), (ADD-PATHならパスID(4)), パス属性の長さ(2)
+        pos += 10 if is_add_path else 6
+        attributes_length = _UINT16.unpack_from(body, pos)[0]
+        pos += 2
+        origin_asn = _origin_from_attributes(body, pos, pos + attributes_length)
+        pos += attributes_length
+        if origin_asn is not None:
+            origins.append(origin_asn)
+    return origins
+
+
+# MRTのストリームから (prefix文字列, [ピアごとのOrigin AS, ...]) を1つずつ返すジェネレータ。TABLE_DUMP_V2のユニキャストのRIB以外は読み飛ばす
+def iter_rib_origins(stream):
+    for mrt_type, mrt_subtype, body in iter_mrt_records(stream):
+        if mrt_type != MRT_TYPE_TABLE_DUMP_V2 or mrt_subtype not in _RIB_SUBTYPES:
+            continue
+        version, is_add_path = _RIB_SUBTYPES[mrt_subtype]
+        prefix, pos = _parse_rib_prefix(body, version)
+        origins = _parse_rib_origins(body, pos, is_add_path)
+        if origins:
+            yield prefix, origins
+
+
+# PEER_INDEX_TABLEのレコードから、ピアのIPアドレスの文字列のリストを作る (RIBのエントリのピアの番号は、このリストの番号)
+def _parse_peer_index_table(body):
+    view_name_length = _UINT16.unpack_from(body, 4)[0]
+    pos = 6 + view_name_length
+    peer_count = _UINT16.unpack_from(body, pos)[0]
+    pos += 2
+    peers = []
+    for _ in range(peer_count):
+        # ピアのタイプ(1. 0x01ならIPv6アドレス, 0x02なら4バイトAS), BGP ID(4), IPアドレス, AS
+        peer_type = body[pos]
+        pos += 5
+        if peer_type & 0x01:
+            peers.append(socket.inet_ntop(socket.AF_INET6, body[pos:pos + 16]))
+            pos += 16
+        else:
+            peers.append(socket.inet_ntop(socket.AF_INET, body[pos:pos + 4]))
+            pos += 4
+        pos += 4 if peer_type & 0x02 else 2
+    return peers
+
+
+# MRTのストリームから (prefix文字列, [(ピアのIPアドレス, Origin AS), ...]) を1つずつ返すジェネレータ
+# iter_rib_origins()と同じだが、どのピアの経路かも返す (あとからそのピアのUPDATEで経路を取り消せるように)
+def iter_rib_peer_origins(stream):
+    peers = []
+    for mrt_type, mrt_subtype, body in iter_mrt_records(stream):
+        if mrt_type != MRT_TYPE_TABLE_DUMP_V2:
+            continue
+        if mrt_subtype == _SUBTYPE_PEER_INDEX_TABLE:
+            peers = _parse_peer_index_table(body)
+            continue
+        if mrt_subtype not in _RIB_SUBTYPES:
+            continue
+        version, is_add_path = _RIB_SUBTYPES[mrt_subtype]
+        prefix, pos = _parse_rib_prefix(body, version)
+        entry_count = _UINT16.unpack_from(body, pos)[0]
+        pos += 2
+        peer_origins = []
+        for _ in range(entry_count):
+            peer_index = _UINT16.unpack_from(body, pos)[0]
+            pos += 10 if is_add_path else 6
+            attributes_length = _UINT16.unpack_from(body, pos)[0]
+            pos += 2
+            origin_asn = _origin_from_attributes(body, pos, pos + attributes_length)
+            pos += attributes_length
+            if origin_asn is not None:
+                # PEER_INDEX_TABLEに無い番号なら、番号そのものでピアを見分ける
+                peer_origins.append((peers[peer_index] if peer_index < len(peers) else peer_index, origin_asn))
+        if peer_origins:
+            yield prefix, peer_origins
+
+
+# MRTのRIBダンプを読んで、ピアごとの経路を (prefix文字列, ピアのIPアドレス, Origin AS) で1つずつ返すジェネレータ
+def read_mrt_peer_routes(file_path_mrt):
+    with open_mrt_file(file_path_mrt) as stream:
+        for prefix, peer_origins in iter_rib_peer_origins(stream):
+            if prefix in _DEFAULT_ROUTES:
+                continue
+            for peer, origin_asn in peer_origins:
+                yield prefix, peer, origin_asn
+
+
+# MRTのファイルを読んで {(prefix文字列, Origin AS): その経路を見ていたピアの数} を返す
+# 同じprefixを複数のASが広告していたら(MOAS)、全部のOrigin ASを残す
+def read_mrt_routes(file_path_mrt):
+    peer_counts = {}
+    with open_mrt_file(file_path_mrt) as stream:
+        for prefix, origins in iter_rib_origins(stream):
+            if prefix in _DEFAULT_ROUTES:
+                continue
+            for origin_asn in origins:
+                key = (prefix, origin_asn)
+                peer_counts[key] = peer_counts.get(key, 0) + 1
+    logger.debug("finish parse {} ({} routes)".format(file_path_mrt, len(peer_counts)))
+    return peer_counts
+
+
+# 複数のMRTのファイルをworkers個のプロセスで並列に読んで、{(prefix文字列, Origin AS): ピアの数} にまとめる
+# ピアの数は全部のファイル(コレクタ)の分を足し合わせる
+def read_mrt_routes_parallel(file_paths_mrt, workers=1):
+    workers = min(workers, len(file_paths_mrt))
+    if workers <= 1:
+        return _merge_routes(map(read_mrt_routes, file_paths_mrt))
+    with multiprocessing.Pool(workers) as pool:
+        return _merge_routes(pool.imap(read_mrt_routes, file_paths_mrt))
+
+
+# 各ファイルの結果をまとめる
+def _merge_routes(results):
+    merged = None
+    for peer_counts in results:
+        if merged is None:
+            merged = peer_counts
+            continue
+        for key, peer_count in peer_counts.items():
+            merged[key] = merged.get(key, 0) + peer_count
+    return merged if merged is not None else {}
+
+
+# {(prefix文字列, Origin AS): ピアの数} をRIBのファイル(「prefix<TAB>ASN<TAB>ピア数」)に書き出す。一時ファイルに書いてからrenameする
+# 3列目を無視すればpyasnが読み込める形式(IPASN)と同じ
+def write_rib_file(peer_counts, file_path_rib):
+    file_path_tmp = "{}.tmp{}".format(file_path_rib, os.getpid())
+    with open(file_path_tmp, "w") as f:
+        f.write("; IP-ASN32-DAT file\n")
+        f.write("; Original source: MRT/RIB dump\n")
+        for (prefix, origin_asn), peer_count in peer_counts.items():
+            f.write("{}\t{}\t{}\n".format(prefix, origin_asn, peer_count))
+    os.replace(file_path_tmp, file_path_rib)
+
+
+# NLRIの並び(body[pos:end])を [(IPバージョン, ネットワークアドレスの整数, プレフィックス長), ...] にする
+# デフォルトルートはROVの対象にしないので落とす。ADD-PATHならprefixの前のパスIDを読み飛ばす
+def _parse_nlri(body, pos, end, version, is_add_path=False):
+    width = 32 if version == 4 else 128
+    prefixes = []
+    while pos < end:
+        if is_add_path:
+            pos += 4
+        prefixlen = body[pos]
+        n_bytes = (prefixlen + 7) // 8
+        if prefixlen > width or pos + 1 + n_bytes > end:
+            raise ValueError("malformed NLRI")
+        network_int = int.from_bytes(body[pos + 1:pos + 1 + n_bytes], "big") << (width - 8 * n_bytes)
+        pos += 1 + n_bytes
+        if prefixlen > 0:
+            # ホスト部のビットが立っていても、prefixとしては落として扱う
+            shift = width - prefixlen
+            prefixes.append((version, network_int >> shift << shift, prefixlen))
+    return prefixes
+
+
+# BGPのUPDATEメッセージ(BGPのヘッダの後ろ、body[pos:end])を読んで、(広告されたprefixのリスト, 取り消されたprefixのリスト, Origin AS) を返す
+# prefixは (IPバージョン, ネットワークアドレスの整数, プレフィックス長)。IPv6はMP_REACH_NLRIとMP_UNREACH_NLRIから読む
+# asn_sizeはAS_PATHのASNのバイト数。2バイトのときは、AS4_PATHがあればそちらからOrigin ASを取る (RFC 6793)
+# Origin ASが決まらない(AS_SETで終わるなど)ときはNone
+def parse_bgp_update(body, pos, end, asn_size=4, is_add_path=False):
+    withdrawn_length = _UINT16.unpack_from(body, pos)[0]
+    pos += 2
+    withdrawn = _parse_nlri(body, pos, pos + withdrawn_length, 4, is_add_path)
+    pos += withdrawn_length
+    attributes_length = _UINT16.unpack_from(body, pos)[0]
+    pos += 2
+    attributes_end = pos + attributes_length
+    announced = _parse_nlri(body, attributes_end, end, 4, is_add_path)
+
+    origin_asn = None
+    as4_path = None
+    while pos < attributes_end:
+        flags = body[pos]
+        attr_type = body[pos + 1]
+        if flags & _ATTR_FLAG_EXTENDED_LENGTH:
+            length = _UINT16.unpack_from(body, pos + 2)[0]
+            pos += 4
+        else:
+            length = body[pos + 2]
+            pos += 3
+        if attr_type == _ATTR_TYPE_AS_PATH:
+            origin_asn = _origin_from_as_path(body, pos, pos + length, asn_size)
+        elif attr_type == _ATTR_TYPE_AS4_PATH and asn_size == 2:
+            as4_path = (pos, pos + length)
+        elif attr_type == _ATTR_TYPE_MP_REACH_NLRI or attr_type == _ATTR_TYPE_MP_UNREACH_NLRI:
+            version = _AFI_VERSIONS.get(_UINT16.unpack_from(body, pos)[0])
+            if version is not None and body[pos + 2] == _SAFI_UNICAST:
+                if attr_type == _ATTR_TYPE_MP_REACH_NLRI:
+                    # AFI(2), SAFI(1), ネクストホップの長さ(1), ネクストホップ, 予約(1), NLRI
+                    nlri_pos = pos + 4 + body[pos + 3] + 1
+                    announced += _parse_nlri(body, nlri_pos, pos + length, version, is_add_path)
+                else:
+                    withdrawn += _parse_nlri(body, pos + 3, pos + length, version, is_add_path)
+        pos += length
+
+    if as4_path is not None and origin_asn is not None:
+        origin_asn = _origin_from_as_path(body, as4_path[0], as4_path[1])
+    return announced, withdrawn, origin_asn
+
+
+# BGP4MPのレコードの先頭(ピアのAS, 自分のAS, インタフェース番号, AFI, ピアのIPアドレス, 自分のIPアドレス)を読んで、
+# (ピアのIPアドレスの文字列, その後ろの位置) を返す
+def _parse_bgp4mp_peer(body, asn_size):
+    pos = 2 * asn_size + 2
+    afi = _UINT16.unpack_from(body, pos)[0]
+    pos += 2
+    if afi == 2:
+        return socket.inet_ntop(socket.AF_INET6, body[pos:pos + 16]), pos + 32
+    return socket.inet_ntop(socket.AF_INET, body[pos:pos + 4]), pos + 8
+
+
+# BGP4MPのストリーム(routeviewsのUPDATESのファイルなど)から、ピアごとの経路の変化を1つずつ返すジェネレータ
+#   (ピアのIPアドレス, 広告されたprefixのリスト, 取り消されたprefixのリスト, Origin AS)  UPDATEを受け取った
+#   (ピアのIPアドレス, None, None, None)  Establishedだったセッションが切れた (そのピアの経路は全部なくなる)
+def iter_bgp4mp_updates(stream):
+    for mrt_type, mrt_subtype, body in iter_mrt_records(stream):
+        if mrt_type == MRT_TYPE_BGP4MP_ET:
+            # 拡張タイムスタンプ(マイクロ秒)を読み飛ばす
+            body = body[4:]
+        elif mrt_type != MRT_TYPE_BGP4MP:
+            continue
+
+        if mrt_subtype in _BGP4MP_MESSAGE_SUBTYPES:
+            asn_size, is_add_path = _BGP4MP_MESSAGE_SUBTYPES[mrt_subtype]
+            peer, pos = _parse_bgp4mp_peer(body, asn_size)
+            if body[pos + 18] != BGP_MESSAGE_UPDATE:
+                continue
+            length = _UINT16.unpack_from(body, pos + 16)[0]
+            announced, withdrawn, origin_asn = parse_bgp_update(body, pos + BGP_HEADER_SIZE, pos + length,
+                                                                asn_size, is_add_path)
+            yield peer, announced, withdrawn, origin_asn
+        elif mrt_subtype in _BGP4MP_STATE_CHANGE_SUBTYPES:
+            peer, pos = _parse_bgp4mp_peer(body, _BGP4MP_STATE_CHANGE_SUBTYPES[mrt_subtype])
+            old_state, new_state = struct.unpack_from(">HH", body, pos)
+            if old_state == _BGP_STATE_ESTABLISHED and new_state != _BGP_STATE_ESTABLISHED:
+                yield peer, None, None, None
@@ -0,0 +1,172 @@
+# encoding: UTF-8
+
+# Copyright (c) 2019-2020 Japan Network Information Center ("JPNIC")
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute and/or sublicense of
+# the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# ROVの結果を書き出すクラスたち
+# 1行ごとにprintするかわりに大きなバッファを挟んでまとめて書き込む。結果はto_dict()の中身をそのまま書き出す
+# only-invalidの結果(ViolationResultStruct)も同じクラスで、VIOLATION_COLUMNSの列で書き出す
+
+import csv
+import gzip
+import json
+import logging
+import sys
+
+logger = logging.getLogger(__name__)
+
+# 出力のバッファサイズ
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+
+# 各形式で書き出す列 (ASNを指定してのROVのときだけasnが入る)
+COLUMNS = ["asn", "specified_prefix", "advertised_prefix", "advertising_asn", "rov_result"]
+# only-invalidで書き出す列
+VIOLATION_COLUMNS = ["roa_asn", "roa_prefix", "roa_max_length", "advertised_prefix", "advertising_asn"]
+
+
+# PrefixRovResultStructを書き出す用のdictにする。asnはASNを指定してのROVのときにそのASNを入れる
+def _to_record(prefix_rov_result_struct, asn=None):
+    record = {"asn": asn}
+    record.update(prefix_rov_result_struct.to_dict())
+    record["rov_result"] = str(record["rov_result"])
+    return record
+
+
+# 書き出す形式ごとの基底クラス
+# columnsは書き出す列 (COLUMNSかVIOLATION_COLUMNS、reportならroamon_verify_summary.SUMMARY_COLUMNS)
+class RovResultWriter:
+    def __init__(self, stream, columns=COLUMNS):
+        self.stream = stream
+        self.columns = columns
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # 1件書き出す。形式ごとに実装する
+    def write_record(self, record):
+        raise NotImplementedError
+
+    # ASNを指定してのROVの結果(AsnRovResultStruct)を書き出す
+    def write_asn_result(self, asn_rov_result_struct):
+        for prefix_rov_result_struct in asn_rov_result_struct.rov_results_dict.values():
+            self.write_record(_to_record(prefix_rov_result_struct, asn_rov_result_struct.specified_asn))
+
+    # prefixを指定してのROVの結果(PrefixRovResultStruct)を書き出す。asnを指定するとASNを指定してのROVの結果と同じ形で書き出す
+    def write_prefix_result(self, prefix_rov_result_struct, asn=None):
+        self.write_record(_to_record(prefix_rov_result_struct, asn))
+
+    # only-invalidの結果(ViolationResultStruct)を書き出す
+    def write_violation(self, violation_result_struct):
+        self.write_record(violation_result_struct.to_dict())
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        self.flush()
+        if self.stream is not sys.stdout:
+            self.stream.close()
+
+
+# タブ区切り。今までのprintでの出力と同じく「(ASN) prefix 結果」を先頭に並べ、そのうしろに広告されてたprefixとASNを付け足す
+# only-invalidの結果などは、columnsの順に並べる
+class TsvWriter(RovResultWriter):
+    def write_record(self, record):
+        if self.columns is not COLUMNS:
+            self.stream.write("\t".join("-" if record[name] is None else str(record[name])
+                                        for name in self.columns) + "\n")
+            return
+        columns = [record["specified_prefix"], record["rov_result"],
+                   record["advertised_prefix"], record["advertising_asn"]]
+        if record["asn"] is not None:
+            columns.insert(0, record["asn"])
+        self.stream.write("\t".join("-" if column is None else str(column) for column in columns) + "\n")
+
+
+# CSV。先頭にヘッダ行を書く
+class CsvWriter(RovResultWriter):
+    def __init__(self, stream, columns=COLUMNS):
+        super().__init__(stream, columns)
+        self._csv_writer = csv.DictWriter(stream, fieldnames=columns, lineterminator="\n")
+        self._csv_writer.writeheader()
+
+    def write_record(self, record):
+        self._csv_writer.writerow(record)
+
+
+# 1行1つのJSON (JSON Lines)
+class JsonlWriter(RovResultWriter):
+    def write_record(self, record):
+        self.stream.write(json.dumps(record) + "\n")
+
+
+WRITER_CLASSES = {"tsv": TsvWriter, "csv": CsvWriter, "jsonl": JsonlWriter}
+
+
+# 出力先を開いてWriterを作る。file_pathがNoneか"-"なら標準出力。compressがTrueか拡張子が.gzならgzipで圧縮して書く
+# columnsは書き出す列 (only-invalidならVIOLATION_COLUMNS)
+def open_writer(output_format="tsv", file_path=None, compress=False, columns=COLUMNS):
+    to_stdout = file_path is None or file_path == "-"
+    if not to_stdout and file_path.endswith(".gz"):
+        compress = True
+    # それまでにprintされたもの(ロゴなど)より先に結果が出てしまわないように
+    sys.stdout.flush()
+
+    if compress:
+        if to_stdout:
+            raw_stream = gzip.GzipFile(fileobj=sys.stdout.buffer, mode="wb")
+        else:
+            raw_stream = gzip.open(file_path, "wb")
+        stream = _BufferedTextStream(raw_stream)
+    elif to_stdout:
+        # 標準出力は行ごとにフラッシュされることがあるので、大きなバッファを挟む
+        stream = open(sys.stdout.fileno(), "w", buffering=OUTPUT_BUFFER_SIZE, closefd=False, newline="")
+    else:
+        stream = open(file_path, "w", buffering=OUTPUT_BUFFER_SIZE, newline="")
+
+    return WRITER_CLASSES[output_format](stream, columns)
+
+
+# gzipの出力先に、OUTPUT_BUFFER_SIZEくらい貯まってからまとめて書き込むテキストストリーム
+class _BufferedTextStream:
+    def __init__(self, raw_stream):
+        self._raw_stream = raw_stream
+        self._chunks = []
+        self._size = 0
+
+    def write(self, text):
+        self._chunks.append(text)
+        self._size += len(text)
+        if self._size >= OUTPUT_BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self._chunks:
+            self._raw_stream.write("".join(self._chunks).encode("utf-8"))
+            self._chunks = []
+            self._size = 0
+        self._raw_stream.flush()
+
+    def close(self):
+        self.flush()
+        self._raw_stream.close()
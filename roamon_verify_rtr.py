@@ -0,0 +1,440 @@
+# encoding: UTF-8
+
+# Copyright (c) 2019-2020 Japan Network Information Center ("JPNIC")
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute and/or sublicense of
+# the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# RPKI-to-Router (RTR, RFC 8210。バージョン0のRFC 6810にも対応) のクライアント
+# routinatorやstayrtrなどのキャッシュにつないでVRPsを受け取り、メモリ上のVrpTrieに反映し続ける。
+# 最初はReset Queryで全部を受け取り、そのあとはSerial Notifyが来るか、Refresh Intervalが過ぎるたびに
+# Serial Queryで前回からの差分だけ受け取る。`routinator vrps`でファイルを書き出して読み込み直すより、ずっと早く変化を拾える
+# LiveRovTableは、RIBの全経路のROVの結果を持っておき、VRPsが変わったときに影響を受ける経路だけ検証しなおす
+#
+# 受け取ったPDUはそのままファイルに記録でき(record_path)、tools/rtr_replay_server.pyで再生できる
+
+import logging
+import select
+import socket
+import struct
+import threading
+import time
+from array import array
+from roamon_verify_checker import validate_route, RovResult, _ROV_RESULTS_BY_ID
+from roamon_verify_incremental import RovResultChange
+from roamon_verify_index import VrpTrie, parse_prefix, format_prefix
+
+logger = logging.getLogger(__name__)
+
+# PDUの種類
+PDU_SERIAL_NOTIFY = 0
+PDU_SERIAL_QUERY = 1
+PDU_RESET_QUERY = 2
+PDU_CACHE_RESPONSE = 3
+PDU_IPV4_PREFIX = 4
+PDU_IPV6_PREFIX = 6
+PDU_END_OF_DATA = 7
+PDU_CACHE_RESET = 8
+PDU_ROUTER_KEY = 9
+PDU_ERROR_REPORT = 10
+
+# Error Reportのエラーコード
+ERROR_UNSUPPORTED_PROTOCOL_VERSION = 4
+ERROR_UNSUPPORTED_PDU_TYPE = 5
+ERROR_NAMES = {0: "Corrupt Data", 1: "Internal Error", 2: "No Data Available", 3: "Invalid Request",
+               4: "Unsupported Protocol Version", 5: "Unsupported PDU Type", 6: "Withdrawal of Unknown Record",
+               7: "Duplicate Announcement Received", 8: "Unexpected Protocol Version"}
+
+# 対応するプロトコルのバージョン。まず新しい方でつなぎ、キャッシュが対応していなければ0でつなぎなおす
+LATEST_PROTOCOL_VERSION = 1
+
+# End of DataでRefresh/Retry/Expire Intervalが来ないとき(バージョン0)に使う値 (RFC 8210の推奨値)
+DEFAULT_REFRESH_INTERVAL = 3600
+DEFAULT_RETRY_INTERVAL = 600
+DEFAULT_EXPIRE_INTERVAL = 7200
+
+# キャッシュがまだVRPsを持っていない(No Data Available)ときに、つなぎなおすまで待つ秒数の上限
+NO_DATA_RETRY_INTERVAL = 30
+
+# 1つのPDUを読み終わるまで待つ秒数
+IO_TIMEOUT = 30
+# PDUの長さの上限 (壊れたデータで巨大なバッファを確保しないように)
+MAX_PDU_LENGTH = 64 * 1024
+
+_HEADER_FORMAT = "!BBHI"
+_HEADER_SIZE = struct.calcsize(_HEADER_FORMAT)
+_FLAG_ANNOUNCE = 1
+
+
+# キャッシュがError Reportを返したときや、通信の内容がおかしいときの例外
+class RtrError(Exception):
+    def __init__(self, message, error_code=None):
+        super().__init__(message)
+        self.error_code = error_code
+
+
+# PDUを1つ組み立てる。session_fieldはSession ID、Error Codeまたは0
+def encode_pdu(version, pdu_type, session_field, body=b""):
+    return struct.pack(_HEADER_FORMAT, version, pdu_type, session_field, _HEADER_SIZE + len(body)) + body
+
+
+def encode_serial_query(version, session_id, serial):
+    return encode_pdu(version, PDU_SERIAL_QUERY, session_id, struct.pack("!I", serial))
+
+
+def encode_reset_query(version):
+    return encode_pdu(version, PDU_RESET_QUERY, 0)
+
+
+# VRP 1つ分のIPv4 PrefixかIPv6 PrefixのPDU。announceがFalseなら取り消し(withdraw)
+def encode_prefix(version, announce, prefix, asn, max_length):
+    ip_version, network_int, prefixlen = parse_prefix(prefix)
+    flags = _FLAG_ANNOUNCE if announce else 0
+    if ip_version == 4:
+        return encode_pdu(version, PDU_IPV4_PREFIX, 0,
+                          struct.pack("!BBBxII", flags, prefixlen, max_length, network_int, asn))
+    return encode_pdu(version, PDU_IPV6_PREFIX, 0,
+                      struct.pack("!BBBx", flags, prefixlen, max_length) + network_int.to_bytes(16, "big") +
+                      struct.pack("!I", asn))
+
+
+# End of Data。バージョン0にはタイマーの値が無い
+def encode_end_of_data(version, session_id, serial, refresh=DEFAULT_REFRESH_INTERVAL, retry=DEFAULT_RETRY_INTERVAL,
+                       expire=DEFAULT_EXPIRE_INTERVAL):
+    if version == 0:
+        return encode_pdu(version, PDU_END_OF_DATA, session_id, struct.pack("!I", serial))
+    return encode_pdu(version, PDU_END_OF_DATA, session_id, struct.pack("!IIII", serial, refresh, retry, expire))
+
+
+# Error Report。pduはエラーの原因になったPDU
+def encode_error_report(version, error_code, pdu=b"", text=""):
+    text_bytes = text.encode("utf-8")
+    return encode_pdu(version, PDU_ERROR_REPORT, error_code,
+                      struct.pack("!I", len(pdu)) + pdu + struct.pack("!I", len(text_bytes)) + text_bytes)
+
+
+# IPv4 Prefix/IPv6 PrefixのPDUの中身を (announceかどうか, prefix文字列, ASN, maxLength) にする
+def decode_prefix(pdu_type, body):
+    if pdu_type == PDU_IPV4_PREFIX:
+        flags, prefixlen, max_length, network_int, asn = struct.unpack("!BBBxII", body)
+        ip_version = 4
+    else:
+        flags, prefixlen, max_length = struct.unpack_from("!BBBx", body)
+        network_int = int.from_bytes(body[4:20], "big")
+        asn, = struct.unpack_from("!I", body, 20)
+        ip_version = 6
+    return bool(flags & _FLAG_ANNOUNCE), format_prefix(ip_version, network_int, prefixlen), asn, max_length
+
+
+# Error Reportの中身から、中に入っているエラーの説明の文字列を取り出す
+def decode_error_text(body):
+    try:
+        pdu_length, = struct.unpack_from("!I", body)
+        text_length, = struct.unpack_from("!I", body, 4 + pdu_length)
+        return body[8 + pdu_length:8 + pdu_length + text_length].decode("utf-8", "replace")
+    except struct.error:
+        return ""
+
+
+# ソケットからちょうどsize バイト読む。途中で切れたらConnectionError
+def _recv_exact(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError("connection closed by RTR cache")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+# PDUを1つ読む。(バージョン, 種類, Session ID(かError Code), 中身, PDU全体のバイト列) を返す
+def read_pdu(sock):
+    header = _recv_exact(sock, _HEADER_SIZE)
+    version, pdu_type, session_field, length = struct.unpack(_HEADER_FORMAT, header)
+    if not _HEADER_SIZE <= length <= MAX_PDU_LENGTH:
+        raise RtrError("invalid PDU length {}".format(length))
+    body = _recv_exact(sock, length - _HEADER_SIZE)
+    return version, pdu_type, session_field, body, header + body
+
+
+# バイト列に並んだPDUを1つずつ (バージョン, 種類, Session ID(かError Code), 中身, PDU全体のバイト列) で返すジェネレータ
+def iter_pdus(data):
+    offset = 0
+    while offset < len(data):
+        version, pdu_type, session_field, length = struct.unpack_from(_HEADER_FORMAT, data, offset)
+        if not _HEADER_SIZE <= length <= len(data) - offset:
+            raise RtrError("invalid PDU length {} at offset {}".format(length, offset))
+        yield version, pdu_type, session_field, data[offset + _HEADER_SIZE:offset + length], \
+            data[offset:offset + length]
+        offset += length
+
+
+# RtrClientのrecord_pathに記録したファイルを読み、応答(Cache ResponseからEnd of DataまでのPDUのバイト列)のリストにする
+# 最初の応答はReset Queryへの応答で、残りはそれに続くSerial Queryへの応答(差分)
+def read_recorded_responses(file_path):
+    with open(file_path, "rb") as f:
+        data = f.read()
+    responses = []
+    current = []
+    for _, pdu_type, _, _, raw in iter_pdus(data):
+        current.append(raw)
+        if pdu_type == PDU_END_OF_DATA:
+            responses.append(b"".join(current))
+            current = []
+    return responses
+
+
+# RTRのクライアント。受け取ったVRPsをvrps(VrpTrie)に反映する
+# sync()で1回問い合わせ、run()ではつなぎっぱなしにして、通知や時間切れのたびに問い合わせる(切れたらつなぎなおす)
+class RtrClient:
+    def __init__(self, host, port, vrps=None, version=LATEST_PROTOCOL_VERSION, record_path=None):
+        self.host = host
+        self.port = port
+        self.vrps = vrps if vrps is not None else VrpTrie()
+        self.version = version
+        self.record_path = record_path
+        self.session_id = None
+        self.serial = None
+        self.refresh_interval = DEFAULT_REFRESH_INTERVAL
+        self.retry_interval = DEFAULT_RETRY_INTERVAL
+        self.expire_interval = DEFAULT_EXPIRE_INTERVAL
+        # 最後にキャッシュと同期できた時刻 (time.time())
+        self.last_synced_at = None
+        # 最初の同期が終わったらセットされる (serveはこれを待ってから問い合わせを受け付ける)
+        self.ready = threading.Event()
+        self._sock = None
+
+    def connect(self):
+        self.close()
+        self._sock = socket.create_connection((self.host, self.port), timeout=IO_TIMEOUT)
+        logger.info("connected to RTR cache {}:{} (protocol version {})".format(self.host, self.port, self.version))
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    # キャッシュに問い合わせ、応答の差分をVRPsに反映する。前回の同期があればSerial Query、なければReset Query
+    # 反映したVRPの変化を [(追加ならTrue, prefix文字列, ASN, maxLength), ...] で返す
+    def sync(self):
+        if self.session_id is None:
+            return self._query(encode_reset_query(self.version), reset=True)
+        try:
+            return self._query(encode_serial_query(self.version, self.session_id, self.serial), reset=False)
+        except _CacheReset:
+            # キャッシュがその差分を持っていない。全部もらいなおす
+            logger.info("RTR cache has no delta from serial {}. resetting".format(self.serial))
+            return self._query(encode_reset_query(self.version), reset=True)
+
+    def _query(self, query_pdu, reset):
+        self._sock.sendall(query_pdu)
+        recorded = []
+        received = []
+        in_response = False
+        while True:
+            version, pdu_type, session_field, body, raw = read_pdu(self._sock)
+            if pdu_type == PDU_ERROR_REPORT:
+                error_text = decode_error_text(body)
+                raise RtrError("RTR cache reported error {} ({}): {}".format(
+                    session_field, ERROR_NAMES.get(session_field, "unknown"), error_text), session_field)
+            if version != self.version:
+                raise RtrError("RTR cache answered with protocol version {} to version {}".format(version,
+                                                                                                 self.version))
+            if pdu_type == PDU_SERIAL_NOTIFY:
+                # 問い合わせの途中に来た通知。この応答を読み終われば最新になるので無視してよい
+                continue
+            if pdu_type == PDU_CACHE_RESET:
+                raise _CacheReset()
+            recorded.append(raw)
+            if pdu_type == PDU_CACHE_RESPONSE:
+                if not reset and session_field != self.session_id:
+                    raise RtrError("session ID of RTR cache changed from {} to {}".format(self.session_id,
+                                                                                          session_field))
+                in_response = True
+            elif pdu_type in (PDU_IPV4_PREFIX, PDU_IPV6_PREFIX) and in_response:
+                received.append(decode_prefix(pdu_type, body))
+            elif pdu_type == PDU_END_OF_DATA and in_response:
+                self._end_of_data(version, session_field, body)
+                break
+            elif pdu_type == PDU_ROUTER_KEY:
+                # BGPsecのルータ鍵は使わない
+                continue
+            else:
+                raise RtrError("unexpected PDU type {}".format(pdu_type))
+
+        changes = self._apply(received, reset)
+        self.last_synced_at = time.time()
+        self.ready.set()
+        if self.record_path is not None:
+            with open(self.record_path, "ab") as f:
+                f.write(b"".join(recorded))
+        logger.info("synced with RTR cache: session {} serial {}, {} VRPs changed, {} VRPs in total".format(
+            self.session_id, self.serial, len(changes), len(self.vrps)))
+        return changes
+
+    def _end_of_data(self, version, session_id, body):
+        self.session_id = session_id
+        if version == 0:
+            self.serial, = struct.unpack("!I", body)
+        else:
+            self.serial, self.refresh_interval, self.retry_interval, self.expire_interval = struct.unpack("!IIII",
+                                                                                                        body)
+
+    # 受け取ったVRPをVrpTrieに反映し、実際に変わったものを返す
+    # Reset Queryの応答は全部のVRPなので、今持っているものとの差分を取って反映する(VrpTrieのオブジェクトは変えない)
+    def _apply(self, received, reset):
+        if reset:
+            current = set(self.vrps.vrps())
+            announced = set((prefix, asn, max_length) for _, prefix, asn, max_length in received)
+            received = [(False, prefix, asn, max_length) for prefix, asn, max_length in current - announced] + \
+                       [(True, prefix, asn, max_length) for prefix, asn, max_length in announced - current]
+
+        changes = []
+        for announce, prefix, asn, max_length in received:
+            count = len(self.vrps)
+            if announce:
+                self.vrps.add(prefix, asn, max_length)
+            else:
+                self.vrps.remove(prefix, asn, max_length)
+            if len(self.vrps) != count:
+                changes.append((announce, prefix, asn, max_length))
+            else:
+                # RFC 8210では重複した追加や、無いものの取り消しはエラーだが、つなぎなおさずに無視する
+                logger.warning("ignore {} of {} AS{} maxlen {}: {}".format(
+                    "announcement" if announce else "withdrawal", prefix, asn, max_length,
+                    "already exists" if announce else "not found"))
+        return changes
+
+    # Serial Notifyが来るか、timeout秒経つまで待つ。通知が来たらTrue
+    def wait_for_notify(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            readable, _, _ = select.select([self._sock], [], [], remaining)
+            if not readable:
+                return False
+            version, pdu_type, session_field, body, _ = read_pdu(self._sock)
+            if pdu_type == PDU_SERIAL_NOTIFY:
+                logger.debug("got serial notify (serial {})".format(struct.unpack("!I", body)[0]))
+                return True
+            if pdu_type == PDU_ERROR_REPORT:
+                raise RtrError("RTR cache reported error {} ({}): {}".format(
+                    session_field, ERROR_NAMES.get(session_field, "unknown"), decode_error_text(body)), session_field)
+            logger.debug("ignore unexpected PDU type {} while waiting".format(pdu_type))
+
+    # つなぎっぱなしにしてVRPsを最新に保つ。同期するたびにon_update(VRPの変化のリスト)を呼ぶ
+    # stop_event(threading.Event)がセットされるか、on_updateがFalseを返したら終わる
+    # 切れたらRetry Intervalだけ待ってつなぎなおす。Expire Intervalを過ぎても同期できなければ、古いVRPsは捨てる
+    def run(self, on_update=None, stop_event=None):
+        stop_event = stop_event if stop_event is not None else threading.Event()
+        while not stop_event.is_set():
+            try:
+                self.connect()
+                while not stop_event.is_set():
+                    changes = self.sync()
+                    if on_update is not None and on_update(changes) is False:
+                        return
+                    self.wait_for_notify(self.refresh_interval)
+            except RtrError as e:
+                if e.error_code == ERROR_UNSUPPORTED_PROTOCOL_VERSION and self.version > 0:
+                    logger.info("RTR cache does not support protocol version {}. retry with version {}".format(
+                        self.version, self.version - 1))
+                    self.version -= 1
+                    self.session_id = None
+                    continue
+                logger.warning("RTR error: {}".format(e))
+            except OSError as e:
+                logger.warning("RTR connection to {}:{} failed: {}".format(self.host, self.port, e))
+            finally:
+                self.close()
+
+            if self._is_expired():
+                logger.warning("VRPs from RTR cache are expired. discard them")
+                changes = self._apply([], reset=True)
+                self.session_id = None
+                self.last_synced_at = None
+                if on_update is not None and on_update(changes) is False:
+                    return
+            retry_interval = self.retry_interval
+            if self.last_synced_at is None:
+                # まだ1回も同期できていない(キャッシュの起動直後など)ときは早めにつなぎなおす
+                retry_interval = min(retry_interval, NO_DATA_RETRY_INTERVAL)
+            stop_event.wait(retry_interval)
+
+    def _is_expired(self):
+        return self.last_synced_at is not None and time.time() - self.last_synced_at > self.expire_interval
+
+    # serveの/statusに出す情報
+    def status(self):
+        return {"server": "{}:{}".format(self.host, self.port),
+                "protocol_version": self.version,
+                "session_id": self.session_id,
+                "serial": self.serial,
+                "vrps": len(self.vrps),
+                "last_synced_at": self.last_synced_at}
+
+
+# Cache Resetを受け取ったことを_query()からsync()に伝える
+class _CacheReset(RtrError):
+    def __init__(self):
+        super().__init__("RTR cache sent cache reset")
+
+
+# RIBの全経路のROVの結果を持ち、VRPsが変わったら影響を受ける経路だけ検証しなおす表
+# RFC 6811ではVRPが結果を変えうるのはそのVRPのprefixに含まれる(同じか長い)経路だけなので、それだけを引きなおす
+class LiveRovTable:
+    def __init__(self, vrps, rib):
+        self.vrps = vrps
+        self.rib = rib
+        import roamon_verify_batch
+        if roamon_verify_batch.is_available():
+            self._result_ids = roamon_verify_batch.validate_rib(vrps, rib)
+        else:
+            self._result_ids = array("B", (validate_route(vrps, version, network_int, prefixlen, origin_asn).id
+                                           for version in (4, 6)
+                                           for network_int, prefixlen, origin_asn, _ in rib.entries(version)))
+
+    # 結果ごとの経路の数 {RovResult: 数}
+    def counts(self):
+        counts = {rov_result: 0 for rov_result in (RovResult.VALID, RovResult.INVALID, RovResult.NOT_FOUND)}
+        for result_id in self._result_ids:
+            counts[_ROV_RESULTS_BY_ID[int(result_id)]] += 1
+        return counts
+
+    # VRPの変化 (RtrClient.sync()の返り値) を受け取り、影響を受ける経路を検証しなおす
+    # 結果が変わった経路を [RovResultChange, ...] でRIBの順に返す
+    def revalidate(self, vrp_changes):
+        affected_indexes = set()
+        for _, prefix, _, _ in vrp_changes:
+            affected_indexes.update(self.rib.within_indexes(*parse_prefix(prefix)))
+
+        changes = []
+        for idx in sorted(affected_indexes):
+            version, network_int, prefixlen, origin_asn, _ = self.rib.entry(idx)
+            new_rov_result = validate_route(self.vrps, version, network_int, prefixlen, origin_asn)
+            old_rov_result = _ROV_RESULTS_BY_ID[int(self._result_ids[idx])]
+            if new_rov_result != old_rov_result:
+                self._result_ids[idx] = new_rov_result.id
+                changes.append(RovResultChange(format_prefix(version, network_int, prefixlen), origin_asn,
+                                               old_rov_result, new_rov_result))
+        logger.debug("revalidated {} routes, {} changed".format(len(affected_indexes), len(changes)))
+        return changes
+
@@ -0,0 +1,245 @@
+# encoding: UTF-8
+
+# Copyright (c) 2019-2020 Japan Network Information Center ("JPNIC")
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute and/or sublicense of
+# the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# VRPsとRIBを読み込んだままにしておき、HTTPでROVの問い合わせに答えるデーモン
+#
+#   GET  /rov?ip=192.0.2.0/24&ip=198.51.100.1   -> [PrefixRovResultStruct.to_dict(), ...]
+#   GET  /rov_with_asn?asn=64511&asn=64510      -> [AsnRovResultStruct.to_dict(), ...]
+#   POST /batch  {"ip": [...], "asn": [...]}     -> {"ip": [...], "asn": [...]}
+#   GET  /status                                -> 読み込んでいるデータの情報とキャッシュのヒット率 (RTRならその同期の状態も)
+#
+# localhostのTCPポートかUnixドメインソケットで待ち受ける。
+# データファイル(かそのスナップショット)が更新されたら裏で読み込み直し、読み込みが終わった時点で参照をまるごと差し替える
+# 同じprefixやASNの問い合わせの結果はキャッシュする。データを差し替えるとキャッシュは捨てられる
+# rtr_addressを指定すると、VRPsはファイルからではなくRTRで受け取り、キャッシュからの差分をその場で反映し続ける
+
+import json
+import logging
+import os
+import signal
+import socketserver
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import roamon_verify_cache
+import roamon_verify_checker
+import roamon_verify_rtr
+import roamon_verify_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+# 読み込んだデータと、それがどのファイルのいつの版なのかを持つ
+# 読み込み直すときは新しいインスタンスを作って差し替えるだけなので、リクエスト処理中に中身が変わることはない
+# (vrpsを渡したとき(RTRで受け取っているとき)は、VRPsはファイルから読まずにそれを使い続ける。中身はRTRの差分で変わっていく)
+class LoadedData:
+    def __init__(self, file_path_vrps, file_path_rib, vrps=None):
+        self.file_paths = (file_path_vrps, file_path_rib)
+        self.mtimes = _get_mtimes(self.file_paths)
+        if vrps is not None:
+            self.vrps = vrps
+            self.rib = roamon_verify_checker.load_rib(file_path_rib)
+        else:
+            data = roamon_verify_checker.load_all_data(file_path_vrps, file_path_rib)
+            self.vrps = data["vrps"]
+            self.rib = data["rib"]
+        self.loaded_at = time.time()
+
+
+# データファイルとスナップショットの最終更新時刻 (無いファイルはNone)
+def _get_mtimes(file_paths):
+    mtimes = []
+    for file_path in file_paths:
+        for path in (file_path, roamon_verify_snapshot.snapshot_path(file_path)):
+            mtimes.append(os.path.getmtime(path) if os.path.exists(path) else None)
+    return tuple(mtimes)
+
+
+# ROVの問い合わせを処理する本体。HTTPとは切り離しておく
+class RovService:
+    def __init__(self, file_path_vrps, file_path_rib, cache_size=roamon_verify_cache.DEFAULT_CACHE_SIZE,
+                 rtr_client=None):
+        self.file_path_vrps = file_path_vrps
+        self.file_path_rib = file_path_rib
+        self.rtr_client = rtr_client
+        self.rtr_vrps = rtr_client.vrps if rtr_client is not None else None
+        self.data = LoadedData(file_path_vrps, file_path_rib, self.rtr_vrps)
+        self.cache = roamon_verify_cache.RovCache(cache_size)
+        self._reload_lock = threading.Lock()
+
+    # ファイルが更新されていたら読み込み直す。読み込み直したらTrue
+    def reload_if_changed(self):
+        with self._reload_lock:
+            if _get_mtimes(self.data.file_paths) == self.data.mtimes:
+                return False
+            logger.info("data files are updated. reloading...")
+            # 読み込みが終わるまでは古いデータで答え続け、終わったら1回の代入で差し替える
+            self.data = LoadedData(self.file_path_vrps, self.file_path_rib, self.rtr_vrps)
+            logger.info("reloaded")
+            return True
+
+    def rov(self, prefixes):
+        data = self.data
+        # prefixを複数のASが広告していたら(MOAS)、Origin ASごとの結果が並ぶ
+        return [result_struct.to_dict() for prefix in prefixes
+                for result_struct in self.cache.rov(data.vrps, data.rib, prefix)]
+
+    def rov_with_asn(self, asns):
+        data = self.data
+        return [self.cache.rov_with_asn(data.vrps, data.rib, asn).to_dict() for asn in asns]
+
+    # 問い合わせは {"ip": [prefix文字列, ...], "asn": [ASN, ...]}。形が違えばValueError (400を返す)
+    def batch(self, request):
+        if not isinstance(request, dict):
+            raise ValueError("request body must be a JSON object")
+        prefixes = request.get("ip", [])
+        asns = request.get("asn", [])
+        if not isinstance(prefixes, list) or not all(isinstance(prefix, str) for prefix in prefixes):
+            raise ValueError("\"ip\" must be a list of prefix strings")
+        if not isinstance(asns, list) or not all(isinstance(asn, (str, int)) and not isinstance(asn, bool)
+                                                 for asn in asns):
+            raise ValueError("\"asn\" must be a list of ASNs")
+        return {"ip": self.rov(prefixes),
+                "asn": self.rov_with_asn(asns)}
+
+    def status(self):
+        data = self.data
+        status = {"file_path_vrps": data.file_paths[0],
+                  "file_path_rib": data.file_paths[1],
+                  "loaded_at": data.loaded_at,
+                  "cache": self.cache.stats()}
+        if self.rtr_client is not None:
+            status["rtr"] = self.rtr_client.status()
+        return status
+
+
+# 一定間隔でファイルの更新を見に行くスレッド
+def _watch_data_files(service, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            service.reload_if_changed()
+        except Exception:
+            # getの途中でファイルが壊れていたりしても、古いデータのまま動き続ける
+            logger.exception("failed to reload data. keep serving old data.")
+
+
+class RovRequestHandler(BaseHTTPRequestHandler):
+    # self.server.serviceにRovServiceが入っている
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        service = self.server.service
+        if url.path == "/rov":
+            self._answer(service.rov, query.get("ip", []))
+        elif url.path == "/rov_with_asn":
+            self._answer(service.rov_with_asn, query.get("asn", []))
+        elif url.path == "/status":
+            self._send_json(200, service.status())
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/batch":
+            self._send_json(404, {"error": "not found"})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": "request body is not JSON"})
+            return
+        self._answer(self.server.service.batch, request)
+
+    # 問い合わせを処理して結果を返す。prefixやASNの書式がおかしいときは400を返す
+    def _answer(self, func, arg):
+        try:
+            result = func(arg)
+        except (ValueError, TypeError, AttributeError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        self._send_json(200, result)
+
+    def _send_json(self, status, obj):
+        # RovResultはstr()で"VALID"などの文字列になる
+        body = json.dumps(obj, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Unixドメインソケットのときはclient_addressが空文字なので、ログ用のアドレスを差し替える
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return super().address_string()
+        return "unix"
+
+    def log_message(self, format, *args):
+        logger.info("%s - %s", self.address_string(), format % args)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+# デーモンを起動する。unix_socket_pathを指定するとTCPのかわりにUnixドメインソケットで待ち受ける
+# cache_sizeはprefixとASNそれぞれについてキャッシュする結果の数。0ならキャッシュしない
+# rtr_addressに(ホスト, ポート)を渡すと、VRPsをそのRTRキャッシュから受け取る。最初の同期が終わるまで待ってから待ち受ける
+def serve(file_path_vrps, file_path_rib, host="127.0.0.1", port=8080, unix_socket_path=None, reload_interval=60,
+          cache_size=roamon_verify_cache.DEFAULT_CACHE_SIZE, rtr_address=None,
+          rtr_version=roamon_verify_rtr.LATEST_PROTOCOL_VERSION):
+    rtr_client = None
+    if rtr_address is not None:
+        rtr_client = roamon_verify_rtr.RtrClient(*rtr_address, version=rtr_version)
+        threading.Thread(target=rtr_client.run, daemon=True).start()
+        logger.info("waiting for VRPs from RTR cache {}:{}".format(*rtr_address))
+        rtr_client.ready.wait()
+    service = RovService(file_path_vrps, file_path_rib, cache_size, rtr_client)
+
+    if unix_socket_path is not None:
+        if os.path.exists(unix_socket_path):
+            os.remove(unix_socket_path)
+        server = ThreadingUnixHTTPServer(unix_socket_path, RovRequestHandler)
+        logger.info("serving on unix socket {}".format(unix_socket_path))
+    else:
+        server = ThreadingHTTPServer((host, port), RovRequestHandler)
+        logger.info("serving on http://{}:{}/".format(host, port))
+    server.service = service
+
+    if reload_interval > 0:
+        watcher = threading.Thread(target=_watch_data_files, args=(service, reload_interval), daemon=True)
+        watcher.start()
+
+    # SIGTERMで止められたときも後片付け(ソケットファイルの削除)をする
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if unix_socket_path is not None and os.path.exists(unix_socket_path):
+            os.remove(unix_socket_path)
@@ -0,0 +1,443 @@
+# encoding: UTF-8
+
+# Copyright (c) 2019-2020 Japan Network Information Center ("JPNIC")
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute and/or sublicense of
+# the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# VRPsとRIBのファイルをコンパイルして、mmapでそのまま引けるバイナリのスナップショットにする
+# 毎回パースしてradix treeやトライを作り直すかわりにこれをmmapすれば、起動がほぼ一瞬で済み、複数のプロセスでページキャッシュも共有できる
+# スナップショットが無いときは、同じ配列をメモリ上に作って使う (RibTable.from_file()など)
+#
+# ファイルの中身 (数値はすべて書き込んだマシンのバイトオーダー。各セクションは8バイト境界に揃える)
+#   ヘッダ: マジック(8バイト), バイトオーダー(1バイト), パディング(7バイト), IPv4のエントリ数, IPv6のエントリ数, ASN数, ASN表のエントリ数 (各uint64)
+#   IPv4: ネットワークアドレス(uint32), プレフィックス長(uint8), ASN(uint32), 値(uint32), 親の番号(int32)
+#   IPv6: ネットワークアドレスの上位64bit(uint64), 下位64bit(uint64), プレフィックス長(uint8), ASN(uint32), 値(uint32), 親の番号(int32)
+#   ASN表: ASN(uint32, 昇順), 各ASNのエントリの開始位置(uint32, ASN数+1個), エントリの番号(uint32. IPv6はIPv4のエントリ数だけずらした番号)
+# エントリは(ネットワークアドレス, プレフィックス長, ASN, 値)の昇順に並んでいて、同じprefixのエントリ(複数のASがROA登録したVRPや、
+# 複数のASが広告している(MOAS)経路など)は隣り合う。親の番号は、そのprefixを含む別のprefixのうち一番長いものの、最後のエントリの番号(なければ-1)
+# 値はVRPsではmaxLength、RIBではその経路(prefixとOrigin ASの組)を見ていたピアの数
+
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from roamon_verify_index import parse_prefix, format_prefix
+from roamon_verify_vrps import read_vrps_file
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b"RVSNAP03"
+SNAPSHOT_SUFFIX = ".snap"
+_HEADER_FORMAT = "=8sB7xQQQQ"
+_HEADER_SIZE = struct.calcsize(_HEADER_FORMAT)
+_BYTEORDER_FLAGS = {"little": 0, "big": 1}
+
+
+# データファイルに対応するスナップショットのファイルパス
+def snapshot_path(file_path_data):
+    return file_path_data + SNAPSHOT_SUFFIX
+
+
+# スナップショットが元のファイルより新しく、今の形式で書かれている(=そのまま使ってよい)か調べる
+def is_snapshot_fresh(file_path_data):
+    file_path_snapshot = snapshot_path(file_path_data)
+    if not os.path.exists(file_path_snapshot):
+        return False
+    with open(file_path_snapshot, "rb") as f:
+        if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            logger.debug("{} is written in old format. ignore it.".format(file_path_snapshot))
+            return False
+    if not os.path.exists(file_path_data):
+        return True
+    return os.path.getmtime(file_path_snapshot) >= os.path.getmtime(file_path_data)
+
+
+# 8バイト境界に揃える
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+# 各セクションの(名前, 型, 要素数)のリスト。書き込みと読み込みで同じものを使う
+def _section_layout(n4, n6, n_asn, n_entries):
+    return [("v4_network", "I", n4),
+            ("v4_prefixlen", "B", n4),
+            ("v4_asn", "I", n4),
+            ("v4_value", "I", n4),
+            ("v4_parent", "i", n4),
+            ("v6_network_hi", "Q", n6),
+            ("v6_network_lo", "Q", n6),
+            ("v6_prefixlen", "B", n6),
+            ("v6_asn", "I", n6),
+            ("v6_value", "I", n6),
+            ("v6_parent", "i", n6),
+            ("asn_keys", "I", n_asn),
+            ("asn_offsets", "I", n_asn + 1),
+            ("asn_entries", "I", n_entries)]
+
+
+# RIBのファイルを読んで (prefix文字列, Origin AS, ピア数) を1つずつ返すジェネレータ
+# 1行に「prefix<TAB>ASN<TAB>ピア数」。同じprefixの行が複数あってよい(MOAS)。ピア数の無い行(pyasn用の形式)は1とみなす
+def read_rib_file(file_path_rib):
+    with open(file_path_rib, "r") as f:
+        for line in f:
+            if line.startswith(";"):
+                continue
+            columns = line.split()
+            if len(columns) < 2:
+                continue
+            yield columns[0], int(columns[1]), int(columns[2]) if len(columns) >= 3 else 1
+
+
+# 経路の列を (prefix文字列, Origin AS) ごとにまとめ、ピア数を足し合わせる
+def merge_routes(routes):
+    peer_counts = defaultdict(int)
+    for prefix, origin_asn, peer_count in routes:
+        peer_counts[(prefix, origin_asn)] += peer_count
+    return ((prefix, origin_asn, peer_count) for (prefix, origin_asn), peer_count in peer_counts.items())
+
+
+# (ネットワークアドレス, プレフィックス長, ...)の昇順に並んだエントリについて、それぞれの親の番号を求める
+def _compute_parents(entries, max_prefixlen):
+    parents = []
+    stack = []  # [prefixの最後のエントリの番号, 末尾アドレス] 今見ているprefixを含んでいる可能性のあるprefixたち
+    previous_prefix = None
+    for idx, (network_int, prefixlen, _, _) in enumerate(entries):
+        if (network_int, prefixlen) == previous_prefix:
+            # 同じprefixの2つめ以降のエントリ
+            parents.append(parents[-1])
+            stack[-1][0] = idx
+            continue
+        previous_prefix = (network_int, prefixlen)
+        while stack and stack[-1][1] < network_int:
+            stack.pop()
+        parents.append(stack[-1][0] if stack else -1)
+        stack.append([idx, network_int + (1 << (max_prefixlen - prefixlen)) - 1])
+    return parents
+
+
+# (prefix文字列, ASN, 値) の列から、スナップショットの各セクションの配列を作る。((各セクションの要素数), {名前: array}) を返す
+def _build_sections(entries):
+    entries_by_version = {4: set(), 6: set()}
+    for prefix, asn, value in entries:
+        version, network_int, prefixlen = parse_prefix(prefix)
+        entries_by_version[version].add((network_int, prefixlen, asn, value))
+    entries_v4 = sorted(entries_by_version[4])
+    entries_v6 = sorted(entries_by_version[6])
+
+    # ASNごとのエントリの番号の表
+    entries_by_asn = defaultdict(list)
+    for idx, entry in enumerate(entries_v4):
+        entries_by_asn[entry[2]].append(idx)
+    for idx, entry in enumerate(entries_v6):
+        entries_by_asn[entry[2]].append(len(entries_v4) + idx)
+    asn_keys = sorted(entries_by_asn)
+    asn_offsets = [0]
+    asn_entries = []
+    for asn in asn_keys:
+        asn_entries.extend(entries_by_asn[asn])
+        asn_offsets.append(len(asn_entries))
+
+    values = {
+        "v4_network": [e[0] for e in entries_v4],
+        "v4_prefixlen": [e[1] for e in entries_v4],
+        "v4_asn": [e[2] for e in entries_v4],
+        "v4_value": [e[3] for e in entries_v4],
+        "v4_parent": _compute_parents(entries_v4, 32),
+        "v6_network_hi": [e[0] >> 64 for e in entries_v6],
+        "v6_network_lo": [e[0] & 0xFFFFFFFFFFFFFFFF for e in entries_v6],
+        "v6_prefixlen": [e[1] for e in entries_v6],
+        "v6_asn": [e[2] for e in entries_v6],
+        "v6_value": [e[3] for e in entries_v6],
+        "v6_parent": _compute_parents(entries_v6, 128),
+        "asn_keys": asn_keys,
+        "asn_offsets": asn_offsets,
+        "asn_entries": asn_entries,
+    }
+    counts = (len(entries_v4), len(entries_v6), len(asn_keys), len(asn_entries))
+    sections = {name: array(typecode, values[name]) for name, typecode, _ in _section_layout(*counts)}
+    return counts, sections
+
+
+# (prefix文字列, ASN, 値) の列からスナップショットを作り、一時ファイルに書いてからrenameする(読み込み中のプロセスを壊さないため)
+def write_snapshot_from_entries(entries, file_path_snapshot):
+    counts, sections = _build_sections(entries)
+
+    file_path_tmp = "{}.tmp{}".format(file_path_snapshot, os.getpid())
+    with open(file_path_tmp, "wb") as f:
+        f.write(struct.pack(_HEADER_FORMAT, SNAPSHOT_MAGIC, _BYTEORDER_FLAGS[sys.byteorder], *counts))
+        offset = _HEADER_SIZE
+        for name, _, _ in _section_layout(*counts):
+            f.write(b"\0" * (_align(offset) - offset))
+            data = sections[name].tobytes()
+            f.write(data)
+            offset = _align(offset) + len(data)
+    os.replace(file_path_tmp, file_path_snapshot)
+    logger.debug("finish write snapshot to {}".format(file_path_snapshot))
+
+
+# RIBのファイルをコンパイルしてスナップショットを書き出す
+# routesに (prefix文字列, Origin AS, ピア数) の列を渡すと、ファイルを読み直さずにそれを使う (getで取得したばかりのとき)
+def write_snapshot(file_path_rib, file_path_snapshot=None, routes=None):
+    if file_path_snapshot is None:
+        file_path_snapshot = snapshot_path(file_path_rib)
+    if routes is None:
+        routes = read_rib_file(file_path_rib)
+    write_snapshot_from_entries(merge_routes(routes), file_path_snapshot)
+
+
+# VRPsのファイルをコンパイルしてスナップショットを書き出す
+# vrpsに (prefix文字列, ASN, maxLength) の列を渡すと、ファイルを読み直さずにそれを使う (getで取得したばかりのとき)
+def write_vrp_snapshot(file_path_vrps, file_path_snapshot=None, vrps=None):
+    if file_path_snapshot is None:
+        file_path_snapshot = snapshot_path(file_path_vrps)
+    if vrps is None:
+        vrps = read_vrps_file(file_path_vrps)
+    write_snapshot_from_entries(vrps, file_path_snapshot)
+
+
+# prefixの表を配列で持ち、検索をする基底クラス
+# file_path_snapshotを指定するとスナップショットをmmapし、entriesを指定すると同じ配列をメモリ上に作る
+class _PrefixTable:
+    def __init__(self, file_path_snapshot=None, entries=None):
+        self._file_path_snapshot = file_path_snapshot
+        if file_path_snapshot is not None:
+            self._open()
+        else:
+            self._set_sections(*_build_sections(entries))
+
+    def _open(self):
+        with open(self._file_path_snapshot, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, byteorder_flag, n4, n6, n_asn, n_entries = struct.unpack_from(_HEADER_FORMAT, self._mmap, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("{} is not a roamon-verify snapshot".format(self._file_path_snapshot))
+        if byteorder_flag != _BYTEORDER_FLAGS[sys.byteorder]:
+            raise ValueError("{} was written on a machine with different byte order".format(self._file_path_snapshot))
+
+        buffer = memoryview(self._mmap)
+        sections = {}
+        offset = _HEADER_SIZE
+        for name, typecode, count in _section_layout(n4, n6, n_asn, n_entries):
+            offset = _align(offset)
+            size = count * struct.calcsize(typecode)
+            sections[name] = buffer[offset:offset + size].cast(typecode)
+            offset += size
+        self._set_sections((n4, n6, n_asn, n_entries), sections)
+        logger.debug("finish map snapshot {} ({} entries)".format(self._file_path_snapshot, n4 + n6))
+
+    def _set_sections(self, counts, sections):
+        self._counts = counts
+        self._sections = sections
+        self._n4, self._n6 = counts[0], counts[1]
+        for name, section in sections.items():
+            setattr(self, "_" + name, section)
+
+    # pickleするとき、スナップショットならmmapではなくファイルパスだけ渡し、復元先でもう一度mmapする
+    def __getstate__(self):
+        if self._file_path_snapshot is not None:
+            return {"file_path_snapshot": self._file_path_snapshot}
+        return {"file_path_snapshot": None, "counts": self._counts, "sections": self._sections}
+
+    def __setstate__(self, state):
+        self._file_path_snapshot = state["file_path_snapshot"]
+        if self._file_path_snapshot is not None:
+            self._open()
+        else:
+            self._set_sections(state["counts"], state["sections"])
+
+    def __len__(self):
+        return self._n4 + self._n6
+
+    def __repr__(self):
+        return "{}('{}') - {} entries".format(type(self).__name__, self._file_path_snapshot, len(self))
+
+    # 配列のおおよそのバイト数
+    def nbytes(self):
+        return sum(section.itemsize * len(section) for section in self._sections.values())
+
+    # IPバージョンごとの配列を {"network": ..., "prefixlen": ..., "asn": ..., "value": ..., "parent": ...} で返す
+    # (IPv6はnetworkのかわりにnetwork_hiとnetwork_lo)。コピーせずに返すので、numpy.frombufferでそのまま包める
+    def columns(self, version):
+        section_prefix = "v{}_".format(version)
+        return {name[len(section_prefix):]: section for name, section in self._sections.items()
+                if name.startswith(section_prefix)}
+
+    # エントリの番号から(IPバージョン, ネットワークアドレスの整数, プレフィックス長, ASN, 値)を得る
+    def entry(self, idx):
+        if idx < self._n4:
+            return 4, self._v4_network[idx], self._v4_prefixlen[idx], self._v4_asn[idx], self._v4_value[idx]
+        idx -= self._n4
+        network_int = (self._v6_network_hi[idx] << 64) | self._v6_network_lo[idx]
+        return 6, network_int, self._v6_prefixlen[idx], self._v6_asn[idx], self._v6_value[idx]
+
+    def prefix(self, idx):
+        version, network_int, prefixlen, _, _ = self.entry(idx)
+        return format_prefix(version, network_int, prefixlen)
+
+    # IPバージョンごとに全てのエントリを (ネットワークアドレスの整数, プレフィックス長, ASN, 値) で順番に返すジェネレータ
+    def entries(self, version):
+        if version == 4:
+            yield from zip(self._v4_network, self._v4_prefixlen, self._v4_asn, self._v4_value)
+            return
+        for network_hi, network_lo, prefixlen, asn, value in zip(self._v6_network_hi, self._v6_network_lo,
+                                                                 self._v6_prefixlen, self._v6_asn, self._v6_value):
+            yield (network_hi << 64) | network_lo, prefixlen, asn, value
+
+    # ネットワークアドレスがnetwork_int以下のエントリのうち、一番うしろにあるものの番号(IPバージョンごとの番号)
+    def _last_index_not_after(self, version, network_int):
+        if version == 4:
+            return bisect_right(self._v4_network, network_int) - 1
+
+        # IPv6は上位と下位に分かれているので、まず上位64bitで範囲を絞ってから下位64bitで探す
+        network_hi = network_int >> 64
+        network_lo = network_int & 0xFFFFFFFFFFFFFFFF
+        low = bisect_left(self._v6_network_hi, network_hi)
+        high = bisect_right(self._v6_network_hi, network_hi)
+        if low == high:
+            return low - 1
+        return bisect_right(self._v6_network_lo, network_lo, low, high) - 1
+
+    # 指定されたprefixを含むエントリの番号を、長いprefixのものから順に返すジェネレータ
+    def covering_indexes(self, version, network_int, prefixlen):
+        if version == 4:
+            max_prefixlen, offset = 32, 0
+            networks, prefixlens, parents = self._v4_network, self._v4_prefixlen, self._v4_parent
+        else:
+            max_prefixlen, offset = 128, self._n4
+            networks, prefixlens, parents = None, self._v6_prefixlen, self._v6_parent
+
+        # 指定されたprefixを含むprefixは、必ず「ネットワークアドレスが指定されたprefix以下の最後のエントリ」のprefixかその祖先
+        # そこから親をたどって、指定されたprefixを含むものを拾っていく
+        idx = self._last_index_not_after(version, network_int)
+        while idx >= 0:
+            candidate_prefixlen = prefixlens[idx]
+            if candidate_prefixlen <= prefixlen:
+                shift = max_prefixlen - candidate_prefixlen
+                candidate_network = networks[idx] if networks is not None else self.entry(offset + idx)[1]
+                if (candidate_network >> shift) == (network_int >> shift):
+                    # 同じprefixのエントリは隣り合っているので全部返す
+                    same_prefix_idx = idx
+                    while True:
+                        yield offset + same_prefix_idx
+                        same_prefix_idx -= 1
+                        if same_prefix_idx < 0 or parents[same_prefix_idx] != parents[idx] \
+                                or prefixlens[same_prefix_idx] != candidate_prefixlen \
+                                or self.entry(offset + same_prefix_idx)[1] != candidate_network:
+                            break
+            idx = parents[idx]
+
+    # 指定されたprefixに含まれる(同じか長い)prefixのエントリの番号を、順番に返すジェネレータ
+    # 含まれるエントリはネットワークアドレスが指定されたprefixの範囲にあるので、並びの中で連続している
+    def within_indexes(self, version, network_int, prefixlen):
+        max_prefixlen, offset = (32, 0) if version == 4 else (128, self._n4)
+        prefixlens = self._v4_prefixlen if version == 4 else self._v6_prefixlen
+        start = self._last_index_not_after(version, network_int - 1) + 1 if network_int > 0 else 0
+        stop = self._last_index_not_after(version, network_int + (1 << (max_prefixlen - prefixlen)) - 1) + 1
+        for idx in range(start, stop):
+            # 先頭には、ネットワークアドレスが同じで短いprefix(指定されたprefixを含む側)が並んでいることがある
+            if prefixlens[idx] >= prefixlen:
+                yield offset + idx
+
+    # エントリのあるASNを全部返す
+    def asns(self):
+        return set(self._asn_keys)
+
+    # 与えられたASNのエントリの番号を全部返す。なければNone
+    def as_entry_indexes(self, asn):
+        asn = int(asn)
+        pos = bisect_left(self._asn_keys, asn)
+        if pos >= len(self._asn_keys) or self._asn_keys[pos] != asn:
+            return None
+        return self._asn_entries[self._asn_offsets[pos]:self._asn_offsets[pos + 1]]
+
+    # 与えられたASNのprefixを全部返す (pyasnと同じく、なければNone)
+    def get_as_prefixes(self, asn):
+        entry_indexes = self.as_entry_indexes(asn)
+        if entry_indexes is None:
+            return None
+        return set(self.prefix(idx) for idx in entry_indexes)
+
+
+# RIBの経路の表。同じprefixを複数のASが広告していても(MOAS)、全部のOrigin ASとそれを見ていたピアの数を持つ
+# RibTable(file_path_snapshot)でスナップショットをmmapするか、RibTable.from_file()でRIBのファイルからメモリ上に作る
+class RibTable(_PrefixTable):
+    @classmethod
+    def from_file(cls, file_path_rib):
+        return cls.from_routes(read_rib_file(file_path_rib))
+
+    # (prefix文字列, Origin AS, ピア数) の列から作る
+    @classmethod
+    def from_routes(cls, routes):
+        rib_table = cls(entries=merge_routes(routes))
+        logger.debug("finish build rib table with {} routes ({} bytes)".format(len(rib_table), rib_table.nbytes()))
+        return rib_table
+
+    # 指定されたprefixにロンゲストマッチするprefixを探す
+    # (ネットワークアドレスの整数, プレフィックス長, [(Origin AS, ピア数), ...]) を返す(Origin ASの昇順)。見つからなければNone
+    def search_best_routes(self, version, network_int, prefixlen):
+        matched = None
+        origins = []
+        for idx in self.covering_indexes(version, network_int, prefixlen):
+            _, route_network_int, route_prefixlen, origin_asn, peer_count = self.entry(idx)
+            if matched is None:
+                matched = (route_network_int, route_prefixlen)
+            elif matched != (route_network_int, route_prefixlen):
+                break
+            origins.append((origin_asn, peer_count))
+        if matched is None:
+            return None
+        return matched[0], matched[1], sorted(origins)
+
+    def prefixes(self):
+        return set(self.prefix(idx) for idx in range(len(self)))
+
+    # 全ての経路を (prefix文字列, Origin AS, ピア数) で返す
+    def routes(self):
+        for idx in range(len(self)):
+            version, network_int, prefixlen, origin_asn, peer_count = self.entry(idx)
+            yield format_prefix(version, network_int, prefixlen), origin_asn, peer_count
+
+
+# VRPsのスナップショットをmmapして、roamon_verify_index.VrpTrieと同じように使えるようにするクラス
+class SnapshotVrpDB(_PrefixTable):
+    # 指定されたprefixを含む(同じか短い)VRPを全部返す。[(VRPのプレフィックス長, ASN, maxLength), ...]
+    def covering_vrps_parsed(self, version, network_int, prefixlen):
+        found = []
+        for idx in self.covering_indexes(version, network_int, prefixlen):
+            _, _, vrp_prefixlen, asn, max_length = self.entry(idx)
+            found.append((vrp_prefixlen, asn, max_length))
+        return found
+
+    def covering_vrps(self, prefix):
+        return self.covering_vrps_parsed(*parse_prefix(prefix))
+
+    def prefixes(self):
+        return set(self.prefix(idx) for idx in range(len(self)))
+
+    # 全てのVRPを (prefix文字列, ASN, maxLength) で返す
+    def vrps(self):
+        for idx in range(len(self)):
+            version, network_int, prefixlen, asn, max_length = self.entry(idx)
+            yield format_prefix(version, network_int, prefixlen), asn, max_length
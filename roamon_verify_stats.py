@@ -0,0 +1,278 @@
+# encoding: UTF-8
+
+# Copyright (c) 2019-2020 Japan Network Information Center ("JPNIC")
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute and/or sublicense of
+# the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# 実行時の統計 (--stats)
+# 処理の段階(読み込み、検証、書き出しなど)ごとの時間、検証した経路の数、キャッシュのヒット率、ASごとにかかった時間を集める
+# enable()するまでは何も記録しない。各関数は有効かどうかを見てすぐ戻るので、1経路ごとではなくASやprefixごとに呼ぶ
+# ワーカープロセスの中の処理は記録されない(親プロセスで結果を受け取った側で数える)。ただしASごとにかかった時間は、
+# ワーカーで測って結果と一緒に返してもらったものを使う (親が結果を待った時間はそのASの検証の時間ではないので)
+
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOP_N = 10
+
+_current = None
+_null_context = nullcontext()
+
+
+# 1回の実行の統計
+class RunStats:
+    def __init__(self, command=None):
+        self.command = command
+        self.started = time.perf_counter()
+        self.finished = None
+        self.phase_seconds = {}
+        self.counters = Counter()
+        self.cache_hits = Counter()
+        self.cache_misses = Counter()
+        # {ASN: [かかった秒数, 経路の数]}
+        self.asn_costs = {}
+        # timed()で最後に取り出した要素にかかった時間
+        self.last_item_seconds = 0.0
+        # 次にtimed()で取り出す要素について、ワーカープロセスで測った時間 (set_worker_item_seconds())
+        self.worker_item_seconds = None
+        # ASごとの時間を測れないとき(numpyで全経路をまとめて検証したときなど)の理由。Noneでなければasn_costsは記録しない
+        self.asn_costs_unavailable = None
+        # getではRIBとVRPsの取得を別スレッドで同時に進めるので
+        self._lock = threading.Lock()
+
+    def add_phase_seconds(self, name, seconds):
+        with self._lock:
+            self.phase_seconds[name] = self.phase_seconds.get(name, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase_seconds(name, time.perf_counter() - start)
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    # ASごとにかかった時間の大きいものから (ASN, 秒数, 経路の数) をn個返す
+    def top_asns(self, n):
+        top = heapq.nlargest(n, self.asn_costs.items(), key=lambda item: item[1][0])
+        return [(asn, seconds, routes) for asn, (seconds, routes) in top]
+
+    # まとめた結果をdictで返す (--stats jsonの出力そのもの)
+    def summary(self, top_n=DEFAULT_TOP_N):
+        wall_seconds = (self.finished or time.perf_counter()) - self.started
+        # numpyでまとめて検証したときは、検証の大部分はvalidate_batchのほう
+        validate_seconds = self.phase_seconds.get("validate", 0.0) + self.phase_seconds.get("validate_batch", 0.0)
+        routes_validated = self.counters["routes_validated"]
+        caches = {}
+        for name in sorted(set(self.cache_hits) | set(self.cache_misses)):
+            hits, misses = self.cache_hits[name], self.cache_misses[name]
+            caches[name] = {"hits": hits, "misses": misses,
+                            "hit_rate": hits / (hits + misses) if hits + misses > 0 else None}
+        return {
+            "command": self.command,
+            "wall_seconds": wall_seconds,
+            "phase_seconds": dict(self.phase_seconds),
+            "counters": dict(self.counters),
+            "validations_per_second": routes_validated / validate_seconds if validate_seconds > 0 else None,
+            "caches": caches,
+            "top_asns": [{"asn": asn, "seconds": seconds, "routes": routes}
+                         for asn, seconds, routes in self.top_asns(top_n)],
+            "top_asns_unavailable": self.asn_costs_unavailable,
+        }
+
+
+# 統計を取り始める。以降の記録はこのRunStatsに入る
+def enable(command=None):
+    global _current
+    _current = RunStats(command)
+    return _current
+
+
+def disable():
+    global _current
+    _current = None
+
+
+def current():
+    return _current
+
+
+# with phase("load_rib"): のように、その間の時間を段階ごとに足していく
+def phase(name):
+    if _current is None:
+        return _null_context
+    return _current.phase(name)
+
+
+def count(name, n=1):
+    if _current is not None:
+        _current.counters[name] += n
+
+
+def cache_hit(name, n=1):
+    if _current is not None:
+        _current.cache_hits[name] += n
+
+
+def cache_miss(name, n=1):
+    if _current is not None:
+        _current.cache_misses[name] += n
+
+
+# 結果のジェネレータから1つ取り出すのにかかった時間を、段階nameの時間として足していく
+# 1つ分の時間はlast_item_secondsに入るので、record_asn_cost()でそのASのコストとして記録できる
+# 統計を取っていなければiterableをそのまま返す
+def timed(iterable, name):
+    if _current is None:
+        return iterable
+    return _timed(_current, iter(iterable), name)
+
+
+def _timed(run_stats, iterator, name):
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            run_stats.add_phase_seconds(name, time.perf_counter() - start)
+            return
+        item_seconds = time.perf_counter() - start
+        run_stats.add_phase_seconds(name, item_seconds)
+        # ワーカープロセスで処理した要素なら、取り出すのを待った時間ではなく、ワーカーで測った時間をその要素の時間にする
+        if run_stats.worker_item_seconds is not None:
+            item_seconds = run_stats.worker_item_seconds
+            run_stats.worker_item_seconds = None
+        run_stats.last_item_seconds = item_seconds
+        yield item
+
+
+# ワーカープロセスから受け取った結果を返す直前に、その結果にワーカーでかかった時間を渡しておく
+# timed()はその結果の時間(last_item_seconds)として、待った時間のかわりにこれを使う
+def set_worker_item_seconds(seconds):
+    if _current is not None:
+        _current.worker_item_seconds = seconds
+
+
+# ASごとにかかった時間を測れないときに呼ぶ。以降のrecord_asn_cost()は記録せず、--statsには理由を出す
+def disable_asn_costs(reason):
+    if _current is not None:
+        _current.asn_costs_unavailable = reason
+
+
+# 直前にtimed()で取り出したASの結果について、かかった時間と経路の数を記録する
+def record_asn_cost(asn, routes):
+    if _current is None or _current.asn_costs_unavailable is not None:
+        return
+    cost = _current.asn_costs.get(asn)
+    if cost is None:
+        _current.asn_costs[asn] = [_current.last_item_seconds, routes]
+    else:
+        cost[0] += _current.last_item_seconds
+        cost[1] += routes
+
+
+# まとめた結果を人が読む形の文字列にする
+def format_summary(summary):
+    lines = ["roamon-verify stats ({})".format(summary["command"]),
+             "  {:<32} {:>12.3f} s".format("wall time", summary["wall_seconds"])]
+    for name, seconds in summary["phase_seconds"].items():
+        lines.append("  {:<32} {:>12.3f} s".format("phase " + name, seconds))
+    for name, value in sorted(summary["counters"].items()):
+        lines.append("  {:<32} {:>12,}".format(name, value))
+    if summary["validations_per_second"] is not None:
+        lines.append("  {:<32} {:>12,.0f} /s".format("validations", summary["validations_per_second"]))
+    for name, cache in summary["caches"].items():
+        hit_rate = "-" if cache["hit_rate"] is None else "{:.1%}".format(cache["hit_rate"])
+        lines.append("  {:<32} {:>12} ({} hits, {} misses)".format("cache " + name + " hit rate", hit_rate,
+                                                                    cache["hits"], cache["misses"]))
+    if summary["top_asns_unavailable"] is not None:
+        lines.append("  most expensive ASNs: not available ({})".format(summary["top_asns_unavailable"]))
+    elif summary["top_asns"]:
+        lines.append("  most expensive ASNs:")
+        for top_asn in summary["top_asns"]:
+            lines.append("    AS{:<12} {:>10.3f} s {:>10,} routes".format(top_asn["asn"], top_asn["seconds"],
+                                                                          top_asn["routes"]))
+    return "\n".join(lines) + "\n"
+
+
+def _prometheus_labels(labels):
+    return ",".join('{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                    for key, value in labels)
+
+
+# まとめた結果をPrometheusのテキスト形式にする (node_exporterのtextfile collector用)
+def format_prometheus(summary):
+    command = [("command", summary["command"])]
+    metrics = [
+        ("roamon_verify_run_seconds", "Wall time of the last run.", [(command, summary["wall_seconds"])]),
+        ("roamon_verify_phase_seconds", "Wall time spent in each phase of the last run.",
+         [(command + [("phase", name)], seconds) for name, seconds in summary["phase_seconds"].items()]),
+        ("roamon_verify_events", "Number of events counted in the last run.",
+         [(command + [("name", name)], value) for name, value in sorted(summary["counters"].items())]),
+        ("roamon_verify_validations_per_second", "Routes validated per second of the validate phases.",
+         [(command, summary["validations_per_second"])] if summary["validations_per_second"] is not None else []),
+        ("roamon_verify_cache_hits", "Cache hits in the last run.",
+         [(command + [("cache", name)], cache["hits"]) for name, cache in summary["caches"].items()]),
+        ("roamon_verify_cache_misses", "Cache misses in the last run.",
+         [(command + [("cache", name)], cache["misses"]) for name, cache in summary["caches"].items()]),
+        ("roamon_verify_asn_seconds", "Time spent on the most expensive ASNs in the last run.",
+         [(command + [("asn", top_asn["asn"])], top_asn["seconds"]) for top_asn in summary["top_asns"]]),
+        ("roamon_verify_last_run_timestamp_seconds", "Unix time when the last run finished.",
+         [(command, time.time())]),
+    ]
+    lines = []
+    for name, help_text, samples in metrics:
+        if not samples:
+            continue
+        lines.append("# HELP {} {}".format(name, help_text))
+        lines.append("# TYPE {} gauge".format(name))
+        for labels, value in samples:
+            lines.append("{}{{{}}} {}".format(name, _prometheus_labels(labels), repr(float(value))))
+    return "\n".join(lines) + "\n"
+
+
+# textfile collectorが書きかけのファイルを読まないように、一時ファイルに書いてからrenameする
+def write_prometheus(summary, file_path):
+    file_path_tmp = "{}.tmp{}".format(file_path, os.getpid())
+    with open(file_path_tmp, "w") as f:
+        f.write(format_prometheus(summary))
+    os.replace(file_path_tmp, file_path)
+    logger.debug("wrote stats to {}".format(file_path))
+
+
+# 統計を書き出す。output_formatは"text"か"json"で、streamに書く。file_path_prometheusがあればそこにも書く
+def report(run_stats, stream, output_format="text", top_n=DEFAULT_TOP_N, file_path_prometheus=None):
+    summary = run_stats.summary(top_n)
+    if output_format == "json":
+        stream.write(json.dumps(summary) + "\n")
+    elif output_format == "text":
+        stream.write(format_summary(summary))
+    if file_path_prometheus is not None:
+        write_prometheus(summary, file_path_prometheus)
@@ -0,0 +1,161 @@
+# encoding: UTF-8
+
+# Copyright (c) 2019-2020 Japan Network Information Center ("JPNIC")
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute and/or sublicense of
+# the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# ASNごとのROVの結果の集計表 (rov --summaryで作り、reportサブコマンドで引く)
+# 全部のASNを検証するとき(check_all_asn_in_vrps())に、結果を書き出すのと同じループでASごとに数えておき、最後にSQLiteのファイルに書き出す
+# reportは検証しなおさずに、このファイルから「INVALIDの多い順に上位N個」や「INVALIDが1つでもあるAS」を引く
+# 並べ替えに使う列にはそれぞれインデックスを張ってあるので、全部のAS(7万くらい)があっても問い合わせはミリ秒で終わる
+#
+#   asn_summary: ASごとに1行
+#     asn            ASN
+#     routes         そのASが広告している経路の数 (valid + invalid + not_found)
+#     valid, invalid, not_found  それぞれの結果になった経路の数
+#     not_advertised そのASのROAのprefixのうち、そのAS自身は(同じprefixで)広告していないものの数
+#     coverage       広告している経路のうち、ROAでカバーされている(VALIDかINVALIDの)割合。広告していなければNULL
+#   summary_info: 形式のバージョン、作った日時、VRPsとRIBのファイルなど (key, value)
+
+import logging
+import os
+import sqlite3
+import time
+from roamon_verify_checker import RovResult
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_FORMAT_VERSION = 1
+
+# 集計表の列 (この順でasn_summaryに入れる)
+SUMMARY_COLUMNS = ["asn", "routes", "valid", "invalid", "not_found", "not_advertised", "coverage"]
+# reportで並べ替えに使える列。それぞれに(列の降順, ASN)のインデックスを張る
+SORT_COLUMNS = ["routes", "valid", "invalid", "not_found", "not_advertised", "coverage"]
+
+
+# ASごとの集計を貯めていくクラス。vrpsはROAのprefixを引くのに使う
+class AsnRovSummary:
+    def __init__(self, vrps):
+        self._vrps = vrps
+        self._rows = []
+
+    def __len__(self):
+        return len(self._rows)
+
+    # ASNを指定してのROVの結果(AsnRovResultStruct)を1つ数える
+    def add(self, asn_rov_result_struct):
+        asn = int(asn_rov_result_struct.specified_asn)
+        rov_results_dict = asn_rov_result_struct.rov_results_dict
+        valid = invalid = 0
+        for prefix_rov_result_struct in rov_results_dict.values():
+            rov_result = prefix_rov_result_struct.rov_result
+            if rov_result is RovResult.VALID:
+                valid += 1
+            elif rov_result is RovResult.INVALID:
+                invalid += 1
+        routes = len(rov_results_dict)
+        roa_prefixes = self._vrps.get_as_prefixes(asn)
+        not_advertised = 0 if roa_prefixes is None else len(roa_prefixes.difference(rov_results_dict))
+        coverage = (valid + invalid) / routes if routes > 0 else None
+        self._rows.append((asn, routes, valid, invalid, routes - valid - invalid, not_advertised, coverage))
+
+    # 貯めた集計を1行ずつdictで返す (列はSUMMARY_COLUMNS)
+    def records(self):
+        for row in self._rows:
+            yield dict(zip(SUMMARY_COLUMNS, row))
+
+    # SQLiteのファイルに書き出す。infoに渡したdictはsummary_infoに入れる
+    # 書いている途中でreportが読んでも壊れたファイルが見えないように、一時ファイルに書いてからrenameする
+    def write(self, file_path_summary, info=None):
+        file_path_tmp = "{}.tmp{}".format(file_path_summary, os.getpid())
+        if os.path.exists(file_path_tmp):
+            os.remove(file_path_tmp)
+        connection = sqlite3.connect(file_path_tmp)
+        try:
+            with connection:
+                connection.execute("CREATE TABLE asn_summary (asn INTEGER PRIMARY KEY, routes INTEGER NOT NULL, "
+                                   "valid INTEGER NOT NULL, invalid INTEGER NOT NULL, not_found INTEGER NOT NULL, "
+                                   "not_advertised INTEGER NOT NULL, coverage REAL)")
+                connection.executemany("INSERT OR REPLACE INTO asn_summary VALUES (?, ?, ?, ?, ?, ?, ?)", self._rows)
+                for column in SORT_COLUMNS:
+                    connection.execute("CREATE INDEX asn_summary_{0} ON asn_summary ({0} DESC, asn)".format(column))
+
+                summary_info = {"version": SUMMARY_FORMAT_VERSION,
+                                "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                                "asns": len(self._rows)}
+                summary_info.update(info or {})
+                connection.execute("CREATE TABLE summary_info (key TEXT PRIMARY KEY, value TEXT)")
+                connection.executemany("INSERT INTO summary_info VALUES (?, ?)",
+                                       [(key, str(value)) for key, value in summary_info.items()])
+        finally:
+            connection.close()
+        os.replace(file_path_tmp, file_path_summary)
+        logger.info("wrote summary of {} ASNs to {}".format(len(self._rows), file_path_summary))
+
+
+# 書き出した集計表を読むクラス
+class SummaryDB:
+    def __init__(self, file_path_summary):
+        # sqlite3.connect()は無いファイルを作ってしまうので、先に確かめる
+        if not os.path.exists(file_path_summary):
+            raise FileNotFoundError("summary file {} does not exist. create it with `rov --summary`".format(
+                file_path_summary))
+        self._connection = sqlite3.connect(file_path_summary)
+        self._connection.row_factory = sqlite3.Row
+        version = self.info().get("version")
+        if version != str(SUMMARY_FORMAT_VERSION):
+            self.close()
+            raise ValueError("summary file {} has format version {} (expected {}). create it again with "
+                             "`rov --summary`".format(file_path_summary, version, SUMMARY_FORMAT_VERSION))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    # summary_infoの中身をdictで返す
+    def info(self):
+        return {row["key"]: row["value"] for row in self._connection.execute("SELECT key, value FROM summary_info")}
+
+    # ASごとの集計をsort_columnの大きい順(同じならASNの順)にdictで返す。limitを指定すると上位limit個だけ
+    # any_invalidならINVALIDの経路があるASだけ、asnsを指定するとそのASたちだけ返す
+    def query(self, sort_column="invalid", limit=None, any_invalid=False, asns=None):
+        if sort_column not in SORT_COLUMNS:
+            raise ValueError("unknown column to sort by: {}".format(sort_column))
+        conditions = []
+        params = []
+        if any_invalid:
+            conditions.append("invalid > 0")
+        if asns is not None:
+            # ASNは"64511"でも"AS64511"でもよい (parse_target_line()と同じ)
+            asns = [int(asn[2:]) if str(asn)[:2].upper() == "AS" else int(asn) for asn in asns]
+            conditions.append("asn IN ({})".format(", ".join("?" * len(asns))))
+            params.extend(asns)
+        sql = "SELECT {} FROM asn_summary".format(", ".join(SUMMARY_COLUMNS))
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY {} DESC, asn".format(sort_column)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [dict(row) for row in self._connection.execute(sql, params)]
@@ -0,0 +1,440 @@
+# encoding: UTF-8
+
+# Copyright (c) 2019-2020 Japan Network Information Center ("JPNIC")
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute and/or sublicense of
+# the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# BGPのUPDATEを受け取りながら、メモリ上のRIBをその場で更新し、ROVの結果の変化を返す
+# RIBのファイル(routeviewsから取得したもの)は数時間前のものなので、その後の経路の広告と取り消しを当てていく。入力は次のどれか
+#   * MRTのUPDATESのファイル (routeviewsのupdates.*.bz2など。BGP4MP)
+#   * ExaBGPのJSONのAPIの出力 (1行に1メッセージ。標準入力かファイル)
+#   * BMP (RFC 7854)。ルータからの接続を待ち受けるか、記録したBMPのメッセージの列のファイルを読む
+#
+# どの入力も、ピアごとの経路の変化 (ピア, prefix, Origin AS) のリストにしてから当てる
+#   * Origin ASがNoneなら、そのピアからのそのprefixの経路の取り消し (Origin ASの決まらない経路の広告も取り消しとして扱う)
+#   * prefixもNoneなら、そのピアの経路を全部取り消す (セッションが切れた)
+# prefixは (IPバージョン, ネットワークアドレスの整数, プレフィックス長)。ピアは入力ごとにピアを見分けられる値
+# 同じピアから同じprefixが広告し直されたら、そのピアの前のOrigin ASの経路は取り消されたことになる (暗黙の取り消し)
+# ADD-PATHのパスIDは区別しないので、同じピアから同じprefixの経路が複数来たら最後のものだけ残る
+#
+# 変化はbatch_size個たまるか、最初の変化からbatch_interval秒たつごとにまとめて当てる
+# 同じprefixが何度も変わっても(フラップ)、まとめた中での最初と最後の経路だけ比べるので、検証はprefixごとに1回で済む
+# VRPsは変わらないので、結果が変わるのは経路が増えたか(None -> 結果)、なくなったか(結果 -> None)のどちらか
+
+import json
+import logging
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from roamon_verify_checker import validate_route
+from roamon_verify_incremental import RovResultChange
+from roamon_verify_index import parse_prefix, format_prefix
+import roamon_verify_mrt
+import roamon_verify_stats
+
+logger = logging.getLogger(__name__)
+
+# まとめて当てる変化の数と時間のデフォルト
+DEFAULT_BATCH_SIZE = 10000
+DEFAULT_BATCH_INTERVAL = 1.0
+
+# ExaBGPのアドレスファミリのうち読むもの
+_EXABGP_FAMILIES = ("ipv4 unicast", "ipv6 unicast")
+
+# BMPのメッセージ: 共通ヘッダ(バージョン(1), 長さ(4), タイプ(1))
+_BMP_COMMON_HEADER = struct.Struct(">BIB")
+_BMP_VERSION = 3
+_BMP_ROUTE_MONITORING = 0
+_BMP_PEER_DOWN = 2
+_BMP_TERMINATION = 5
+# ピアごとのヘッダ: タイプ(1), フラグ(1), Peer Distinguisher(8), アドレス(16), AS(4), BGP ID(4), タイムスタンプ(8)
+_BMP_PER_PEER_HEADER_SIZE = 42
+_BMP_PEER_FLAG_IPV6 = 0x80
+_BMP_PEER_FLAG_LEGACY_AS_PATH = 0x20
+_BMP_PEER_FLAG_ADJ_RIB_OUT = 0x10
+
+
+# 変更できるRIBの表。RibTableと同じく、経路(prefixとOrigin ASの組)ごとにそれを見ているピアの数を持つ
+# RIBのファイルから読んだ経路(from_rib())はどのピアのものかわからないので、どのピアのUPDATEでも取り消されない
+# ピアごとに取り消せるようにしたいときは、MRTのRIBダンプからfrom_peer_routes()で作るか、空から始める
+class LiveRib:
+    def __init__(self):
+        # {prefix: {Origin AS: ピアの数}}
+        self._routes = {}
+        # {ピア: {prefix: Origin AS}}
+        self._peer_routes = {}
+        # {IPバージョン: {プレフィックス長: その長さのprefixの数}} (ロンゲストマッチで見る長さを絞るため)
+        self._prefixlen_counts = {4: {}, 6: {}}
+        self._count = 0
+        # 中身が変わるたびに増える番号 (roamon_verify_cacheが、古い検索結果を捨てるのに使う)
+        self.generation = 0
+
+    # RibTableの経路から作る
+    @classmethod
+    def from_rib(cls, rib):
+        live_rib = cls()
+        for version in (4, 6):
+            for network_int, prefixlen, origin_asn, peer_count in rib.entries(version):
+                live_rib._add((version, network_int, prefixlen), origin_asn, peer_count)
+        logger.debug("finish build live rib with {} routes".format(len(live_rib)))
+        return live_rib
+
+    # (prefix文字列, ピア, Origin AS) の列 (roamon_verify_mrt.read_mrt_peer_routes()など) から作る
+    @classmethod
+    def from_peer_routes(cls, peer_routes):
+        live_rib = cls()
+        for prefix, peer, origin_asn in peer_routes:
+            live_rib.update(peer, parse_prefix(prefix), origin_asn)
+        logger.debug("finish build live rib with {} routes from {} peers".format(len(live_rib),
+                                                                                len(live_rib._peer_routes)))
+        return live_rib
+
+    def __len__(self):
+        return self._count
+
+    def _add(self, prefix, origin_asn, peer_count=1):
+        origins = self._routes.get(prefix)
+        if origins is None:
+            origins = self._routes[prefix] = {}
+            prefixlen_counts = self._prefixlen_counts[prefix[0]]
+            prefixlen_counts[prefix[2]] = prefixlen_counts.get(prefix[2], 0) + 1
+        if origin_asn in origins:
+            origins[origin_asn] += peer_count
+        else:
+            origins[origin_asn] = peer_count
+            self._count += 1
+
+    def _remove(self, prefix, origin_asn):
+        origins = self._routes[prefix]
+        if origins[origin_asn] > 1:
+            origins[origin_asn] -= 1
+            return
+        del origins[origin_asn]
+        self._count -= 1
+        if not origins:
+            del self._routes[prefix]
+            prefixlen_counts = self._prefixlen_counts[prefix[0]]
+            prefixlen_counts[prefix[2]] -= 1
+            if prefixlen_counts[prefix[2]] == 0:
+                del prefixlen_counts[prefix[2]]
+
+    # ピアからprefixの経路を受け取った。origin_asnがNoneならそのピアからの経路の取り消し
+    def update(self, peer, prefix, origin_asn):
+        routes_of_peer = self._peer_routes.get(peer)
+        if routes_of_peer is None:
+            if origin_asn is None:
+                return
+            routes_of_peer = self._peer_routes[peer] = {}
+        old_origin_asn = routes_of_peer.get(prefix)
+        if old_origin_asn == origin_asn:
+            return
+        if old_origin_asn is not None:
+            self._remove(prefix, old_origin_asn)
+        if origin_asn is None:
+            del routes_of_peer[prefix]
+        else:
+            routes_of_peer[prefix] = origin_asn
+            self._add(prefix, origin_asn)
+        self.generation += 1
+
+    # ピアの経路を全部取り消す
+    def remove_peer(self, peer):
+        routes_of_peer = self._peer_routes.pop(peer, None)
+        if not routes_of_peer:
+            return
+        for prefix, origin_asn in routes_of_peer.items():
+            self._remove(prefix, origin_asn)
+        self.generation += 1
+
+    # ピアから受け取っている経路のprefixを全部返す
+    def peer_prefixes(self, peer):
+        return list(self._peer_routes.get(peer, ()))
+
+    # prefixの経路のOrigin ASの集合 (経路がなければ空)
+    def origin_asns(self, prefix):
+        origins = self._routes.get(prefix)
+        return frozenset(origins) if origins else frozenset()
+
+    # 経路を受け取っているピアの数
+    def peer_count(self):
+        return len(self._peer_routes)
+
+    # 指定されたprefixにロンゲストマッチするprefixを探す (RibTable.search_best_routes()と同じ)
+    # (ネットワークアドレスの整数, プレフィックス長, [(Origin AS, ピア数), ...]) を返す(Origin ASの昇順)。見つからなければNone
+    def search_best_routes(self, version, network_int, prefixlen):
+        max_prefixlen = 32 if version == 4 else 128
+        for route_prefixlen in sorted(self._prefixlen_counts[version], reverse=True):
+            if route_prefixlen > prefixlen:
+                continue
+            shift = max_prefixlen - route_prefixlen
+            route_network_int = network_int >> shift << shift
+            origins = self._routes.get((version, route_network_int, route_prefixlen))
+            if origins:
+                return route_network_int, route_prefixlen, sorted(origins.items())
+        return None
+
+    def prefixes(self):
+        return set(format_prefix(*prefix) for prefix in self._routes)
+
+    # 全ての経路を (prefix文字列, Origin AS, ピア数) で返す (roamon_verify_mrt.write_rib_file()で書き出せる)
+    def routes(self):
+        for prefix, origins in self._routes.items():
+            prefix_text = format_prefix(*prefix)
+            for origin_asn, peer_count in origins.items():
+                yield prefix_text, origin_asn, peer_count
+
+
+# まとめた変化をRIBに当て、経路が増えたりなくなったりしたところだけ検証する。[RovResultChange, ...] をprefixの順に返す
+def apply_updates(vrps, live_rib, events):
+    # 変化のあったprefixの、当てる前のOrigin ASの集合
+    origins_before = {}
+    for peer, prefix, origin_asn in events:
+        if prefix is None:
+            for peer_prefix in live_rib.peer_prefixes(peer):
+                if peer_prefix not in origins_before:
+                    origins_before[peer_prefix] = live_rib.origin_asns(peer_prefix)
+            live_rib.remove_peer(peer)
+            continue
+        if prefix not in origins_before:
+            origins_before[prefix] = live_rib.origin_asns(prefix)
+        live_rib.update(peer, prefix, origin_asn)
+
+    changes = []
+    for prefix in sorted(origins_before):
+        old_origin_asns = origins_before[prefix]
+        new_origin_asns = live_rib.origin_asns(prefix)
+        if old_origin_asns == new_origin_asns:
+            continue
+        version, network_int, prefixlen = prefix
+        prefix_text = format_prefix(version, network_int, prefixlen)
+        for origin_asn in sorted(old_origin_asns ^ new_origin_asns):
+            rov_result = validate_route(vrps, version, network_int, prefixlen, origin_asn)
+            if origin_asn in new_origin_asns:
+                changes.append(RovResultChange(prefix_text, origin_asn, None, rov_result))
+            else:
+                changes.append(RovResultChange(prefix_text, origin_asn, rov_result, None))
+    roamon_verify_stats.count("bgp_updates", len(events))
+    roamon_verify_stats.count("changed_routes", len(changes))
+    logger.debug("applied {} updates to {} prefixes, {} routes changed".format(len(events), len(origins_before),
+                                                                             len(changes)))
+    return changes
+
+
+# 変化のリストの列を、batch_size個以上たまるか、最初の変化からbatch_interval秒たつごとにまとめて返すジェネレータ
+# 入力が止まっていても時間で区切れるように、event_listsは変化がないときに空のリストを返してもよい (_poll_queue())
+def iter_batches(event_lists, batch_size=DEFAULT_BATCH_SIZE, batch_interval=DEFAULT_BATCH_INTERVAL):
+    batch = []
+    started_at = 0
+    for events in event_lists:
+        if events:
+            if not batch:
+                started_at = time.monotonic()
+            batch.extend(events)
+        if batch and (len(batch) >= batch_size or time.monotonic() - started_at >= batch_interval):
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# ピアのUPDATE1つ分 (広告されたprefixのリスト, 取り消されたprefixのリスト, Origin AS) を変化のリストにする
+def _update_events(peer, announced, withdrawn, origin_asn):
+    events = [(peer, prefix, None) for prefix in withdrawn]
+    events.extend((peer, prefix, origin_asn) for prefix in announced)
+    return events
+
+
+# MRTのUPDATESのファイルを順に読んで、UPDATEごとに変化のリストを返すジェネレータ。ピアはピアのIPアドレスの文字列
+def iter_mrt_update_events(file_paths_mrt):
+    for file_path_mrt in file_paths_mrt:
+        with roamon_verify_mrt.open_mrt_file(file_path_mrt) as stream:
+            for peer, announced, withdrawn, origin_asn in roamon_verify_mrt.iter_bgp4mp_updates(stream):
+                if announced is None:
+                    yield [(peer, None, None)]
+                else:
+                    yield _update_events(peer, announced, withdrawn, origin_asn)
+        logger.debug("finish read updates from {}".format(file_path_mrt))
+
+
+# ExaBGPのJSONのAS_PATHからOrigin ASを取り出す。決まらない(AS_SETで終わる、空)ときはNone
+# 4.xはASNのリスト(AS_SETは入れ子のリスト)、5.xは {"番号": {"element": "as-sequence", "value": [...]}, ...}
+def _exabgp_origin(as_path):
+    if isinstance(as_path, dict):
+        segments = [as_path[key] for key in sorted(as_path, key=int)]
+        if not segments or segments[-1].get("element") != "as-sequence" or not segments[-1].get("value"):
+            return None
+        return int(segments[-1]["value"][-1])
+    if not as_path or isinstance(as_path[-1], list):
+        return None
+    return int(as_path[-1])
+
+
+# ExaBGPのNLRI ("192.0.2.0/24" か {"nlri": "192.0.2.0/24", ...}) をprefixにする。デフォルトルートはNone
+def _exabgp_prefix(nlri):
+    if isinstance(nlri, dict):
+        nlri = nlri["nlri"]
+    prefix = parse_prefix(nlri)
+    return prefix if prefix[2] > 0 else None
+
+
+# ExaBGPのJSONのAPIの出力を1行ずつ読んで、メッセージごとに変化のリストを返すジェネレータ
+# "update"のannounceとwithdraw(ユニキャストだけ)と、"state"のdown(セッションが切れた)を読む。ピアはneighborのピアのアドレス
+def iter_exabgp_events(stream):
+    for line in stream:
+        line = line.strip()
+        if not line.startswith("{"):
+            continue
+        try:
+            message = json.loads(line)
+        except ValueError:
+            logger.warning("ignore broken ExaBGP message: {}".format(line[:100]))
+            continue
+        neighbor = message.get("neighbor", {})
+        peer = neighbor.get("address", {}).get("peer")
+        if message.get("type") == "state":
+            if neighbor.get("state") == "down":
+                yield [(peer, None, None)]
+            continue
+        if message.get("type") != "update":
+            continue
+
+        update = neighbor.get("message", {}).get("update", {})
+        events = []
+        for family, nlris in update.get("withdraw", {}).items():
+            if family in _EXABGP_FAMILIES:
+                events.extend((peer, prefix, None) for prefix in map(_exabgp_prefix, nlris) if prefix is not None)
+        origin_asn = _exabgp_origin(update.get("attribute", {}).get("as-path"))
+        for family, nlris_by_next_hop in update.get("announce", {}).items():
+            if family not in _EXABGP_FAMILIES:
+                continue
+            for nlris in nlris_by_next_hop.values():
+                events.extend((peer, prefix, origin_asn) for prefix in map(_exabgp_prefix, nlris)
+                              if prefix is not None)
+        if events:
+            yield events
+
+
+# BMPのメッセージの列(ソケットかファイル)を読んで、Route MonitoringとPeer Downごとに変化のリストを返すジェネレータ
+# ピアは (routerの値, Peer Distinguisher, ピアのアドレス)。pre-policyとpost-policyは区別しない。Adj-RIB-Outは読まない
+# Terminationか接続が切れたら、そのルータから受け取ったピアの経路を全部取り消して終わる
+def iter_bmp_events(stream, router=None):
+    peers = set()
+    while True:
+        header = stream.read(_BMP_COMMON_HEADER.size)
+        if len(header) < _BMP_COMMON_HEADER.size:
+            break
+        version, length, message_type = _BMP_COMMON_HEADER.unpack(header)
+        if version != _BMP_VERSION:
+            raise ValueError("unsupported BMP version {}".format(version))
+        body = stream.read(length - _BMP_COMMON_HEADER.size)
+        if len(body) < length - _BMP_COMMON_HEADER.size:
+            logger.warning("BMP message from {} is truncated".format(router))
+            break
+        if message_type == _BMP_TERMINATION:
+            break
+        if message_type != _BMP_ROUTE_MONITORING and message_type != _BMP_PEER_DOWN:
+            continue
+
+        flags = body[1]
+        if flags & _BMP_PEER_FLAG_IPV6:
+            address = socket.inet_ntop(socket.AF_INET6, body[10:26])
+        else:
+            address = socket.inet_ntop(socket.AF_INET, body[22:26])
+        peer = (router, bytes(body[2:10]), address)
+        if message_type == _BMP_PEER_DOWN:
+            peers.discard(peer)
+            yield [(peer, None, None)]
+            continue
+        if flags & _BMP_PEER_FLAG_ADJ_RIB_OUT:
+            continue
+
+        pos = _BMP_PER_PEER_HEADER_SIZE
+        if body[pos + 18] != roamon_verify_mrt.BGP_MESSAGE_UPDATE:
+            continue
+        bgp_length = struct.unpack_from(">H", body, pos + 16)[0]
+        asn_size = 2 if flags & _BMP_PEER_FLAG_LEGACY_AS_PATH else 4
+        announced, withdrawn, origin_asn = roamon_verify_mrt.parse_bgp_update(
+            body, pos + roamon_verify_mrt.BGP_HEADER_SIZE, pos + bgp_length, asn_size)
+        peers.add(peer)
+        yield _update_events(peer, announced, withdrawn, origin_asn)
+
+    if peers:
+        logger.info("BMP session from {} is closed. withdraw routes from {} peers".format(router, len(peers)))
+        yield [(peer, None, None) for peer in peers]
+
+
+# キューに入れられた変化のリストを返し続けるジェネレータ。poll_interval秒なにも来なければ空のリストを返す
+# キューに例外が入っていたら投げ、Noneが入っていたら終わる
+def _poll_queue(event_queue, poll_interval):
+    while True:
+        try:
+            events = event_queue.get(timeout=poll_interval)
+        except queue.Empty:
+            yield []
+            continue
+        if events is None:
+            return
+        if isinstance(events, Exception):
+            raise events
+        yield events
+
+
+# 入力が止まっている間もバッチを時間で区切れるように、ブロックする入力(標準入力など)を別のスレッドで読む
+def iter_polled(event_lists, poll_interval=DEFAULT_BATCH_INTERVAL):
+    event_queue = queue.Queue(maxsize=DEFAULT_BATCH_SIZE)
+
+    def read():
+        try:
+            for events in event_lists:
+                event_queue.put(events)
+        except Exception as e:
+            event_queue.put(e)
+            return
+        event_queue.put(None)
+
+    threading.Thread(target=read, daemon=True).start()
+    return _poll_queue(event_queue, poll_interval)
+
+
+class _BmpHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        router = self.client_address[0]
+        logger.info("BMP session from {} is opened".format(router))
+        try:
+            for events in iter_bmp_events(self.rfile, router):
+                self.server.event_queue.put(events)
+        except (ConnectionError, ValueError) as e:
+            logger.warning("BMP session from {} is broken: {}".format(router, e))
+
+
+class _BmpServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+# BMPの接続を待ち受けて、どのルータから受け取った変化も1つの列にして返す (止まらない)
+def iter_bmp_listener(host, port, poll_interval=DEFAULT_BATCH_INTERVAL):
+    server = _BmpServer((host, port), _BmpHandler)
+    server.event_queue = queue.Queue(maxsize=DEFAULT_BATCH_SIZE)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info("listening BMP on {}:{}".format(host, port))
+    return _poll_queue(server.event_queue, poll_interval)
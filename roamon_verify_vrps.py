@@ -0,0 +1,174 @@
+# encoding: UTF-8
+
+# Copyright (c) 2019-2020 Japan Network Information Center ("JPNIC")
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute and/or sublicense of
+# the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# VRPsの読み込み
+# routinatorの出力(csv, csvcompat, csvext, json, jsonext)と、このツールが保存する「prefix<TAB>ASN<TAB>maxLength」の形式を、
+# ファイルからでもroutinatorのプロセスの標準出力からでも、1回読むだけで (prefix文字列, ASN, maxLength) の列にする
+
+import json
+import logging
+import os
+import re
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+# JSONをまとめて読み込む単位
+JSON_READ_SIZE = 64 * 1024
+
+# routinatorのCSVのヘッダに出てくる列名
+_CSV_COLUMN_ASN = "ASN"
+_CSV_COLUMN_PREFIX = "IP Prefix"
+_CSV_COLUMN_MAX_LENGTH = "Max Length"
+
+# routinatorのJSONでVRPの配列が始まるところ
+_JSON_ROAS_START = re.compile(r'"roas"\s*:\s*\[')
+
+
+# "AS64511"や"64511"をASNの整数にする
+def _parse_asn(asn):
+    asn = asn.strip().strip('"')
+    if asn[:2].upper() == "AS":
+        asn = asn[2:]
+    return int(asn)
+
+
+# このツールの形式(「prefix<TAB>ASN<TAB>maxLength」)の行を読む
+# maxLengthの無い行(以前のpyasn用の形式)はprefix長をmaxLengthとみなす
+def iter_tsv_vrps(lines):
+    for line in lines:
+        if line.startswith(";") or line.startswith("#"):
+            continue
+        columns = line.split()
+        if len(columns) < 2:
+            continue
+        prefix = columns[0]
+        max_length = int(columns[2]) if len(columns) >= 3 else int(prefix.partition("/")[2])
+        yield prefix, int(columns[1]), max_length
+
+
+# routinatorのCSV(csv, csvcompat, csvext)の行を読む。列の位置は先頭のヘッダ行から決める
+def iter_routinator_csv_vrps(lines):
+    lines = iter(lines)
+    header = [column.strip().strip('"') for column in next(lines, "").split(",")]
+    try:
+        idx_asn = header.index(_CSV_COLUMN_ASN)
+        idx_prefix = header.index(_CSV_COLUMN_PREFIX)
+        idx_max_length = header.index(_CSV_COLUMN_MAX_LENGTH)
+    except ValueError:
+        raise ValueError("unknown routinator csv header: {}".format(header))
+
+    for line in lines:
+        columns = line.rstrip("\r\n").split(",")
+        if len(columns) < len(header):
+            continue
+        yield (columns[idx_prefix].strip('"'), _parse_asn(columns[idx_asn]),
+               int(columns[idx_max_length].strip('"')))
+
+
+# routinatorのJSON(json, jsonext)を読む。{"roas": [{"asn": "AS64511", "prefix": ..., "maxLength": ...}, ...]}
+# 全体をjson.load()すると数十万件のdictが一度にメモリに乗るので、"roas"の配列の要素を1つずつデコードする
+def iter_routinator_json_vrps(stream):
+    decoder = json.JSONDecoder()
+    buffer = ""
+    # "roas": [ まで読み飛ばす (jsonextだと前にmetadataがある)
+    while True:
+        matched = _JSON_ROAS_START.search(buffer)
+        if matched is not None:
+            buffer = buffer[matched.end():]
+            break
+        chunk = stream.read(JSON_READ_SIZE)
+        if not chunk:
+            raise ValueError("\"roas\" is not found in routinator json")
+        buffer += chunk
+
+    pos = 0
+    while True:
+        # 要素の間の空白とカンマを読み飛ばす
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == "]":
+            return
+        try:
+            roa, end = decoder.raw_decode(buffer, pos)
+        except ValueError:
+            # 要素が途中で切れているので続きを読む
+            chunk = stream.read(JSON_READ_SIZE)
+            if not chunk:
+                raise ValueError("routinator json is truncated")
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        pos = end
+        yield roa["prefix"], _parse_asn(str(roa["asn"])), int(roa["maxLength"])
+
+
+# ストリームの形式を指定して読む。output_formatはroutinatorの--formatと同じ名前 (このツールの形式は"tsv")
+def iter_vrps(stream, output_format):
+    if output_format in ("csv", "csvcompat", "csvext"):
+        return iter_routinator_csv_vrps(stream)
+    if output_format in ("json", "jsonext"):
+        return iter_routinator_json_vrps(stream)
+    if output_format == "tsv":
+        return iter_tsv_vrps(stream)
+    raise ValueError("unsupported vrps format: {}".format(output_format))
+
+
+# ファイルの先頭を見て形式を判定する
+def detect_vrps_format(first_line):
+    first_line = first_line.lstrip()
+    if first_line.startswith("{"):
+        return "json"
+    if first_line.replace('"', "").split(",")[:1] in ([_CSV_COLUMN_ASN], ["URI"]):
+        return "csv"
+    return "tsv"
+
+
+# VRPsのファイルを読んで (prefix文字列, ASN, maxLength) を1つずつ返すジェネレータ。形式は中身から判定する
+def read_vrps_file(file_path_vrps):
+    with open(file_path_vrps, "r") as f:
+        output_format = detect_vrps_format(f.readline())
+        f.seek(0)
+        yield from iter_vrps(f, output_format)
+
+
+# コマンド(routinator vrpsなど)を実行して、その標準出力を読んだそばからVRPにして返すジェネレータ
+def iter_command_vrps(command, output_format="csv"):
+    logger.debug("run {}".format(" ".join(command)))
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                          universal_newlines=True) as process:
+        yield from iter_vrps(process.stdout, output_format)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+
+# VRPをこのツールの形式でファイルに書き出す。途中で失敗しても前のファイルが壊れないように、一時ファイルに書いてからrenameする
+def write_vrps_file(vrps, file_path_vrps):
+    file_path_tmp = "{}.tmp{}".format(file_path_vrps, os.getpid())
+    count = 0
+    with open(file_path_tmp, "w") as f:
+        for prefix, asn, max_length in vrps:
+            f.write("{}\t{}\t{}\n".format(prefix, asn, max_length))
+            count += 1
+    os.replace(file_path_tmp, file_path_vrps)
+    logger.debug("wrote {} VRPs to {}".format(count, file_path_vrps))
+    return count
@@ -0,0 +1,43 @@
+# encoding: UTF-8
+
+# Copyright (c) 2019-2020 Japan Network Information Center ("JPNIC")
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute and/or sublicense of
+# the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# pip install . で roamon-verify コマンドを入れるためのもの
+# モジュールはパッケージにせず、今まで通りトップレベルのroamon_verify_*.pyのまま入れる
+
+import glob
+import os
+from setuptools import setup
+
+setup(
+    name="roamon-verify",
+    version="0.1.0",
+    description="Command line tool to show ROV results from BGP routes",
+    url="https://github.com/taiji-k/roamon-verify",
+    license="MIT",
+    py_modules=sorted(os.path.splitext(os.path.basename(file_path))[0]
+                      for file_path in glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                              "roamon_verify_*.py"))),
+    python_requires=">=3.7",
+    install_requires=["tqdm", "pyfiglet", "requests"],
+    extras_require={"fast": ["numpy"]},
+    entry_points={"console_scripts": ["roamon-verify = roamon_verify_controller:main"]},
+)
@@ -0,0 +1,8 @@
+# encoding: UTF-8
+
+# テストからリポジトリ直下のroamon_verify_*.pyをimportできるようにする (tools/のスクリプトと同じやり方)
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
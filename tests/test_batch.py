@@ -0,0 +1,68 @@
+# encoding: UTF-8
+
+# roamon_verify_batch.validate_rib()を、経路を1つずつvalidate_route()したものと比べるテスト
+# IPv6の/64より長いVRPは上位64bitの配列では引けず1つずつ検証するので、その長さのVRPと経路も混ぜる
+
+import random
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import roamon_verify_batch
+from roamon_verify_checker import validate_route
+from roamon_verify_index import VrpTrie, format_prefix
+from roamon_verify_snapshot import RibTable, SnapshotVrpDB
+
+ASNS = [0, 64496, 64497, 64498, 64499, 64500]
+
+
+def random_prefix(rng, version, prefixlen, within=None):
+    width = 32 if version == 4 else 128
+    if within is None:
+        network_int = rng.getrandbits(width) if version == 4 else 0x20010db8 << 96 | rng.getrandbits(96)
+        within = (network_int >> (width - 16) << (width - 16), 16 if version == 4 else 32)
+    base_network_int, base_prefixlen = within
+    prefixlen = max(prefixlen, base_prefixlen)
+    network_int = base_network_int | rng.getrandbits(width - base_prefixlen) & ((1 << (width - base_prefixlen)) - 1)
+    return network_int >> (width - prefixlen) << (width - prefixlen), prefixlen
+
+
+def make_data(seed):
+    rng = random.Random(seed)
+    vrps = set()
+    routes = set()
+    for version, prefixlens in ((4, [8, 16, 20, 24, 28, 32]), (6, [32, 48, 56, 64, 72, 96, 112, 128])):
+        width = 32 if version == 4 else 128
+        bases = [random_prefix(rng, version, rng.choice(prefixlens)) for _ in range(30)]
+        for network_int, prefixlen in bases:
+            for _ in range(rng.randint(1, 3)):
+                max_length = rng.randint(prefixlen, min(width, prefixlen + 16))
+                vrps.add((format_prefix(version, network_int, prefixlen), rng.choice(ASNS), max_length))
+        for _ in range(300):
+            if rng.random() < 0.8:
+                # VRPに含まれる経路 (同じprefix、長いprefix)。VRPより短いprefixも少し混ぜる
+                network_int, prefixlen = rng.choice(bases)
+                route_prefixlen = min(width, prefixlen + rng.choice([0, 0, 1, 4, 8, 16, 24]))
+                if rng.random() < 0.1:
+                    route_prefixlen = max(8, prefixlen - rng.randint(1, 8))
+                route = random_prefix(rng, version, route_prefixlen, (network_int, min(prefixlen, route_prefixlen)))
+            else:
+                route = random_prefix(rng, version, rng.choice(prefixlens))
+            routes.add((format_prefix(version, *route), rng.choice(ASNS[1:] + [65000, 65001]), 1))
+    return sorted(vrps), sorted(routes)
+
+
+@pytest.mark.parametrize("vrp_class", [VrpTrie, SnapshotVrpDB])
+@pytest.mark.parametrize("seed", range(5))
+def test_validate_rib_matches_validate_route(vrp_class, seed):
+    vrp_tuples, routes = make_data(seed)
+    vrps = VrpTrie.from_vrps(vrp_tuples) if vrp_class is VrpTrie else SnapshotVrpDB(entries=vrp_tuples)
+    rib = RibTable.from_routes(routes)
+
+    expected = [validate_route(vrps, version, network_int, prefixlen, origin_asn).id
+                for version in (4, 6) for network_int, prefixlen, origin_asn, _ in rib.entries(version)]
+    assert roamon_verify_batch.validate_rib(vrps, rib).tolist() == expected
+    # /64より長いVRPも、その中の経路も入っている
+    assert any(int(prefix.split("/")[1]) > 64 for prefix, _, _ in vrp_tuples if ":" in prefix)
+    assert len(set(expected)) == 3
@@ -0,0 +1,150 @@
+# encoding: UTF-8
+
+# roamon_verify_checkerのテスト
+
+import pytest
+
+import roamon_verify_checker
+import roamon_verify_output
+from roamon_verify_checker import RovResult
+from roamon_verify_index import VrpTrie, parse_prefix
+from roamon_verify_snapshot import RibTable
+
+
+def make_data():
+    vrps = VrpTrie.from_vrps([("192.0.2.0/24", 64511, 24), ("2001:db8::/32", 64496, 48)])
+    rib = RibTable.from_routes([("192.0.2.0/24", 64511, 1), ("198.51.100.0/24", 64510, 1),
+                                ("2001:db8:1::/48", 64497, 1)])
+    return vrps, rib
+
+
+def test_iter_targets_skips_bad_prefixes(caplog):
+    lines = ["192.0.2.0/24\n", "bogus\n", "# comment\n", "AS64511\n", "192.0.2.0/33\n", "2001:db8::/32\n"]
+    targets = list(roamon_verify_checker.iter_targets(lines))
+    assert targets == [("ip", "192.0.2.0/24"), ("asn", "64511"), ("ip", "2001:db8::/32")]
+    assert "line 2" in caplog.text
+    assert "line 5" in caplog.text
+
+
+def test_check_targets_streaming_continues_after_bad_line(tmp_path):
+    vrps, rib = make_data()
+    file_path_output = str(tmp_path / "out.tsv")
+    lines = ["192.0.2.0/24\n", "bogus\n", "2001:db8:1::/48\n"]
+    with roamon_verify_output.open_writer("tsv", file_path_output) as writer:
+        roamon_verify_checker.check_targets_streaming(vrps, rib, roamon_verify_checker.iter_targets(lines),
+                                                      writer=writer)
+    with open(file_path_output) as f:
+        rows = [line.split("\t") for line in f.read().splitlines()]
+    assert [(row[0], row[1]) for row in rows] == [("192.0.2.0/24", "VALID"), ("2001:db8:1::/48", "INVALID")]
+
+
+def test_check_violation_all_asn_in_vrps(tmp_path):
+    vrps, rib = make_data()
+    file_path_output = str(tmp_path / "out.tsv")
+    with roamon_verify_output.open_writer("tsv", file_path_output,
+                                          columns=roamon_verify_output.VIOLATION_COLUMNS) as writer:
+        n_violations = roamon_verify_checker.check_violation_all_asn_in_vrps(vrps, rib, writer)
+    assert n_violations == 1
+    with open(file_path_output) as f:
+        assert f.read() == "64496\t2001:db8::/32\t48\t2001:db8:1::/48\t64497\n"
+
+
+RFC6811_VRPS = [("192.0.2.0/24", 64511, 24), ("198.51.100.0/22", 64510, 24), ("203.0.113.0/24", 0, 24),
+                ("203.0.0.0/16", 64501, 24), ("2001:db8::/32", 64496, 48)]
+
+
+@pytest.mark.parametrize("prefix, origin_asn, rov_result", [
+    ("192.0.2.0/24", 64511, RovResult.VALID),
+    # maxLengthより長い
+    ("192.0.2.0/25", 64511, RovResult.INVALID),
+    # 含むVRPはあるがOrigin ASが違う
+    ("192.0.2.0/24", 64512, RovResult.INVALID),
+    # VRPより短い経路はVRPに含まれない
+    ("192.0.0.0/16", 64511, RovResult.NOT_FOUND),
+    ("198.51.100.0/22", 64510, RovResult.VALID),
+    ("198.51.101.0/24", 64510, RovResult.VALID),
+    ("198.51.101.0/25", 64510, RovResult.INVALID),
+    # AS0のVRPはどのASにも一致しない。AS0の経路も一致しない
+    ("203.0.113.0/24", 64500, RovResult.INVALID),
+    ("203.0.113.0/24", 0, RovResult.INVALID),
+    # AS0のVRPがあっても、他のVRPに一致すればVALID
+    ("203.0.113.0/24", 64501, RovResult.VALID),
+    ("2001:db8:1::/48", 64496, RovResult.VALID),
+    ("2001:db8:1:1::/64", 64496, RovResult.INVALID),
+    ("2001:db9::/32", 64496, RovResult.NOT_FOUND),
+])
+def test_validate_route_rfc6811(prefix, origin_asn, rov_result):
+    vrps = VrpTrie.from_vrps(RFC6811_VRPS)
+    assert roamon_verify_checker.validate_route(vrps, *parse_prefix(prefix), origin_asn) == rov_result
+
+
+def test_rov_returns_result_per_origin():
+    vrps = VrpTrie.from_vrps(RFC6811_VRPS)
+    rib = RibTable.from_routes([("192.0.0.0/16", 64511, 1), ("192.0.2.0/24", 64512, 2), ("192.0.2.0/24", 64511, 3)])
+
+    # MOASならOrigin ASごとに1つずつ、Origin ASの順で返す。ロンゲストマッチした経路を検証する
+    results = roamon_verify_checker.rov(vrps, rib, "192.0.2.5/32")
+    assert [(result.roved_prefix, result.matched_advertised_prefix, result.advertising_asn, result.rov_result)
+            for result in results] == [("192.0.2.5/32", "192.0.2.0/24", 64511, RovResult.VALID),
+                                       ("192.0.2.5/32", "192.0.2.0/24", 64512, RovResult.INVALID)]
+
+    results = roamon_verify_checker.rov(vrps, rib, "192.0.3.0/24")
+    assert [(result.matched_advertised_prefix, result.advertising_asn, result.rov_result) for result in results] == \
+        [("192.0.0.0/16", 64511, RovResult.NOT_FOUND)]
+
+    results = roamon_verify_checker.rov(vrps, rib, "198.51.100.0/24")
+    assert [(result.roved_prefix, result.matched_advertised_prefix, result.advertising_asn, result.rov_result)
+            for result in results] == [("198.51.100.0/24", None, None, RovResult.NOT_ADVERTISED)]
+
+
+RANGE_ROUTES = [("10.0.0.0/7", 64499, 1), ("10.0.0.0/8", 64500, 1), ("10.0.0.0/8", 64505, 1), ("10.1.0.0/16", 64502, 1),
+                ("10.1.0.0/16", 64501, 1), ("10.1.2.0/24", 64501, 1), ("10.1.2.128/25", 64503, 1),
+                ("10.2.0.0/16", 64504, 1), ("10.1.0.0/17", 64501, 1)]
+
+
+def rov_range_rows(specified_prefix, **options):
+    vrps = VrpTrie.from_vrps([("10.0.0.0/8", 64500, 16), ("10.1.0.0/16", 64501, 24)])
+    rib = RibTable.from_routes(RANGE_ROUTES)
+    return [(result.roved_prefix, result.matched_advertised_prefix, result.advertising_asn, result.rov_result)
+            for result in roamon_verify_checker.rov_range(vrps, rib, specified_prefix, **options)]
+
+
+# 結果はRIBでの並び (ネットワークアドレス、プレフィックス長、Origin ASの順)
+def test_rov_range_more_specifics():
+    assert rov_range_rows("10.1.0.0/16") == [
+        ("10.1.0.0/16", "10.1.0.0/16", 64501, RovResult.VALID),
+        ("10.1.0.0/16", "10.1.0.0/16", 64502, RovResult.INVALID),
+        ("10.1.0.0/16", "10.1.0.0/17", 64501, RovResult.VALID),
+        ("10.1.0.0/16", "10.1.2.0/24", 64501, RovResult.VALID),
+        ("10.1.0.0/16", "10.1.2.128/25", 64503, RovResult.INVALID)]
+
+
+def test_rov_range_less_specifics():
+    assert rov_range_rows("10.1.2.0/24", more_specifics=False, less_specifics=True) == [
+        ("10.1.2.0/24", "10.0.0.0/7", 64499, RovResult.NOT_FOUND),
+        ("10.1.2.0/24", "10.0.0.0/8", 64500, RovResult.VALID),
+        ("10.1.2.0/24", "10.0.0.0/8", 64505, RovResult.INVALID),
+        ("10.1.2.0/24", "10.1.0.0/16", 64501, RovResult.VALID),
+        ("10.1.2.0/24", "10.1.0.0/16", 64502, RovResult.INVALID),
+        ("10.1.2.0/24", "10.1.0.0/17", 64501, RovResult.VALID),
+        ("10.1.2.0/24", "10.1.2.0/24", 64501, RovResult.VALID)]
+
+
+# 指定されたprefixと同じ経路は1回だけ
+def test_rov_range_both_directions():
+    assert rov_range_rows("10.1.0.0/16", less_specifics=True) == [
+        ("10.1.0.0/16", "10.0.0.0/7", 64499, RovResult.NOT_FOUND),
+        ("10.1.0.0/16", "10.0.0.0/8", 64500, RovResult.VALID),
+        ("10.1.0.0/16", "10.0.0.0/8", 64505, RovResult.INVALID),
+        ("10.1.0.0/16", "10.1.0.0/16", 64501, RovResult.VALID),
+        ("10.1.0.0/16", "10.1.0.0/16", 64502, RovResult.INVALID),
+        ("10.1.0.0/16", "10.1.0.0/17", 64501, RovResult.VALID),
+        ("10.1.0.0/16", "10.1.2.0/24", 64501, RovResult.VALID),
+        ("10.1.0.0/16", "10.1.2.128/25", 64503, RovResult.INVALID)]
+
+
+def test_rov_range_not_advertised():
+    assert rov_range_rows("192.0.2.0/24", less_specifics=True) == [
+        ("192.0.2.0/24", None, None, RovResult.NOT_ADVERTISED)]
+    assert rov_range_rows("10.3.0.0/16", more_specifics=True, less_specifics=False) == [
+        ("10.3.0.0/16", None, None, RovResult.NOT_ADVERTISED)]
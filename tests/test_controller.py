@@ -0,0 +1,95 @@
+# encoding: UTF-8
+
+# roamon_verify_controllerのサブコマンドのテスト
+
+import logging
+import os
+
+import pytest
+
+import roamon_verify_controller
+import roamon_verify_summary
+
+
+def write_config(tmp_path):
+    file_path_vrps = tmp_path / "vrps.dat"
+    file_path_vrps.write_text("192.0.2.0/24\t64511\t24\n")
+    file_path_rib = tmp_path / "rib.dat"
+    file_path_rib.write_text("192.0.2.0/24\t64511\t1\n192.0.2.0/25\t64496\t1\n198.51.100.0/24\t64511\t1\n")
+    file_path_config = tmp_path / "config.ini"
+    file_path_config.write_text("[roamon-verify]\ndir_path_data = {}\nfile_path_vrps = {}\nfile_path_rib = {}\n".format(
+        tmp_path, file_path_vrps, file_path_rib))
+    return str(file_path_config)
+
+
+def test_only_invalid_warns_workers(tmp_path, caplog):
+    file_path_output = tmp_path / "out.tsv"
+    with caplog.at_level(logging.WARNING):
+        roamon_verify_controller.main(["only-invalid", "-q", "--config", write_config(tmp_path),
+                                       "--workers", "4", "--output", str(file_path_output)])
+    assert "--workers has no effect" in caplog.text
+    assert file_path_output.read_text() == "64511\t192.0.2.0/24\t24\t192.0.2.0/25\t64496\n"
+
+
+def test_summary_with_state(tmp_path):
+    file_path_config = write_config(tmp_path)
+    file_path_output = str(tmp_path / "out.tsv")
+    summaries = []
+    for name, options in [("full", []), ("state1", ["--state", str(tmp_path / "state.pkl")]),
+                          ("state2", ["--state", str(tmp_path / "state.pkl")])]:
+        file_path_summary = str(tmp_path / "{}.sqlite".format(name))
+        roamon_verify_controller.main(["rov", "-q", "--config", file_path_config, "--output", file_path_output,
+                                       "--summary", file_path_summary] + options)
+        with roamon_verify_summary.SummaryDB(file_path_summary) as summary_db:
+            summaries.append(summary_db.query())
+    assert summaries[0] == [{"asn": 64511, "routes": 2, "valid": 1, "invalid": 0, "not_found": 1,
+                             "not_advertised": 0, "coverage": 0.5}]
+    assert summaries[1] == summaries[0]
+    assert summaries[2] == summaries[0]
+
+
+def test_report_asn_needs_values(tmp_path):
+    with pytest.raises(SystemExit):
+        roamon_verify_controller.main(["report", "-q", "--config", write_config(tmp_path),
+                                       str(tmp_path / "summary.sqlite"), "--asn"])
+
+
+@pytest.mark.parametrize("options, expected", [
+    (["--ip", "192.0.2.0/24"], "192.0.2.0/24\tVALID\t192.0.2.0/24\t64511\n"),
+    (["--ip", "192.0.2.0/24", "--more-specifics"],
+     "192.0.2.0/24\tVALID\t192.0.2.0/24\t64511\n192.0.2.0/24\tINVALID\t192.0.2.0/25\t64496\n"),
+    (["--ip", "192.0.2.0/25", "--less-specifics"],
+     "192.0.2.0/25\tVALID\t192.0.2.0/24\t64511\n192.0.2.0/25\tINVALID\t192.0.2.0/25\t64496\n"),
+    (["--ip", "192.0.2.0/24", "--more-specifics", "--less-specifics"],
+     "192.0.2.0/24\tVALID\t192.0.2.0/24\t64511\n192.0.2.0/24\tINVALID\t192.0.2.0/25\t64496\n"),
+])
+def test_rov_ip_range_options(tmp_path, options, expected):
+    file_path_output = tmp_path / "out.tsv"
+    roamon_verify_controller.main(["rov", "-q", "--config", write_config(tmp_path), "--output", str(file_path_output)] +
+                                  options)
+    assert file_path_output.read_text() == expected
+
+
+# 入力のファイルは、変化を書き出すファイルと一緒に閉じる
+@pytest.mark.parametrize("source", ["exabgp", "bmp-file"])
+def test_updates_closes_input_files(tmp_path, monkeypatch, source):
+    file_path_input = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "updates_exabgp.json")
+    if source == "bmp-file":
+        file_path_input = str(tmp_path / "empty.bmp")
+        open(file_path_input, "wb").close()
+    opened_files = []
+
+    def open_and_record(*args, **kwargs):
+        f = open(*args, **kwargs)
+        opened_files.append(f)
+        return f
+
+    monkeypatch.setattr(roamon_verify_controller, "open", open_and_record, raising=False)
+    file_path_changes = tmp_path / "changes.tsv"
+    roamon_verify_controller.main(["updates", "-q", "--config", write_config(tmp_path), "--empty-rib",
+                                   "--" + source, file_path_input, "--changes", str(file_path_changes),
+                                   "--batch-interval", "0.1"])
+    assert len(opened_files) == 2
+    assert all(f.closed for f in opened_files)
+    if source == "exabgp":
+        assert "64511\t192.0.2.128/25\t-\tINVALID\n" in file_path_changes.read_text()
@@ -0,0 +1,53 @@
+# encoding: UTF-8
+
+# roamon_verify_historyのテスト
+
+import roamon_verify_checker
+import roamon_verify_output
+from roamon_verify_history import HistoryState, SUMMARY_RESULTS
+from roamon_verify_index import VrpTrie
+from roamon_verify_snapshot import RibTable
+
+# (経路の集合, VRPの集合) の列。Noneは前のスナップショットと同じ
+SNAPSHOTS = [
+    ({("192.0.2.0/24", 64511), ("192.0.2.128/25", 64511), ("198.51.100.0/24", 64510), ("203.0.113.0/24", 64500),
+      ("203.0.113.0/24", 64501), ("2001:db8:1::/48", 64496), ("2001:db8:2::/48", 64497)},
+     {("192.0.2.0/24", 64511, 24), ("203.0.113.0/24", 64500, 24), ("2001:db8::/32", 64496, 48)}),
+    # maxLengthが変わる、VRPのASが増える、経路が消える・増える
+    ({("192.0.2.0/24", 64511), ("192.0.2.128/25", 64511), ("198.51.100.0/24", 64510), ("203.0.113.0/24", 64500),
+      ("203.0.113.0/24", 64501), ("2001:db8:1::/48", 64496), ("2001:db8:3::/48", 64496)},
+     {("192.0.2.0/24", 64511, 25), ("203.0.113.0/24", 64500, 24), ("2001:db8::/32", 64496, 48),
+      ("198.51.100.0/22", 64510, 24)}),
+    # VRPsは同じで経路だけ変わる
+    ({("192.0.2.0/24", 64511), ("192.0.2.0/24", 64499), ("198.51.100.0/24", 64510), ("203.0.113.0/24", 64501),
+      ("2001:db8:1::/48", 64496), ("2001:db8:3::/48", 64496)},
+     None),
+    # VRPから消えるAS
+    (None,
+     {("192.0.2.0/24", 64511, 25), ("2001:db8::/32", 64496, 48), ("198.51.100.0/22", 64510, 24)}),
+]
+
+
+# スナップショットごとにトライとRIBを作りなおして、check_all_asn_in_vrps()で全部ROVする
+def full_check(rib_routes, vrp_tuples, tmp_path):
+    vrps = VrpTrie.from_vrps(vrp_tuples)
+    rib = RibTable.from_routes([(prefix, origin_asn, 1) for prefix, origin_asn in rib_routes])
+    with roamon_verify_output.open_writer("tsv", str(tmp_path / "full.tsv")) as writer:
+        return roamon_verify_checker.check_all_asn_in_vrps(vrps, rib, writer=writer)
+
+
+def test_history_state_matches_full_check(tmp_path):
+    state = HistoryState()
+    rib_routes, vrp_tuples = None, None
+    for snapshot_rib_routes, snapshot_vrp_tuples in SNAPSHOTS:
+        state.apply(snapshot_rib_routes, snapshot_vrp_tuples)
+        rib_routes = snapshot_rib_routes or rib_routes
+        vrp_tuples = snapshot_vrp_tuples or vrp_tuples
+
+        table = full_check(rib_routes, vrp_tuples, tmp_path)
+        assert state.results == {(row.roved_prefix, row.advertising_asn): row.rov_result for _, row in table.rows()}
+        assert state.total_counts == [table.count(rov_result) for rov_result in SUMMARY_RESULTS]
+        for asn in table:
+            assert state.asn_counts.get(asn, [0] * len(SUMMARY_RESULTS)) == \
+                [table.count(rov_result, asn) for rov_result in SUMMARY_RESULTS]
+        state.pop_changed_asn_counts({})
@@ -0,0 +1,116 @@
+# encoding: UTF-8
+
+# roamon_verify_incrementalのテスト
+
+import io
+import random
+
+import pytest
+
+import roamon_verify_checker
+import roamon_verify_incremental
+import roamon_verify_output
+from roamon_verify_incremental import PrefixSpace
+from roamon_verify_index import VrpTrie
+from roamon_verify_snapshot import RibTable
+
+VRPS_BEFORE = [("192.0.2.0/24", 64511, 24), ("203.0.113.0/24", 64500, 24), ("2001:db8::/32", 64496, 48)]
+ROUTES_BEFORE = [("192.0.2.0/24", 64511, 1), ("192.0.2.128/25", 64511, 1), ("198.51.100.0/24", 64510, 1),
+                 ("203.0.113.0/24", 64500, 2), ("203.0.113.0/24", 64501, 1), ("2001:db8:1::/48", 64496, 1),
+                 ("2001:db8:2::/48", 64496, 1)]
+# maxLengthの変更、VRPの追加(新しいAS)と削除、経路の追加と削除、ピア数だけの変化
+VRPS_AFTER = [("192.0.2.0/24", 64511, 25), ("198.51.100.0/22", 64510, 24), ("2001:db8::/32", 64496, 48)]
+ROUTES_AFTER = [("192.0.2.0/24", 64511, 1), ("192.0.2.128/25", 64511, 1), ("198.51.100.0/24", 64510, 1),
+                ("203.0.113.0/24", 64500, 1), ("2001:db8:1::/48", 64496, 3), ("2001:db8:3::/48", 64496, 1),
+                ("2001:db8:3::/48", 64499, 1)]
+
+
+def random_prefixes(rng, n):
+    prefixes = set()
+    while len(prefixes) < n:
+        if rng.random() < 0.7:
+            prefixlen = rng.randint(8, 24)
+            network_int = rng.getrandbits(prefixlen) << (32 - prefixlen)
+            prefixes.add("{}.{}.{}.{}/{}".format(network_int >> 24, network_int >> 16 & 255, network_int >> 8 & 255,
+                                                  network_int & 255, prefixlen))
+        else:
+            prefixlen = rng.randint(32, 48)
+            network_int = (0x20010db8 << 16 | rng.getrandbits(16)) >> (48 - prefixlen) << (48 - prefixlen)
+            prefixes.add("{:x}:{:x}:{:x}::/{}".format(network_int >> 32, network_int >> 16 & 0xffff,
+                                                       network_int & 0xffff, prefixlen))
+    return prefixes
+
+
+# 1件ずつ挿入・削除する場合 (変化が少ない) と、併合する場合 (変化が多い) の両方
+@pytest.mark.parametrize("n_changes", [3, 10, 150])
+def test_prefix_space_update_matches_rebuild(n_changes):
+    rng = random.Random(n_changes)
+    pool = sorted(random_prefixes(rng, 1500))
+    current = set(rng.sample(pool, 600))
+    prefix_space = PrefixSpace(current)
+    queries = ["0.0.0.0/0", "::/0", "2001:db8::/32"] + rng.sample(pool, 50)
+
+    for _ in range(5):
+        removed = rng.sample(sorted(current), n_changes)
+        added = rng.sample(sorted(set(pool) - current), n_changes)
+        prefix_space.update(added, removed)
+        current = (current - set(removed)) | set(added)
+
+        rebuilt = PrefixSpace(current)
+        for query in queries:
+            assert prefix_space.covered(query) == rebuilt.covered(query)
+        assert sorted(prefix_space.covered("0.0.0.0/0") + prefix_space.covered("::/0")) == sorted(current)
+
+
+# check_all_asn_in_vrps()で全部ROVした結果 {(prefix, Origin AS): RovResult}
+def full_results(vrps, rib, tmp_path):
+    with roamon_verify_output.open_writer("tsv", str(tmp_path / "full.tsv")) as writer:
+        table = roamon_verify_checker.check_all_asn_in_vrps(vrps, rib, writer=writer)
+    return {(row.roved_prefix, row.advertising_asn): row.rov_result for _, row in table.rows()}
+
+
+def run_incremental(vrps, rib, file_path_state, tmp_path):
+    change_stream = io.StringIO()
+    with roamon_verify_output.open_writer("tsv", str(tmp_path / "incremental.tsv")) as writer:
+        results, _ = roamon_verify_incremental.check_all_asn_in_vrps_incremental(vrps, rib, file_path_state, writer,
+                                                                                 change_stream=change_stream)
+    return results, change_stream.getvalue().splitlines()
+
+
+def test_incremental_run_matches_full_run(tmp_path):
+    file_path_state = str(tmp_path / "state.pickle")
+    vrps, rib = VrpTrie.from_vrps(VRPS_BEFORE), RibTable.from_routes(ROUTES_BEFORE)
+    results, changes = run_incremental(vrps, rib, file_path_state, tmp_path)
+    before = full_results(vrps, rib, tmp_path)
+    assert results == before
+    # 状態が無ければ全部の結果が追加として出る
+    assert sorted(changes) == sorted("{}\t{}\t-\t{}".format(asn, prefix, rov_result)
+                                     for (prefix, asn), rov_result in before.items())
+    state = roamon_verify_incremental.load_state(file_path_state)
+    assert state["vrps"] == set(VRPS_BEFORE)
+    assert state["rib"] == set((prefix, asn) for prefix, asn, _ in ROUTES_BEFORE)
+
+    vrps, rib = VrpTrie.from_vrps(VRPS_AFTER), RibTable.from_routes(ROUTES_AFTER)
+    results, changes = run_incremental(vrps, rib, file_path_state, tmp_path)
+    after = full_results(vrps, rib, tmp_path)
+    assert results == after
+    expected_changes = sorted("{}\t{}\t{}\t{}".format(asn, prefix, before.get((prefix, asn)) or "-",
+                                                      after.get((prefix, asn)) or "-")
+                              for prefix, asn in set(before) | set(after)
+                              if before.get((prefix, asn)) != after.get((prefix, asn)))
+    assert expected_changes
+    assert sorted(changes) == expected_changes
+
+    # 何も変わらなければ変化は無い
+    assert run_incremental(vrps, rib, file_path_state, tmp_path) == (after, [])
+
+
+def test_state_with_other_format_version_is_ignored(tmp_path, monkeypatch):
+    file_path_state = str(tmp_path / "state.pickle")
+    vrps, rib = VrpTrie.from_vrps(VRPS_BEFORE), RibTable.from_routes(ROUTES_BEFORE)
+    run_incremental(vrps, rib, file_path_state, tmp_path)
+    monkeypatch.setattr(roamon_verify_incremental, "STATE_FORMAT_VERSION",
+                        roamon_verify_incremental.STATE_FORMAT_VERSION + 1)
+    assert roamon_verify_incremental.load_state(file_path_state) is None
+    _, changes = run_incremental(vrps, rib, file_path_state, tmp_path)
+    assert len(changes) == len(full_results(vrps, rib, tmp_path))
@@ -0,0 +1,70 @@
+# encoding: UTF-8
+
+# roamon_verify_indexのテスト
+
+import threading
+
+import pytest
+
+from roamon_verify_index import VrpTrie, parse_prefix
+
+
+def test_parse_prefix():
+    assert parse_prefix("203.0.113.5/24") == (4, 0xCB007100, 24)
+    assert parse_prefix("2001:db8::1") == (6, 0x20010DB8000000000000000000000001, 128)
+
+
+@pytest.mark.parametrize("prefix", ["foo", "192.0.2.0/33", "2001:db8::zz/32", "192.0.2.0/x"])
+def test_parse_prefix_invalid(prefix):
+    with pytest.raises(ValueError):
+        parse_prefix(prefix)
+
+
+def test_add_remove():
+    vrp_trie = VrpTrie.from_vrps([("192.0.2.0/24", 64511, 24), ("192.0.2.0/24", 64496, 25), ("192.0.0.0/16", 64510, 24)])
+    assert vrp_trie.covering_vrps("192.0.2.128/25") == [(16, 64510, 24), (24, 64511, 24), (24, 64496, 25)]
+    vrp_trie.add("192.0.2.0/24", 64511, 24)
+    assert len(vrp_trie) == 3
+    vrp_trie.remove("192.0.2.0/24", 64511, 24)
+    vrp_trie.remove("192.0.2.0/24", 64511, 24)
+    assert vrp_trie.covering_vrps("192.0.2.0/24") == [(16, 64510, 24), (24, 64496, 25)]
+    assert vrp_trie.get_as_prefixes(64511) is None
+    vrp_trie.remove("192.0.2.0/24", 64496, 25)
+    assert vrp_trie.covering_vrps("192.0.2.0/24") == [(16, 64510, 24)]
+    assert sorted(vrp_trie.vrps()) == [("192.0.0.0/16", 64510, 24)]
+
+
+# RTRの差分を当てている間に別のスレッドが検索しても、変わっていないVRPを見落とさず、例外にもならないこと
+def test_lookup_during_updates():
+    stable = ("192.0.2.0/24", 64511, 24)
+    churn = [("192.0.2.0/24", 64496 + i, 24) for i in range(8)] + \
+            [("198.51.{}.0/24".format(i), 64496, 24) for i in range(200)]
+    vrp_trie = VrpTrie.from_vrps(churn[:4] + [stable])
+    stop = threading.Event()
+    errors = []
+
+    def update():
+        while not stop.is_set():
+            for vrp in churn:
+                vrp_trie.add(*vrp)
+            for vrp in churn:
+                vrp_trie.remove(*vrp)
+
+    def lookup():
+        try:
+            for _ in range(3000):
+                if (24, 64511, 24) not in vrp_trie.covering_vrps("192.0.2.0/24"):
+                    errors.append("stable VRP was not found")
+                vrp_trie.entries(4)
+                vrp_trie.prefixes()
+        except Exception as e:
+            errors.append(repr(e))
+
+    updater = threading.Thread(target=update)
+    updater.start()
+    try:
+        lookup()
+    finally:
+        stop.set()
+        updater.join()
+    assert errors == []
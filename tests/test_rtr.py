@@ -0,0 +1,149 @@
+# encoding: UTF-8
+
+# roamon_verify_rtrのテスト。tools/rtr_replay_server.pyで、VRPsの列から作った記録を再生してキャッシュの代わりにする
+
+import threading
+
+import pytest
+
+import roamon_verify_rtr
+from roamon_verify_checker import validate_route
+from roamon_verify_index import VrpTrie, parse_prefix
+from roamon_verify_snapshot import RibTable
+from roamon_verify_vrps import write_vrps_file
+from tools.rtr_replay_server import ReplayHandler, ReplayServer, build_replay_file
+
+VRP_SETS = [
+    {("192.0.2.0/24", 64511, 24), ("203.0.113.0/24", 64500, 24), ("2001:db8::/32", 64496, 48)},
+    # maxLengthの変更(取り消しと追加)、VRPの取り消しと追加
+    {("192.0.2.0/24", 64511, 25), ("198.51.100.0/22", 64510, 24), ("2001:db8::/32", 64496, 48)},
+    # AS0のVRPと、別のASのVRP
+    {("192.0.2.0/24", 64511, 25), ("198.51.100.0/22", 64510, 24), ("203.0.113.0/24", 64501, 24),
+     ("2001:db8::/32", 0, 32)},
+]
+
+ROUTES = [("192.0.2.0/24", 64511, 1), ("192.0.2.128/25", 64511, 1), ("198.51.100.0/24", 64510, 1),
+          ("198.51.100.0/24", 64999, 1), ("203.0.113.0/24", 64500, 1), ("203.0.113.0/24", 64501, 1),
+          ("2001:db8::/32", 64496, 1), ("2001:db8:1::/48", 64496, 1), ("2001:db8:1::/48", 64497, 1)]
+
+
+@pytest.fixture
+def replay(tmp_path):
+    servers = []
+
+    def start(version=roamon_verify_rtr.LATEST_PROTOCOL_VERSION):
+        file_paths_vrps = []
+        for idx, vrp_set in enumerate(VRP_SETS):
+            file_path_vrps = str(tmp_path / "vrps_{}.tsv".format(idx))
+            write_vrps_file(sorted(vrp_set), file_path_vrps)
+            file_paths_vrps.append(file_path_vrps)
+        file_path_replay = str(tmp_path / "replay_v{}.rtr".format(version))
+        build_replay_file(file_path_replay, file_paths_vrps, version)
+
+        server = ReplayServer(("127.0.0.1", 0), ReplayHandler)
+        server.responses = roamon_verify_rtr.read_recorded_responses(file_path_replay)
+        server.notify_interval = 60
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server.server_address, file_path_replay
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+# RIBを全部検証しなおした結果 {(prefix, Origin AS): RovResult}
+def full_rov(vrps, rib):
+    return {(prefix, origin_asn): validate_route(vrps, *parse_prefix(prefix), origin_asn)
+            for prefix, origin_asn, _ in rib.routes()}
+
+
+def test_sync_resets_then_applies_serial_deltas(replay, tmp_path, monkeypatch):
+    (host, port), file_path_replay = replay()
+    queries = []
+    encode_reset_query = roamon_verify_rtr.encode_reset_query
+    encode_serial_query = roamon_verify_rtr.encode_serial_query
+    monkeypatch.setattr(roamon_verify_rtr, "encode_reset_query",
+                        lambda *args: queries.append("reset") or encode_reset_query(*args))
+    monkeypatch.setattr(roamon_verify_rtr, "encode_serial_query",
+                        lambda *args: queries.append(("serial", args[2])) or encode_serial_query(*args))
+
+    file_path_record = str(tmp_path / "record.rtr")
+    client = roamon_verify_rtr.RtrClient(host, port, record_path=file_path_record)
+    client.connect()
+    try:
+        changes = client.sync()
+        assert sorted(changes) == sorted((True,) + vrp for vrp in VRP_SETS[0])
+        assert set(client.vrps.vrps()) == VRP_SETS[0]
+        assert (client.session_id, client.serial) == (1, 1)
+        assert client.ready.is_set()
+
+        for serial, (previous, current) in enumerate(zip(VRP_SETS, VRP_SETS[1:]), 2):
+            changes = client.sync()
+            assert sorted(changes) == sorted([(False,) + vrp for vrp in previous - current] +
+                                             [(True,) + vrp for vrp in current - previous])
+            assert set(client.vrps.vrps()) == current
+            assert client.serial == serial
+
+        # 差分を返し終わったら変化なし
+        assert client.sync() == []
+        assert client.serial == len(VRP_SETS)
+    finally:
+        client.close()
+
+    assert queries == ["reset", ("serial", 1), ("serial", 2), ("serial", 3)]
+    # 記録したPDUは再生したものと同じ (変化なしの応答も記録される)
+    recorded = roamon_verify_rtr.read_recorded_responses(file_path_record)
+    assert recorded[:len(VRP_SETS)] == roamon_verify_rtr.read_recorded_responses(file_path_replay)
+
+
+def test_run_falls_back_to_version_0(replay):
+    (host, port), _ = replay(version=0)
+    client = roamon_verify_rtr.RtrClient(host, port)
+    updates = []
+
+    def on_update(changes):
+        updates.append(changes)
+        return False
+
+    client.run(on_update)
+    assert client.version == 0
+    assert len(updates) == 1
+    assert set(client.vrps.vrps()) == VRP_SETS[0]
+    assert client.refresh_interval == roamon_verify_rtr.DEFAULT_REFRESH_INTERVAL
+
+
+def test_sync_raises_unsupported_protocol_version(replay):
+    (host, port), _ = replay(version=0)
+    client = roamon_verify_rtr.RtrClient(host, port)
+    client.connect()
+    try:
+        with pytest.raises(roamon_verify_rtr.RtrError) as error:
+            client.sync()
+    finally:
+        client.close()
+    assert error.value.error_code == roamon_verify_rtr.ERROR_UNSUPPORTED_PROTOCOL_VERSION
+
+
+def test_live_rov_table_revalidate_matches_full_rov(replay):
+    (host, port), _ = replay()
+    rib = RibTable.from_routes(ROUTES)
+    client = roamon_verify_rtr.RtrClient(host, port, vrps=VrpTrie())
+    client.connect()
+    try:
+        client.sync()
+        table = roamon_verify_rtr.LiveRovTable(client.vrps, rib)
+        results = full_rov(client.vrps, rib)
+        for _ in VRP_SETS[1:]:
+            for change in table.revalidate(client.sync()):
+                key = (change.prefix, change.origin_asn)
+                assert results[key] == change.old_rov_result
+                results[key] = change.new_rov_result
+
+            expected = full_rov(client.vrps, rib)
+            assert results == expected
+            assert table.counts() == {rov_result: list(expected.values()).count(rov_result)
+                                      for rov_result in table.counts()}
+    finally:
+        client.close()
@@ -0,0 +1,68 @@
+# encoding: UTF-8
+
+# serveのHTTPの問い合わせのテスト。書式のおかしいprefixなどには、接続を切らずに400を返すこと
+
+import http.client
+import json
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import roamon_verify_server
+
+
+@pytest.fixture
+def server(tmp_path):
+    file_path_vrps = tmp_path / "vrps.dat"
+    file_path_vrps.write_text("192.0.2.0/24\t64511\t24\n")
+    file_path_rib = tmp_path / "rib.dat"
+    file_path_rib.write_text("192.0.2.0/24\t64511\t1\n198.51.100.0/24\t64496\t1\n")
+
+    http_server = ThreadingHTTPServer(("127.0.0.1", 0), roamon_verify_server.RovRequestHandler)
+    http_server.service = roamon_verify_server.RovService(str(file_path_vrps), str(file_path_rib))
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    yield http_server
+    http_server.shutdown()
+    http_server.server_close()
+
+
+def request(server, method, path, body=None):
+    connection = http.client.HTTPConnection(*server.server_address, timeout=10)
+    try:
+        connection.request(method, path, body=body)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def test_rov(server):
+    status, results = request(server, "GET", "/rov?ip=192.0.2.0/24")
+    assert status == 200
+    assert results[0]["rov_result"] == "VALID"
+
+
+@pytest.mark.parametrize("path", ["/rov?ip=foo", "/rov?ip=192.0.2.0/33", "/rov?ip=2001:db8::zz/32",
+                                  "/rov_with_asn?asn=AS-foo"])
+def test_get_bad_input(server, path):
+    status, body = request(server, "GET", path)
+    assert status == 400
+    assert "error" in body
+
+
+@pytest.mark.parametrize("body", ['{"ip": "foo"}', '{"ip": ["foo"]}', '{"ip": [1]}', '{"asn": "64511"}',
+                                  '{"asn": [null]}', '["192.0.2.0/24"]', 'not json'])
+def test_batch_bad_input(server, body):
+    status, response = request(server, "POST", "/batch", body.encode("utf-8"))
+    assert status == 400
+    assert "error" in response
+
+
+def test_batch(server):
+    body = json.dumps({"ip": ["198.51.100.0/24"], "asn": ["64511"]}).encode("utf-8")
+    status, response = request(server, "POST", "/batch", body)
+    assert status == 200
+    assert response["ip"][0]["rov_result"] == "NOT_FOUND"
+    assert len(response["asn"]) == 1
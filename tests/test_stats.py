@@ -0,0 +1,40 @@
+# encoding: UTF-8
+
+# roamon_verify_stats(--stats)のテスト
+
+import time
+
+import pytest
+
+import roamon_verify_stats
+
+
+@pytest.fixture
+def run_stats():
+    run_stats = roamon_verify_stats.enable("test")
+    yield run_stats
+    roamon_verify_stats.disable()
+
+
+# ワーカーで測った時間を渡された要素は、親が待った時間ではなくその時間をASのコストにする
+def test_worker_item_seconds(run_stats):
+    def results():
+        roamon_verify_stats.set_worker_item_seconds(1.5)
+        yield "64511"
+        time.sleep(0.01)
+        yield "64496"
+
+    for asn in roamon_verify_stats.timed(results(), "validate"):
+        roamon_verify_stats.record_asn_cost(asn, 1)
+    assert run_stats.asn_costs["64511"] == [1.5, 1]
+    assert 0.01 <= run_stats.asn_costs["64496"][0] < 1.5
+    assert run_stats.phase_seconds["validate"] < 1.5
+
+
+def test_disable_asn_costs(run_stats):
+    roamon_verify_stats.disable_asn_costs("validated at once")
+    for asn in roamon_verify_stats.timed(["64511"], "validate"):
+        roamon_verify_stats.record_asn_cost(asn, 1)
+    summary = run_stats.summary()
+    assert summary["top_asns"] == []
+    assert "not available (validated at once)" in roamon_verify_stats.format_summary(summary)
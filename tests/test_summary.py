@@ -0,0 +1,60 @@
+# encoding: UTF-8
+
+# roamon_verify_summary(rov --summaryとreport)のテスト
+
+import pytest
+
+import roamon_verify_summary
+from roamon_verify_checker import AsnRovResultStruct, PrefixRovResultStruct, RovResult
+from roamon_verify_index import VrpTrie
+
+
+def asn_result(asn, results):
+    return AsnRovResultStruct(asn, {prefix: PrefixRovResultStruct(prefix, prefix, int(asn), rov_result)
+                                    for prefix, rov_result in results})
+
+
+@pytest.fixture
+def file_path_summary(tmp_path):
+    vrps = VrpTrie.from_vrps([("192.0.2.0/24", 64511, 24), ("203.0.113.0/24", 64511, 24),
+                              ("198.51.100.0/24", 64496, 24), ("10.0.0.0/8", 64500, 8)])
+    summary = roamon_verify_summary.AsnRovSummary(vrps)
+    summary.add(asn_result(64496, [("198.51.100.0/25", RovResult.INVALID)]))
+    summary.add(asn_result(64500, []))
+    summary.add(asn_result(64511, [("192.0.2.0/24", RovResult.VALID), ("192.0.2.0/25", RovResult.INVALID),
+                                   ("172.16.0.0/16", RovResult.NOT_FOUND)]))
+    file_path_summary = str(tmp_path / "summary.sqlite")
+    summary.write(file_path_summary)
+    return file_path_summary
+
+
+def test_counts(file_path_summary):
+    with roamon_verify_summary.SummaryDB(file_path_summary) as summary_db:
+        records = summary_db.query("invalid")
+    assert records == [
+        {"asn": 64496, "routes": 1, "valid": 0, "invalid": 1, "not_found": 0, "not_advertised": 1, "coverage": 1.0},
+        {"asn": 64511, "routes": 3, "valid": 1, "invalid": 1, "not_found": 1, "not_advertised": 1,
+         "coverage": 2 / 3},
+        {"asn": 64500, "routes": 0, "valid": 0, "invalid": 0, "not_found": 0, "not_advertised": 1, "coverage": None},
+    ]
+
+
+def test_query(file_path_summary):
+    with roamon_verify_summary.SummaryDB(file_path_summary) as summary_db:
+        assert [record["asn"] for record in summary_db.query("routes", limit=1)] == [64511]
+        assert [record["asn"] for record in summary_db.query(any_invalid=True)] == [64496, 64511]
+        assert [record["asn"] for record in summary_db.query(asns=["AS64511", "as64500", "64496"])] == \
+            [64496, 64511, 64500]
+        with pytest.raises(ValueError):
+            summary_db.query("asn; DROP TABLE asn_summary")
+
+
+def test_missing_file(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        roamon_verify_summary.SummaryDB(str(tmp_path / "none.sqlite"))
+    assert not (tmp_path / "none.sqlite").exists()
+
+
+def test_does_have_rov_failed_prefix():
+    assert asn_result("64511", [("192.0.2.0/24", RovResult.INVALID)]).does_have_rov_failed_prefix()
+    assert not asn_result("64511", [("192.0.2.0/24", RovResult.VALID)]).does_have_rov_failed_prefix()
@@ -0,0 +1,96 @@
+# encoding: UTF-8
+
+# roamon_verify_updatesのテスト
+# tests/data/updates.mrt (BGP4MP) と tests/data/updates_exabgp.json (ExaBGPのJSON) は同じUPDATEの列を記録したもの
+# 取り消し、広告し直し、Origin ASの変化、AS_PATHだけの変化、IPv6、ピアのセッション断を含む
+
+import os
+
+import pytest
+
+import roamon_verify_updates
+from roamon_verify_checker import validate_route
+from roamon_verify_index import VrpTrie, parse_prefix
+from roamon_verify_snapshot import RibTable
+
+DIR_PATH_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+FILE_PATH_MRT = os.path.join(DIR_PATH_DATA, "updates.mrt")
+FILE_PATH_EXABGP = os.path.join(DIR_PATH_DATA, "updates_exabgp.json")
+
+VRPS = [("192.0.2.0/23", 64511, 24), ("203.0.113.0/24", 64500, 24), ("2001:db8::/32", 64496, 48)]
+
+# UPDATEを当てる前の (prefix, ピア, Origin AS)
+INITIAL_PEER_ROUTES = [("192.0.2.0/24", "198.51.100.1", 64511),
+                       ("192.0.2.0/24", "198.51.100.2", 64511),
+                       ("192.0.3.0/24", "198.51.100.1", 64511),
+                       ("203.0.113.0/24", "198.51.100.1", 64500),
+                       ("2001:db8:1::/48", "198.51.100.2", 64496)]
+
+# 全部当てた後の (prefix, Origin AS, ピア数)
+FINAL_ROUTES = [("192.0.2.0/24", 64511, 1),
+                ("192.0.2.128/25", 64511, 1),
+                ("192.0.3.0/24", 64511, 1),
+                ("2001:db8:2::/48", 64511, 1),
+                ("203.0.113.0/24", 64501, 1)]
+
+
+def read_events(kind):
+    if kind == "mrt":
+        return list(roamon_verify_updates.iter_mrt_update_events([FILE_PATH_MRT]))
+    with open(FILE_PATH_EXABGP) as f:
+        return list(roamon_verify_updates.iter_exabgp_events(f))
+
+
+# RIBを作り直して全部の経路を検証する。{(prefix, Origin AS): RovResult}
+def full_rov(vrps, routes):
+    rib = RibTable.from_routes(routes)
+    results = {}
+    for prefix, origin_asn, _ in rib.routes():
+        results[(prefix, origin_asn)] = validate_route(vrps, *parse_prefix(prefix), origin_asn)
+    return results
+
+
+def test_recorded_mrt_and_exabgp_are_the_same_updates():
+    assert read_events("mrt") == read_events("exabgp")
+
+
+@pytest.mark.parametrize("kind", ["mrt", "exabgp"])
+@pytest.mark.parametrize("batch_size", [1, 4, 1000])
+def test_replay_matches_full_rebuild(kind, batch_size):
+    vrps = VrpTrie.from_vrps(VRPS)
+    live_rib = roamon_verify_updates.LiveRib.from_peer_routes(INITIAL_PEER_ROUTES)
+    initial_results = full_rov(vrps, live_rib.routes())
+
+    # 変化を前の結果に順に当てていくと、作り直して検証したものと同じになる
+    results = dict(initial_results)
+    for batch in roamon_verify_updates.iter_batches(read_events(kind), batch_size=batch_size, batch_interval=3600):
+        for change in roamon_verify_updates.apply_updates(vrps, live_rib, batch):
+            key = (change.prefix, change.origin_asn)
+            assert results.get(key) == change.old_rov_result
+            if change.new_rov_result is None:
+                del results[key]
+            else:
+                results[key] = change.new_rov_result
+
+    assert sorted(live_rib.routes()) == FINAL_ROUTES
+    assert live_rib.peer_count() == 2
+    assert results == full_rov(vrps, FINAL_ROUTES)
+    assert results != initial_results
+
+
+def test_replay_in_one_batch_reports_only_net_changes():
+    vrps = VrpTrie.from_vrps(VRPS)
+    live_rib = roamon_verify_updates.LiveRib.from_peer_routes(INITIAL_PEER_ROUTES)
+    initial_results = full_rov(vrps, live_rib.routes())
+    events = [event for events in read_events("mrt") for event in events]
+
+    changes = roamon_verify_updates.apply_updates(vrps, live_rib, events)
+
+    final_results = full_rov(vrps, FINAL_ROUTES)
+    expected = sorted((key, initial_results.get(key), final_results.get(key))
+                      for key in set(initial_results) | set(final_results)
+                      if initial_results.get(key) != final_results.get(key))
+    assert sorted(((change.prefix, change.origin_asn), change.old_rov_result, change.new_rov_result)
+                  for change in changes) == expected
+    # 取り消して広告し直した192.0.3.0/24は変化に出ない
+    assert "192.0.3.0/24" not in set(change.prefix for change in changes)
@@ -0,0 +1,140 @@
+# encoding: UTF-8
+
+# Copyright (c) 2019-2020 Japan Network Information Center ("JPNIC")
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute and/or sublicense of
+# the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# RouteViewsのアーカイブ(archive.routeviews.org)の代わりになる、試験用のHTTPサーバ
+# ディレクトリの中身をそのまま配る(ディレクトリなら一覧のページを返す)。Rangeヘッダに対応しているので、
+# getのダウンロードの再開やサイズの確かめ方を、本物のアーカイブにつながなくても手元で試せる
+#
+#   python tools/archive_stand_in_server.py /path/to/archive --port 8000
+#   (config.iniに routeviews_archive_url = http://127.0.0.1:8000/ と書く)
+#
+# わざとおかしな応答を返して、失敗したときの動きも確かめられる
+#   --truncate BYTES      ファイルごとに最初の1回だけ、本文をBYTESバイト送ったところで接続を切る (ダウンロードの中断)
+#   --ignore-range        Rangeヘッダを無視して、いつも200で全部を返す (Rangeに対応していないサーバ)
+#   --omit-content-range  416の応答にContent-Rangeヘッダを付けない
+
+import argparse
+import functools
+import logging
+import os
+import re
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8000
+
+_RANGE_PATTERN = re.compile(r"bytes=(\d+)-(\d*)$")
+
+
+class ArchiveHandler(SimpleHTTPRequestHandler):
+    def do_GET(self):
+        file_path = self.translate_path(self.path)
+        if not os.path.isfile(file_path):
+            # ディレクトリの一覧や404はSimpleHTTPRequestHandlerにまかせる
+            super().do_GET()
+            return
+
+        size = os.path.getsize(file_path)
+        start, end = 0, size - 1
+        matched = _RANGE_PATTERN.match(self.headers.get("Range", ""))
+        if matched is not None and not self.server.ignore_range:
+            start = int(matched.group(1))
+            if matched.group(2):
+                end = min(int(matched.group(2)), size - 1)
+            if start >= size:
+                self.send_response(416)
+                if not self.server.omit_content_range:
+                    self.send_header("Content-Range", "bytes */{}".format(size))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end, size))
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+        with open(file_path, "rb") as f:
+            f.seek(start)
+            body = f.read(end - start + 1)
+        if self.server.should_truncate(file_path):
+            # Content-Lengthより短いところで接続を切る
+            self.wfile.write(body[:self.server.truncate])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.info("%s - %s", self.address_string(), format % args)
+
+
+class ArchiveServer(ThreadingHTTPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, server_address, directory, truncate=None, ignore_range=False, omit_content_range=False):
+        super().__init__(server_address, functools.partial(ArchiveHandler, directory=directory))
+        self.truncate = truncate
+        self.ignore_range = ignore_range
+        self.omit_content_range = omit_content_range
+        self._truncated = set()
+        self._lock = threading.Lock()
+
+    # このファイルの応答を途中で切るか。--truncateのときは、ファイルごとに最初の1回だけ切る
+    def should_truncate(self, file_path):
+        if self.truncate is None:
+            return False
+        with self._lock:
+            if file_path in self._truncated:
+                return False
+            self._truncated.add(file_path)
+            return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="serve a directory as a stand-in for archive.routeviews.org")
+    parser.add_argument("directory")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--truncate", type=int, metavar="BYTES",
+                        help="close the connection after BYTES bytes of the first response for each file")
+    parser.add_argument("--ignore-range", action="store_true", help="ignore Range headers and always answer 200")
+    parser.add_argument("--omit-content-range", action="store_true", help="answer 416 without Content-Range")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    server = ArchiveServer((args.host, args.port), args.directory, args.truncate, args.ignore_range,
+                           args.omit_content_range)
+    logger.info("serving {} on http://{}:{}/".format(args.directory, args.host, args.port))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
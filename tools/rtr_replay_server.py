@@ -0,0 +1,171 @@
+# encoding: UTF-8
+
+# Copyright (c) 2019-2020 Japan Network Information Center ("JPNIC")
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute and/or sublicense of
+# the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# 記録したRTRのPDUを再生する、試験用のRTRキャッシュの代わり
+# routinatorなどを用意しなくても、rtrサブコマンドやserve --rtrの動きを手元で確かめられる
+#
+#   build: VRPsのファイルを順に並べて、1つめを全部(Reset Queryへの応答)、2つめ以降を1つ前からの差分にした記録ファイルを作る
+#     python tools/rtr_replay_server.py build replay.rtr vrps_1.csv vrps_2.csv vrps_3.csv
+#   serve: 記録ファイル(これで作ったものか、rtrサブコマンドの--recordで記録したもの)を再生する
+#     python tools/rtr_replay_server.py serve replay.rtr --port 3323 --notify-interval 5
+#
+# Reset Queryには1つめの応答を、Serial Queryには次の差分を順番に返す。まだ返していない差分があれば、
+# 前の応答からnotify-interval秒後にSerial Notifyを送る。差分を返し終わったら、変化なしの応答を返す
+# 記録と違うプロトコルのバージョンで問い合わせられたら、Unsupported Protocol VersionのError Reportを返す
+
+import argparse
+import logging
+import os
+import select
+import socketserver
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import roamon_verify_rtr as rtr
+from roamon_verify_vrps import read_vrps_file
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 3323
+DEFAULT_SESSION_ID = 1
+DEFAULT_NOTIFY_INTERVAL = 5.0
+
+
+# VRPsのファイルの列から記録ファイルを作る
+def build_replay_file(file_path_replay, file_paths_vrps, version=rtr.LATEST_PROTOCOL_VERSION,
+                      session_id=DEFAULT_SESSION_ID):
+    previous = set()
+    with open(file_path_replay, "wb") as f:
+        for serial, file_path_vrps in enumerate(file_paths_vrps, 1):
+            current = set(read_vrps_file(file_path_vrps))
+            pdus = [rtr.encode_pdu(version, rtr.PDU_CACHE_RESPONSE, session_id)]
+            pdus += [rtr.encode_prefix(version, False, prefix, asn, max_length)
+                     for prefix, asn, max_length in sorted(previous - current)]
+            pdus += [rtr.encode_prefix(version, True, prefix, asn, max_length)
+                     for prefix, asn, max_length in sorted(current - previous)]
+            pdus.append(rtr.encode_end_of_data(version, session_id, serial))
+            f.write(b"".join(pdus))
+            logger.info("serial {}: {} withdrawn, {} announced".format(serial, len(previous - current),
+                                                                     len(current - previous)))
+            previous = current
+
+
+# 応答のバイト列から (バージョン, Session ID, シリアル番号, 変化なしの応答) を取り出す
+def _describe_response(response):
+    pdus = list(rtr.iter_pdus(response))
+    version, _, session_id, _, cache_response = pdus[0]
+    _, _, _, end_of_data_body, end_of_data = pdus[-1]
+    serial, = struct.unpack_from("!I", end_of_data_body)
+    return version, session_id, serial, cache_response + end_of_data
+
+
+class ReplayHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        sock = self.request
+        responses = self.server.responses
+        version, session_id, _, _ = _describe_response(responses[0])
+        # 次に返す差分の番号。Reset Queryを受けるまではNone
+        position = None
+        notify_pending = False
+        logger.info("client {} connected".format(self.client_address))
+        while True:
+            timeout = self.server.notify_interval if notify_pending else None
+            readable, _, _ = select.select([sock], [], [], timeout)
+            if not readable:
+                _, _, serial, _ = _describe_response(responses[position])
+                sock.sendall(rtr.encode_pdu(version, rtr.PDU_SERIAL_NOTIFY, session_id, struct.pack("!I", serial)))
+                notify_pending = False
+                continue
+            try:
+                query_version, pdu_type, _, _, raw = rtr.read_pdu(sock)
+            except (ConnectionError, rtr.RtrError):
+                logger.info("client {} disconnected".format(self.client_address))
+                return
+
+            if query_version != version:
+                sock.sendall(rtr.encode_error_report(version, rtr.ERROR_UNSUPPORTED_PROTOCOL_VERSION, raw,
+                                                     "only protocol version {} is replayed".format(version)))
+                return
+            if pdu_type == rtr.PDU_RESET_QUERY:
+                sock.sendall(responses[0])
+                position = 1
+            elif pdu_type == rtr.PDU_SERIAL_QUERY and position is None:
+                sock.sendall(rtr.encode_pdu(version, rtr.PDU_CACHE_RESET, 0))
+                continue
+            elif pdu_type == rtr.PDU_SERIAL_QUERY and position < len(responses):
+                sock.sendall(responses[position])
+                position += 1
+            elif pdu_type == rtr.PDU_SERIAL_QUERY:
+                sock.sendall(_describe_response(responses[-1])[3])
+            else:
+                sock.sendall(rtr.encode_error_report(version, rtr.ERROR_UNSUPPORTED_PDU_TYPE, raw,
+                                                     "unsupported PDU type"))
+                continue
+            logger.info("answered PDU type {} from {} (next delta {}/{})".format(
+                pdu_type, self.client_address, position, len(responses) - 1))
+            notify_pending = position < len(responses)
+
+
+class ReplayServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="replay recorded RTR PDUs as a stand-in RTR cache")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_build = subparsers.add_parser("build", help="build a replay file from VRP files")
+    parser_build.add_argument("replay_file")
+    parser_build.add_argument("vrps_files", nargs="+", metavar="vrps_file")
+    parser_build.add_argument("--version", type=int, default=rtr.LATEST_PROTOCOL_VERSION, choices=[0, 1],
+                              help="RTR protocol version (default: {})".format(rtr.LATEST_PROTOCOL_VERSION))
+    parser_build.add_argument("--session-id", type=int, default=DEFAULT_SESSION_ID)
+
+    parser_serve = subparsers.add_parser("serve", help="serve a replay file")
+    parser_serve.add_argument("replay_file")
+    parser_serve.add_argument("--host", default="127.0.0.1")
+    parser_serve.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser_serve.add_argument("--notify-interval", type=float, default=DEFAULT_NOTIFY_INTERVAL,
+                              help="seconds before sending serial notify for the next delta (default: {})".format(
+                                  DEFAULT_NOTIFY_INTERVAL))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    if args.command == "build":
+        build_replay_file(args.replay_file, args.vrps_files, args.version, args.session_id)
+        return
+
+    server = ReplayServer((args.host, args.port), ReplayHandler)
+    server.responses = rtr.read_recorded_responses(args.replay_file)
+    server.notify_interval = args.notify_interval
+    logger.info("replaying {} responses on {}:{}".format(len(server.responses), args.host, args.port))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()